@@ -0,0 +1,5 @@
+# Load the Celery app whenever Django starts so that tasks published from the
+# web process use the CELERY_* settings and the agent gateway task routes.
+from .celery import app as celery_app
+
+__all__ = ('celery_app',)
@@ -1,19 +1,67 @@
 import logging
 from django.contrib import admin
-from .models import AgentTrigger
+from django.template.response import TemplateResponse
+from django.urls import path
+from .metrics import collect
+from .models import AgentTrigger, TriggerFiring
 
 logger = logging.getLogger(__name__)
 
 @admin.register(AgentTrigger)
 class AgentTriggerAdmin(admin.ModelAdmin):
-    list_display = ('name', 'trigger_type', 'active', 'last_triggered')
-    list_filter = ('trigger_type', 'active')
+    list_display = ('name', 'trigger_type', 'active', 'rate_limit', 'pattern_risk', 'quarantined_at', 'last_triggered', 'next_fire_at')
+    list_filter = ('trigger_type', 'active', 'pattern_risk', ('quarantined_at', admin.EmptyFieldListFilter))
     search_fields = ('name', 'prompt_pattern')
+    readonly_fields = ('pattern_risk', 'quarantine_reason')
+    actions = ['release_from_quarantine']
 
     def save_model(self, request, obj, form, change):
         logger.info(f"Saving AgentTrigger: {obj.name} by user {request.user.username}")
+        if change and 'prompt_pattern' in form.changed_data and obj.quarantined_at is not None:
+            logger.info(f"Releasing AgentTrigger {obj.name} from quarantine after its pattern changed")
+            obj.quarantined_at = None
+            obj.quarantine_reason = ''
         super().save_model(request, obj, form, change)
 
+    @admin.action(description='Release selected triggers from quarantine')
+    def release_from_quarantine(self, request, queryset):
+        for trigger in queryset.filter(quarantined_at__isnull=False):
+            trigger.quarantined_at = None
+            trigger.quarantine_reason = ''
+            trigger.save(update_fields=['quarantined_at', 'quarantine_reason'])
+            logger.info(f"AgentTrigger {trigger.name} released from quarantine by user {request.user.username}")
+
+    def get_urls(self):
+        urls = [path('metrics/', self.admin_site.admin_view(self.metrics_view), name='ai_agent_gateway_agenttrigger_metrics')]
+        return urls + super().get_urls()
+
+    def metrics_view(self, request):
+        """
+        Shows the p50/p95/p99 timings of every stage and trigger, slowest first.
+        """
+        merged = collect()
+        context = {
+            **self.admin_site.each_context(request),
+            'title': 'Agent gateway metrics',
+            'opts': self.model._meta,
+            'rows': merged.summary(),
+            'counters': sorted(merged.counters.items()),
+        }
+        return TemplateResponse(request, 'admin/ai_agent_gateway/metrics.html', context)
+
     def delete_model(self, request, obj):
         logger.warning(f"Deleting AgentTrigger: {obj.name} by user {request.user.username}")
         super().delete_model(request, obj)
+
+@admin.register(TriggerFiring)
+class TriggerFiringAdmin(admin.ModelAdmin):
+    list_display = ('trigger_name', 'fired_at', 'payload_version', 'count', 'succeeded')
+    list_filter = ('succeeded',)
+    search_fields = ('trigger_name',)
+    raw_id_fields = ('trigger',)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
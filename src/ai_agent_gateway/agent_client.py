@@ -0,0 +1,226 @@
+import logging
+# agent_gateway/agent_client.py
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_STATUS_CODES = frozenset({429, 502, 503, 504})
+
+
+class AgentClientError(Exception):
+    """
+    Raised when an agent call fails after all retries.
+    """
+
+
+class CircuitOpenError(AgentClientError):
+    """
+    Raised without contacting the agent API while the circuit breaker is open.
+    """
+
+
+class CircuitBreaker:
+    """
+    A consecutive-failure circuit breaker.
+
+    After `failure_threshold` consecutive failures the circuit opens and calls
+    fail fast for `reset_timeout` seconds. The first call after that is let
+    through as a probe: success closes the circuit, failure re-opens it.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self._failures = 0
+        self._opened_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        return self._opened_at is not None
+
+    def allow(self):
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if self.clock() - self._opened_at >= self.reset_timeout:
+                # Half-open: let this call through and re-arm the timer so
+                # concurrent callers keep failing fast until it reports back.
+                self._opened_at = self.clock()
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._failures >= self.failure_threshold:
+                if self._opened_at is None:
+                    logger.warning(f"Agent API circuit opened after {self._failures} consecutive failures")
+                self._opened_at = self.clock()
+
+
+class AgentClient:
+    """
+    A pooled, concurrency-limited HTTP client for the agent API.
+
+    One client is meant to live for the whole worker process (see
+    `get_agent_client`): its `requests.Session` keeps connections alive
+    between tasks instead of opening a fresh TCP/TLS connection per call.
+
+    Args:
+        url: The agent API endpoint that action payloads are POSTed to.
+        timeout: Connect/read timeout in seconds for each attempt.
+        max_concurrency: The maximum number of calls in flight at once, which
+            is also the size of the connection pool.
+        max_retries: How many times a failed call is retried.
+        backoff_base: The base delay in seconds for exponential backoff.
+        backoff_max: The maximum backoff delay in seconds.
+        breaker: The `CircuitBreaker` guarding the API.
+    """
+
+    def __init__(self, url, timeout=10.0, max_concurrency=10, max_retries=3,
+                 backoff_base=0.5, backoff_max=10.0, breaker=None, session=None):
+        self.url = url
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.breaker = breaker or CircuitBreaker()
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self.session = session or requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_concurrency, pool_block=True, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def _backoff(self, attempt):
+        """
+        Full-jitter exponential backoff: a random delay up to base * 2**attempt.
+        """
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    @staticmethod
+    def _decode(response):
+        """
+        Returns the body of a successful response: the decoded JSON if it is
+        declared as JSON and parses, else the text, or None if it is empty.
+        The call succeeded either way, so a body that cannot be decoded must
+        not turn it into a failure (and a retry).
+        """
+        if not response.content:
+            return None
+        if 'json' in response.headers.get('Content-Type', ''):
+            try:
+                return response.json()
+            except ValueError:
+                logger.warning(f"Agent API returned invalid JSON with status {response.status_code}")
+        return response.text
+
+    def post(self, payload, retries=None):
+        """
+        POSTs an action payload to the agent API.
+
+        Connection errors, timeouts and 429/5xx responses are retried with
+        jittered backoff; other 4xx responses are not.
+
+        Args:
+            payload: The action payload, sent as JSON.
+            retries: How many times to retry, overriding `max_retries`.
+                Celery tasks pass 0 because they retry the task instead.
+
+        Returns:
+            The decoded JSON response, the text of a non-JSON response, or
+            None for an empty body.
+
+        Raises:
+            CircuitOpenError: If the circuit breaker is open.
+            AgentClientError: If the call still fails after all retries.
+        """
+        retries = self.max_retries if retries is None else retries
+        last_error = None
+        for attempt in range(retries + 1):
+            if attempt:
+                time.sleep(self._backoff(attempt - 1))
+            if not self.breaker.allow():
+                raise CircuitOpenError(f"Agent API circuit is open: {self.url}")
+            try:
+                with self._slots:
+                    response = self.session.post(self.url, json=payload, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                last_error = e
+                self.breaker.record_failure()
+                continue
+            if response.status_code in RETRYABLE_STATUS_CODES or response.status_code >= 500:
+                last_error = AgentClientError(f"Agent API returned {response.status_code}")
+                self.breaker.record_failure()
+                continue
+            self.breaker.record_success()
+            if response.status_code >= 400:
+                raise AgentClientError(f"Agent API rejected the action with {response.status_code}")
+            return self._decode(response)
+        raise AgentClientError(f"Agent API call failed after {retries + 1} attempts: {last_error}")
+
+    def post_many(self, payloads, retries=None):
+        """
+        POSTs many action payloads concurrently, up to `max_concurrency` at a
+        time, so one worker keeps a whole batch of agent calls in flight.
+
+        Returns:
+            A list with, for each payload in order, the response or the
+            exception the call raised.
+        """
+        payloads = list(payloads)
+        if not payloads:
+            return []
+
+        def call(payload):
+            try:
+                return self.post(payload, retries=retries)
+            except Exception as e:
+                return e
+
+        with ThreadPoolExecutor(max_workers=min(self.max_concurrency, len(payloads))) as executor:
+            return list(executor.map(call, payloads))
+
+    def close(self):
+        self.session.close()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_agent_client():
+    """
+    Returns the process-wide `AgentClient`, or None if `AGENT_API_URL` is not
+    configured.
+    """
+    global _client
+    url = getattr(settings, 'AGENT_API_URL', None)
+    if not url:
+        return None
+    with _client_lock:
+        if _client is None or _client.url != url:
+            _client = AgentClient(
+                url,
+                timeout=getattr(settings, 'AGENT_API_TIMEOUT', 10.0),
+                max_concurrency=getattr(settings, 'AGENT_API_MAX_CONCURRENCY', 10),
+                max_retries=getattr(settings, 'AGENT_API_MAX_RETRIES', 3),
+                breaker=CircuitBreaker(
+                    failure_threshold=getattr(settings, 'AGENT_API_CIRCUIT_FAILURES', 5),
+                    reset_timeout=getattr(settings, 'AGENT_API_CIRCUIT_RESET', 30.0),
+                ),
+            )
+        return _client
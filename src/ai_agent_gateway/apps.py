@@ -13,31 +13,50 @@ class AgentGatewayConfig(AppConfig):
         """
         Executes when the Django application is ready.
 
-        Checks if 'celery' is included in the INSTALLED_APPS setting. If it is,
-        this method dynamically configures the Celery Beat schedule to run the
-        `check_scheduled_triggers` and `check_periodic_triggers` tasks every
-        minute using crontab scheduling. This ensures that the trigger checks
-        are performed regularly by the Celery Beat scheduler process.
+        If Celery is installed, this method routes the agent gateway tasks to
+        their dedicated queues (see `routing.configure_routing`) and configures
+        the Celery Beat schedule to run the `check_scheduled_triggers` and
+        `check_periodic_triggers` tasks every minute using crontab scheduling.
+        This ensures that the trigger checks are performed regularly by the
+        Celery Beat scheduler process. With `AGENT_GATEWAY_SCAN_SHARDS` > 1,
+        one entry per shard is scheduled so the scans can run concurrently on
+        several nodes.
         """
         logger.info("Agent Gateway app is ready.")
-        if 'celery' in settings.INSTALLED_APPS:
-            logger.info("Celery is installed, configuring Celery Beat schedule.")
-            from . import tasks
+        from . import checks
+        try:
+            from celery import current_app as celery_app
             from celery.schedules import crontab
-            from celery.beat import crontab_to_periodic
+        except ImportError:
+            logger.warning("Celery is not installed, Celery Beat schedule for agent_gateway will not be configured.")
+            return
 
-            from celery import current_app as celery_app
+        logger.info("Celery is installed, configuring task routes and the Celery Beat schedule.")
+        from . import tasks
+        from .routing import configure_routing
 
-            celery_app.conf.beat_schedule = {
-                'check-scheduled-triggers': {
-                    'task': 'agent_gateway.tasks.check_scheduled_triggers',
-                    'schedule': crontab(minute='*'), # Check every minute
-                },
-                'check-periodic-triggers': {
-                    'task': 'agent_gateway.tasks.check_periodic_triggers',
-                    'schedule': crontab(minute='*'), # Check every minute
-                },
+        configure_routing(celery_app)
+
+        # One entry per shard lets several Beat/worker nodes split the
+        # due triggers between them (see claims.claim_due_triggers).
+        shard_count = getattr(settings, 'AGENT_GATEWAY_SCAN_SHARDS', 1)
+        # A scan that has waited past the next one is redundant; drop it.
+        options = {'expires': 55}
+        beat_schedule = {}
+        for shard in range(shard_count):
+            suffix = f'-{shard}' if shard_count > 1 else ''
+            beat_schedule[f'check-scheduled-triggers{suffix}'] = {
+                'task': 'ai_agent_gateway.tasks.check_scheduled_triggers',
+                'schedule': crontab(minute='*'), # Check every minute
+                'kwargs': {'shard': shard, 'shard_count': shard_count},
+                'options': options,
+            }
+            beat_schedule[f'check-periodic-triggers{suffix}'] = {
+                'task': 'ai_agent_gateway.tasks.check_periodic_triggers',
+                'schedule': crontab(minute='*'), # Check every minute
+                'kwargs': {'shard': shard, 'shard_count': shard_count},
+                'options': options,
             }
-            logger.info("Celery Beat schedule configured for agent_gateway tasks.")
-        else:
-            logger.warning("Celery is not installed, Celery Beat schedule for agent_gateway will not be configured.")
\ No newline at end of file
+        # Merged rather than assigned: other apps add their own entries.
+        celery_app.conf.beat_schedule = {**(celery_app.conf.beat_schedule or {}), **beat_schedule}
+        logger.info("Celery Beat schedule configured for agent_gateway tasks.")
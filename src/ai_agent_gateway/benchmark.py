@@ -0,0 +1,281 @@
+import logging
+# agent_gateway/benchmark.py
+import json
+import platform
+import random
+import statistics
+import subprocess
+import time
+from datetime import timedelta
+from unittest.mock import patch
+from django.db import connection
+from django.test import Client
+from django.urls import reverse
+from django.utils import timezone
+from .matcher import bump_trigger_set_version, get_prompt_matcher
+from .models import AgentTrigger
+from .payloads import payload_digest
+from .tasks import check_periodic_triggers, check_scheduled_triggers, process_agent_action
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SIZES = (1000, 10000, 100000)
+
+WORDS = (
+    'order', 'refund', 'invoice', 'status', 'cancel', 'upgrade', 'password', 'reset', 'billing', 'report',
+    'deploy', 'summarize', 'translate', 'schedule', 'meeting', 'ticket', 'escalate', 'shipping', 'account', 'export',
+)
+
+# How the synthetic population is split. Prompt triggers get a mix of the
+# pattern shapes seen in practice: anchored literals, free-form wildcards,
+# case-insensitive patterns, alternations and patterns with no literal prefix.
+TRIGGER_MIX = (
+    ('anchored', 0.40),
+    ('wildcard', 0.15),
+    ('ignorecase', 0.10),
+    ('alternation', 0.10),
+    ('unanchored', 0.05),
+    ('scheduled', 0.10),
+    ('periodic', 0.10),
+)
+
+# Share of benchmark prompts that are built to match some trigger. The rest
+# match nothing, which is the worst case for the matcher.
+MATCHING_PROMPT_SHARE = 0.7
+
+
+def _words(rng, i):
+    return rng.choice(WORDS), f'{rng.choice(WORDS)}{i}'
+
+
+def synthetic_trigger(kind, i, rng, now):
+    """
+    Returns an unsaved `AgentTrigger` of the given `kind`, plus (for prompt
+    triggers) a prompt that matches it.
+    """
+    first, second = _words(rng, i)
+    payload = {'action': f'{first}_{second}', 'priority': rng.randint(1, 5)}
+    trigger = AgentTrigger(
+        name=f'bench-{kind}-{i}',
+        action_payload=payload,
+        payload_hash=payload_digest(payload),
+    )
+    prompt = None
+    if kind == 'anchored':
+        trigger.prompt_pattern, prompt = rf'^{first} {second} \d+', f'{first} {second} {rng.randint(1, 9999)}'
+    elif kind == 'wildcard':
+        trigger.prompt_pattern, prompt = rf'{first}.*{second}', f'{first} my {second} please'
+    elif kind == 'ignorecase':
+        trigger.prompt_pattern, prompt = rf'(?i){first}\s+{second}', f'{first.upper()} {second.upper()}'
+    elif kind == 'alternation':
+        trigger.prompt_pattern, prompt = rf'({first}|{second}) now', f'{second} now'
+    elif kind == 'unanchored':
+        trigger.prompt_pattern, prompt = rf'\w+ {second}$', f'please {second}'
+    elif kind == 'scheduled':
+        trigger.scheduled_time = now + timedelta(minutes=rng.randint(-30, 30))
+        trigger.next_fire_at = trigger.scheduled_time
+    else:
+        trigger.periodic_interval = timedelta(minutes=rng.choice((1, 5, 15, 60)))
+        trigger.last_triggered = now - timedelta(minutes=rng.randint(0, 120))
+        trigger.next_fire_at = trigger.last_triggered + trigger.periodic_interval
+    trigger.trigger_type = kind if kind in ('scheduled', 'periodic') else 'prompt'
+    return trigger, prompt
+
+
+def seed_triggers(start, stop, rng, batch_size=1000):
+    """
+    Inserts synthetic triggers numbered `start` to `stop - 1`.
+
+    Returns:
+        The prompts that match the prompt triggers that were inserted.
+    """
+    now = timezone.now()
+    kinds = [kind for kind, _ in TRIGGER_MIX]
+    weights = [weight for _, weight in TRIGGER_MIX]
+    prompts = []
+    batch = []
+    for i in range(start, stop):
+        trigger, prompt = synthetic_trigger(rng.choices(kinds, weights)[0], i, rng, now)
+        batch.append(trigger)
+        if prompt is not None:
+            prompts.append(prompt)
+        if len(batch) >= batch_size:
+            AgentTrigger.objects.bulk_create(batch)
+            batch = []
+    if batch:
+        AgentTrigger.objects.bulk_create(batch)
+    # bulk_create does not send post_save, so invalidate the matcher here.
+    bump_trigger_set_version()
+    return prompts
+
+
+def summarize(durations, queries, items=None):
+    """
+    Returns latency percentiles (in ms), queries per call and throughput for
+    a list of per-call durations (in seconds) and query counts.
+    """
+    ordered = sorted(durations)
+    total = sum(durations)
+    return {
+        'calls': len(durations),
+        'p50_ms': round(statistics.median(ordered) * 1000, 3),
+        'p99_ms': round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))] * 1000, 3),
+        'mean_ms': round(statistics.fmean(ordered) * 1000, 3),
+        'queries_per_call': round(sum(queries) / len(queries), 2),
+        'throughput_per_s': round((items if items is not None else len(durations)) / total, 1) if total else None,
+    }
+
+
+class QueryCounter:
+    """
+    A `connection.execute_wrapper` that counts queries without recording them.
+    """
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def measure(call, iterations, before=None):
+    """
+    Times `call` `iterations` times, counting the queries each call makes.
+
+    Args:
+        call: A callable returning the number of items it processed, or None.
+        before: An optional untimed callable run before each call.
+    """
+    durations, queries, items = [], [], 0
+    for _ in range(iterations):
+        if before is not None:
+            before()
+        counter = QueryCounter()
+        with connection.execute_wrapper(counter):
+            started = time.perf_counter()
+            result = call()
+            durations.append(time.perf_counter() - started)
+        queries.append(counter.count)
+        items += result if isinstance(result, int) else 1
+    return summarize(durations, queries, items)
+
+
+def bench_matcher_build():
+    def build():
+        bump_trigger_set_version()
+        get_prompt_matcher()
+    return measure(build, 3)
+
+
+def bench_handle_prompt(prompts, iterations, rng):
+    client = Client()
+    url = reverse('agent_gateway:handle_prompt')
+    sample = [
+        rng.choice(prompts) if prompts and rng.random() < MATCHING_PROMPT_SHARE else f'unmatched {rng.random()}'
+        for _ in range(iterations)
+    ]
+    bodies = iter(json.dumps({'prompt': prompt}) for prompt in sample)
+
+    def post():
+        response = client.post(url, next(bodies), content_type='application/json')
+        if response.status_code != 200:
+            raise RuntimeError(f'handle_prompt returned {response.status_code}: {response.content[:200]}')
+    return measure(post, iterations)
+
+
+def bench_scan(trigger_type, task, iterations):
+    def make_due():
+        AgentTrigger.objects.filter(trigger_type=trigger_type).update(
+            active=True, next_fire_at=timezone.now() - timedelta(minutes=1)
+        )
+    return measure(task, iterations, before=make_due)
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(sizes=DEFAULT_SIZES, prompts=500, scans=5, celery='mock', seed=0, log=print):
+    """
+    Runs every benchmark scenario against growing trigger populations.
+
+    Triggers are seeded cumulatively, so each size reuses the rows of the
+    previous one. Run this against a throwaway database.
+
+    Args:
+        sizes: The trigger population sizes to benchmark.
+        prompts: The number of prompts sent through `handle_prompt` per size.
+        scans: The number of scheduled/periodic scans timed per size.
+        celery: 'mock' to replace `process_agent_action.delay` with a no-op,
+            or 'eager' to run the task inline.
+        seed: The random seed for the synthetic data.
+
+    Returns:
+        A JSON-serializable report.
+    """
+    from celery import current_app
+
+    rng = random.Random(seed)
+    report = {
+        'commit': git_commit(),
+        'created': timezone.now().isoformat(),
+        'database': connection.vendor,
+        'python': platform.python_version(),
+        'celery': celery,
+        'seed': seed,
+        'results': [],
+    }
+    matching_prompts = []
+    seeded = 0
+    eager = current_app.conf.task_always_eager
+    delay_patch = patch.object(process_agent_action, 'delay')
+    try:
+        if celery == 'eager':
+            current_app.conf.task_always_eager = True
+        else:
+            delay_patch.start()
+        for size in sorted(sizes):
+            started = time.perf_counter()
+            matching_prompts += seed_triggers(seeded, size, rng)
+            seeded = size
+            log(f'Seeded {size} triggers in {time.perf_counter() - started:.1f}s')
+            scenarios = {
+                'matcher_build': bench_matcher_build(),
+                'handle_prompt': bench_handle_prompt(matching_prompts, prompts, rng),
+                'check_scheduled_triggers': bench_scan('scheduled', check_scheduled_triggers, scans),
+                'check_periodic_triggers': bench_scan('periodic', check_periodic_triggers, scans),
+            }
+            for scenario, stats in scenarios.items():
+                report['results'].append({'size': size, 'scenario': scenario, **stats})
+                log(format_result(size, scenario, stats))
+    finally:
+        if celery == 'eager':
+            current_app.conf.task_always_eager = eager
+        else:
+            delay_patch.stop()
+    return report
+
+
+def format_result(size, scenario, stats, baseline=None):
+    line = (
+        f"{size:>7} {scenario:<26} p50 {stats['p50_ms']:>9.3f}ms  p99 {stats['p99_ms']:>9.3f}ms  "
+        f"{stats['queries_per_call']:>7} q/call  {stats['throughput_per_s']}/s"
+    )
+    if baseline:
+        line += f"  (p50 x{stats['p50_ms'] / baseline['p50_ms']:.2f} vs baseline)" if baseline['p50_ms'] else ''
+    return line
+
+
+def compare(report, baseline):
+    """
+    Yields one line per result comparing `report` against a `baseline` report.
+    """
+    previous = {(result['size'], result['scenario']): result for result in baseline['results']}
+    for result in report['results']:
+        yield format_result(result['size'], result['scenario'], result, previous.get((result['size'], result['scenario'])))
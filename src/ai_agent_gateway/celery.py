@@ -1,13 +1,13 @@
-import logging
 from __future__ import absolute_import, unicode_literals
+import logging
 import os
 from celery import Celery
 
 logger = logging.getLogger(__name__)
 
 # set the default Django settings module for the 'celery' program.
-os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Project.settings')
-logger.info("Celery DJANGO_SETTINGS_MODULE set to 'Project.settings'")
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'genapp.settings')
+logger.info("Celery DJANGO_SETTINGS_MODULE set to 'genapp.settings'")
 
 app = Celery('ai_agent_gateway')
 
@@ -0,0 +1,45 @@
+import logging
+# agent_gateway/checks.py
+from django.conf import settings
+from django.core.checks import Error, Tags, Warning, register
+
+logger = logging.getLogger(__name__)
+
+# Cache backends whose contents are private to one process.
+PROCESS_LOCAL_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+def is_shared_cache(alias):
+    """
+    Whether the Django cache `alias` is configured with a backend that every
+    process can see.
+    """
+    backend = settings.CACHES.get(alias, {}).get('BACKEND')
+    return backend is not None and backend not in PROCESS_LOCAL_BACKENDS
+
+
+@register(Tags.caches)
+def check_shared_caches(app_configs, **kwargs):
+    """
+    Flags gateway features that need a cache shared between processes but are
+    pointed at a process-local one, or at none.
+    """
+    errors = []
+    for setting in ('AGENT_GATEWAY_SHARED_CACHE_ALIAS', 'AGENT_GATEWAY_MATCH_CACHE_ALIAS'):
+        alias = getattr(settings, setting, None)
+        if alias and not is_shared_cache(alias):
+            errors.append(Error(
+                f"{setting} points at the cache '{alias}', which is not shared between processes.",
+                hint='Configure a cache such as Redis under that alias, or unset the setting.',
+                id='ai_agent_gateway.E001',
+            ))
+    if not getattr(settings, 'AGENT_GATEWAY_SHARED_CACHE_ALIAS', None):
+        errors.append(Warning(
+            'No shared cache is configured, so /agent/metrics/ only reports the process that serves it.',
+            hint='Set REDIS_CACHE_URL, or point AGENT_GATEWAY_SHARED_CACHE_ALIAS at a shared cache.',
+            id='ai_agent_gateway.W001',
+        ))
+    return errors
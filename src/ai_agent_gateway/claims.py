@@ -0,0 +1,129 @@
+import logging
+# agent_gateway/claims.py
+from collections import defaultdict
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.db.models.functions import Mod
+from .models import AgentTrigger, add_interval, next_periodic_fire_at, periodic_spread
+
+logger = logging.getLogger(__name__)
+
+
+def _fired_fields(trigger_type, now, periodic_interval, trigger_id=None, fire_at=None):
+    """
+    Returns the column values that mark a trigger as fired at `now`.
+
+    When periodic firings are spread (see `models.periodic_spread`), a firing
+    claimed ahead of time counts as fired at its due time, and the trigger is
+    next due at its following phase slot.
+    """
+    if trigger_type == 'scheduled':
+        return {'scheduled_time': None, 'last_triggered': now, 'next_fire_at': None}
+    if trigger_id is None or periodic_spread() == 'off':
+        return {'last_triggered': now, 'next_fire_at': add_interval(now, periodic_interval)}
+    fired_at = max(fire_at, now) if fire_at is not None else now
+    return {'last_triggered': fired_at, 'next_fire_at': next_periodic_fire_at(trigger_id, periodic_interval, fired_at)}
+
+
+def claim_trigger(trigger_id, trigger_type, fire_at, periodic_interval, now):
+    """
+    Atomically marks a single due trigger as fired.
+
+    The update only succeeds if `next_fire_at` still holds the value the
+    caller saw, so a firing claimed elsewhere (another scheduler node or the
+    dispatcher) is never claimed twice.
+
+    Returns:
+        A `(claimed, next_fire_at)` tuple.
+    """
+    fields = _fired_fields(trigger_type, now, periodic_interval, trigger_id, fire_at)
+    updated = AgentTrigger.objects.filter(
+        id=trigger_id, active=True, next_fire_at=fire_at
+    ).update(**fields)
+    return updated == 1, fields['next_fire_at']
+
+
+def due_triggers(trigger_type, now, shard=None, shard_count=None, lookahead=None):
+    """
+    Returns the active triggers of `trigger_type` due at `now`, optionally
+    restricted to one shard of the id space.
+
+    With a `lookahead`, triggers due within it are included too, provided
+    their interval is at least as long and they last fired before `now`. A
+    trigger fired by the scan at `now` counts as fired at `now` or later, so
+    the scan cannot claim it again even if its next slot is within the
+    lookahead.
+    """
+    due = Q(next_fire_at__lte=now)
+    if lookahead:
+        due |= Q(
+            Q(last_triggered__isnull=True) | Q(last_triggered__lt=now),
+            next_fire_at__lte=now + lookahead,
+            periodic_interval__gte=lookahead,
+        )
+    qs = AgentTrigger.objects.filter(
+        due,
+        trigger_type=trigger_type,
+        active=True,
+    )
+    if shard_count and shard_count > 1:
+        qs = qs.alias(shard=Mod(F('id'), shard_count)).filter(shard=shard or 0)
+    return qs.order_by('next_fire_at')
+
+
+def claim_due_triggers(trigger_type, now, batch_size=None, shard=None, shard_count=None, lookahead=None):
+    """
+    Claims up to `batch_size` due triggers of `trigger_type` for this caller.
+
+    On databases that support it the batch is locked with
+    `SELECT ... FOR UPDATE SKIP LOCKED` and marked as fired in the same
+    transaction, so concurrent scheduler nodes each claim a disjoint batch
+    without waiting on one another. Elsewhere (SQLite) every row is claimed
+    with a compare-and-set on `next_fire_at`, which gives the same
+    exactly-once guarantee at one UPDATE per row.
+
+    Args:
+        trigger_type: 'scheduled' or 'periodic'.
+        now: The scan time; triggers with `next_fire_at <= now` are due.
+        batch_size: The maximum number of triggers to claim. Defaults to the
+            `AGENT_GATEWAY_CLAIM_BATCH_SIZE` setting.
+        shard: This node's shard number, in `range(shard_count)`.
+        shard_count: The number of shards the id space is split into.
+        lookahead: Also claim periodic firings due within this timedelta of
+            `now` (see `due_triggers`).
+
+    Returns:
+        A list of `(trigger_id, payload_version, fire_at)` tuples that were
+        claimed, where `fire_at` is the due time each firing was claimed for.
+    """
+    batch_size = batch_size or getattr(settings, 'AGENT_GATEWAY_CLAIM_BATCH_SIZE', 500)
+    qs = due_triggers(trigger_type, now, shard=shard, shard_count=shard_count, lookahead=lookahead)
+    fields = ('id', 'next_fire_at', 'periodic_interval', 'payload_version')
+
+    if not connection.features.has_select_for_update_skip_locked:
+        claimed = []
+        for trigger_id, fire_at, periodic_interval, payload_version in qs.values_list(*fields)[:batch_size]:
+            ok, _ = claim_trigger(trigger_id, trigger_type, fire_at, periodic_interval, now)
+            if ok:
+                claimed.append((trigger_id, payload_version, fire_at))
+        return claimed
+
+    with transaction.atomic():
+        rows = list(qs.select_for_update(skip_locked=True).values_list(*fields)[:batch_size])
+        if trigger_type == 'periodic' and periodic_spread() != 'off':
+            # Every trigger moves to its own phase slot: one bulk UPDATE.
+            fired = [
+                AgentTrigger(id=trigger_id, **_fired_fields(trigger_type, now, periodic_interval, trigger_id, fire_at))
+                for trigger_id, fire_at, periodic_interval, _ in rows
+            ]
+            AgentTrigger.objects.bulk_update(fired, ['last_triggered', 'next_fire_at'])
+            return [(trigger_id, payload_version, fire_at) for trigger_id, fire_at, _, payload_version in rows]
+        ids_by_interval = defaultdict(list)
+        for trigger_id, _, periodic_interval, _ in rows:
+            ids_by_interval[periodic_interval].append(trigger_id)
+        for periodic_interval, ids in ids_by_interval.items():
+            AgentTrigger.objects.filter(id__in=ids).update(
+                **_fired_fields(trigger_type, now, periodic_interval)
+            )
+    return [(trigger_id, payload_version, fire_at) for trigger_id, fire_at, _, payload_version in rows]
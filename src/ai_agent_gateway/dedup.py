@@ -0,0 +1,204 @@
+import logging
+# agent_gateway/dedup.py
+import threading
+from datetime import timedelta
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from django.core.cache import caches
+from .metrics import increment, shared_cache
+
+logger = logging.getLogger(__name__)
+
+DEDUP_KEY_PREFIX = 'ai_agent_gateway:dedup'
+TASK_KEY_PREFIX = 'task:'
+
+# The database backend purges expired claims once every this many claims.
+PURGE_EVERY = 1000
+
+
+def firing_key(trigger_id, fire_at):
+    """
+    Returns the idempotency key of a scheduled or periodic firing: the trigger
+    and the due time it was claimed for. The Beat scans and the dispatcher
+    derive the same key for the same due time.
+    """
+    return f'{trigger_id}:{fire_at.isoformat()}'
+
+
+def task_key(task_id):
+    """
+    Returns the idempotency key of a message without a firing key: its Celery
+    task id, which stays the same across redelivery and retries.
+    """
+    return f'{TASK_KEY_PREFIX}{task_id}'
+
+
+class RedisDedupSet:
+    """
+    Idempotency keys kept in Redis with `SET NX PX`, so a claim is one round
+    trip and expired keys disappear on their own.
+    """
+
+    def __init__(self, client):
+        self.client = client
+
+    def claim(self, key, ttl):
+        return bool(self.client.set(f'{DEDUP_KEY_PREFIX}:{key}', 1, nx=True, px=int(ttl * 1000)))
+
+    def release(self, key):
+        self.client.delete(f'{DEDUP_KEY_PREFIX}:{key}')
+
+
+class CacheDedupSet:
+    """
+    Idempotency keys kept in a Django cache with `add`, which only sets a key
+    that is not there yet. Used for task id keys when Redis is not
+    configured: a task id is unique to one message, so a cheap expiring key
+    is enough and no `ActionClaim` row is written.
+    """
+
+    def __init__(self, cache):
+        self.cache = cache
+
+    def claim(self, key, ttl):
+        return self.cache.add(f'{DEDUP_KEY_PREFIX}:{key}', 1, timeout=ttl)
+
+    def release(self, key):
+        self.cache.delete(f'{DEDUP_KEY_PREFIX}:{key}')
+
+
+class DatabaseDedupSet:
+    """
+    Idempotency keys kept in the `ActionClaim` table, relying on its unique
+    constraint. Used when Redis is not configured.
+    """
+
+    def __init__(self):
+        self._claims = 0
+
+    def claim(self, key, ttl):
+        from .models import ActionClaim
+        now = timezone.now()
+        self._claims += 1
+        if self._claims % PURGE_EVERY == 0:
+            self.purge(ttl, now)
+        try:
+            with transaction.atomic():
+                ActionClaim.objects.create(key=key, claimed_at=now)
+            return True
+        except IntegrityError:
+            # The key is taken, unless its claim has expired: take it over
+            # with a compare-and-set so only one caller wins.
+            return ActionClaim.objects.filter(
+                key=key, claimed_at__lt=now - timedelta(seconds=ttl)
+            ).update(claimed_at=now) == 1
+
+    def release(self, key):
+        from .models import ActionClaim
+        ActionClaim.objects.filter(key=key).delete()
+
+    def purge(self, ttl, now=None):
+        from .models import ActionClaim
+        cutoff = (now or timezone.now()) - timedelta(seconds=ttl)
+        deleted, _ = ActionClaim.objects.filter(claimed_at__lt=cutoff).delete()
+        return deleted
+
+
+class Deduplicator:
+    """
+    Drops agent actions whose idempotency key has already been claimed.
+
+    A claim lasts `AGENT_GATEWAY_DEDUP_TTL` seconds (default one day), which
+    must outlast any redelivery or retry of the same message. Keys live in
+    Redis when `AGENT_GATEWAY_DEDUP_REDIS_URL` is set; if Redis fails, the
+    database is used for that claim. Otherwise firing keys live in the
+    database and task id keys in `task_backend`, a cheaper expiring set.
+
+    Attributes:
+        hits: Duplicates dropped by this process.
+        misses: First-time keys claimed by this process.
+
+    Both are also counted in the gateway metrics (`dedup_hits_total` and
+    `dedup_misses_total`), which are summed across processes.
+    """
+
+    def __init__(self, backend, ttl=86400, fallback=None, task_backend=None):
+        self.backend = backend
+        self.ttl = ttl
+        self.fallback = fallback
+        self.task_backend = task_backend
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def _backend_for(self, key):
+        if self.task_backend is not None and key.startswith(TASK_KEY_PREFIX):
+            return self.task_backend
+        return self.backend
+
+    def claim(self, key):
+        """
+        Claims `key`.
+
+        Returns:
+            True if this is the first claim of `key` within the TTL, False if
+            the action is a duplicate and should be dropped.
+        """
+        try:
+            first = self._backend_for(key).claim(key, self.ttl)
+        except Exception as e:
+            if self.fallback is None:
+                raise
+            logger.warning(f"Dedup claim failed for {key}, using the database: {e}")
+            first = self.fallback.claim(key, self.ttl)
+        with self._lock:
+            if first:
+                self.misses += 1
+            else:
+                self.hits += 1
+        increment('dedup_misses' if first else 'dedup_hits')
+        return first
+
+    def release(self, key):
+        """
+        Gives up a claim, so that a retry of a failed action can run.
+        """
+        try:
+            self._backend_for(key).release(key)
+        except Exception as e:
+            logger.warning(f"Could not release idempotency key {key}: {e}")
+            if self.fallback is not None:
+                self.fallback.release(key)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / total, 4) if total else 0.0,
+            }
+
+
+_deduplicator = None
+_deduplicator_lock = threading.Lock()
+
+
+def get_deduplicator():
+    """
+    Returns the process-wide `Deduplicator`.
+    """
+    global _deduplicator
+    with _deduplicator_lock:
+        if _deduplicator is None:
+            ttl = getattr(settings, 'AGENT_GATEWAY_DEDUP_TTL', 86400)
+            url = getattr(settings, 'AGENT_GATEWAY_DEDUP_REDIS_URL', None)
+            if url:
+                import redis
+                client = redis.Redis.from_url(url, socket_timeout=1.0, socket_connect_timeout=1.0)
+                _deduplicator = Deduplicator(RedisDedupSet(client), ttl, fallback=DatabaseDedupSet())
+            else:
+                task_backend = CacheDedupSet(shared_cache() or caches['default'])
+                _deduplicator = Deduplicator(DatabaseDedupSet(), ttl, task_backend=task_backend)
+        return _deduplicator
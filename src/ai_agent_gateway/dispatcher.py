@@ -0,0 +1,121 @@
+import logging
+# agent_gateway/dispatcher.py
+import heapq
+import threading
+from datetime import timedelta
+from django.db import close_old_connections
+from django.utils import timezone
+from .claims import claim_trigger
+from .dedup import firing_key
+from .matcher import trigger_set_version
+from .models import AgentTrigger
+from .tasks import process_agent_action
+
+logger = logging.getLogger(__name__)
+
+TIMED_TRIGGER_TYPES = ('scheduled', 'periodic')
+
+
+class TriggerDispatcher:
+    """
+    Fires scheduled and periodic triggers at their exact due time.
+
+    The triggers due within the next `lookahead` are held in a min-heap keyed
+    by `next_fire_at`. The dispatcher sleeps until the head of the heap is due
+    (or at most `poll_interval`, to notice trigger changes), claims each due
+    trigger and dispatches `process_agent_action`. The window is reloaded with
+    one indexed query when the trigger set version changes or the lookahead
+    horizon is reached, so the database is not polled between firings.
+    """
+
+    def __init__(self, lookahead=timedelta(minutes=5), poll_interval=1.0, clock=timezone.now):
+        self.lookahead = lookahead
+        self.poll_interval = poll_interval
+        self.clock = clock
+        self._heap = []
+        self._pending = {}
+        self._version = None
+        self._horizon = None
+        self._stop = threading.Event()
+
+    def __len__(self):
+        return len(self._pending)
+
+    def _push(self, trigger_id, trigger_type, fire_at, periodic_interval, payload_version):
+        self._pending[trigger_id] = fire_at
+        heapq.heappush(self._heap, (fire_at, trigger_id, trigger_type, periodic_interval, payload_version))
+
+    def refresh(self, now=None):
+        """
+        Reloads every active timed trigger due before the lookahead horizon.
+        """
+        now = now or self.clock()
+        self._version = trigger_set_version()
+        self._horizon = now + self.lookahead
+        self._heap = []
+        self._pending = {}
+        due = AgentTrigger.objects.filter(
+            trigger_type__in=TIMED_TRIGGER_TYPES,
+            active=True,
+            next_fire_at__lte=self._horizon,
+        ).values_list('id', 'trigger_type', 'next_fire_at', 'periodic_interval', 'payload_version')
+        for trigger_id, trigger_type, fire_at, periodic_interval, payload_version in due:
+            self._push(trigger_id, trigger_type, fire_at, periodic_interval, payload_version)
+        logger.info(f"Trigger dispatcher loaded {len(self._pending)} triggers due before {self._horizon}")
+
+    def _needs_refresh(self, now):
+        return (
+            self._horizon is None
+            or now >= self._horizon
+            or trigger_set_version() != self._version
+        )
+
+    def fire_due(self, now=None):
+        """
+        Claims and dispatches every loaded trigger that is due at `now`.
+
+        Returns:
+            The number of triggers dispatched.
+        """
+        now = now or self.clock()
+        fired = 0
+        while self._heap and self._heap[0][0] <= now:
+            fire_at, trigger_id, trigger_type, periodic_interval, payload_version = heapq.heappop(self._heap)
+            if self._pending.get(trigger_id) != fire_at:
+                continue
+            del self._pending[trigger_id]
+            claimed, next_fire_at = claim_trigger(trigger_id, trigger_type, fire_at, periodic_interval, now)
+            if not claimed:
+                logger.info(f"Trigger {trigger_id} was already fired elsewhere, skipping")
+                continue
+            process_agent_action.delay(trigger_id, payload_version, idempotency_key=firing_key(trigger_id, fire_at))
+            fired += 1
+            if next_fire_at is not None and next_fire_at <= self._horizon:
+                self._push(trigger_id, trigger_type, next_fire_at, periodic_interval, payload_version)
+        return fired
+
+    def run_once(self):
+        """
+        Runs one dispatcher iteration.
+
+        Returns:
+            The number of seconds to sleep before the next iteration.
+        """
+        close_old_connections()
+        now = self.clock()
+        if self._needs_refresh(now):
+            self.refresh(now)
+        self.fire_due(now)
+        wake_at = self._horizon
+        if self._heap:
+            wake_at = min(wake_at, self._heap[0][0])
+        return max(0.0, min((wake_at - self.clock()).total_seconds(), self.poll_interval))
+
+    def run_forever(self):
+        logger.info("Trigger dispatcher started")
+        while not self._stop.is_set():
+            self._stop.wait(self.run_once())
+        logger.info("Trigger dispatcher stopped")
+
+    def stop(self):
+        self._stop.set()
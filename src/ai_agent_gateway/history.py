@@ -0,0 +1,155 @@
+import logging
+# agent_gateway/history.py
+import threading
+from celery.signals import worker_init, worker_process_init, worker_process_shutdown, worker_shutdown
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+from .models import AgentTrigger, TriggerFiring
+
+logger = logging.getLogger(__name__)
+
+
+def write_firings(firings):
+    """
+    Persists a batch of `TriggerFiring` records and moves `last_triggered`
+    forward for the triggers that fired successfully.
+
+    Both writes are bulk statements that only touch the columns they set, and
+    neither sends `post_save`, so recording a firing does not invalidate the
+    compiled prompt matcher.
+    """
+    names = dict(
+        AgentTrigger.objects.filter(id__in={firing.trigger_id for firing in firings}).values_list('id', 'name')
+    )
+    last_triggered = {}
+    for firing in firings:
+        if firing.trigger_id not in names:
+            # Deleted since it fired: keep the record, without the relation.
+            firing.trigger_id = None
+            continue
+        firing.trigger_name = names[firing.trigger_id]
+        if firing.succeeded:
+            last_triggered[firing.trigger_id] = max(firing.fired_at, last_triggered.get(firing.trigger_id, firing.fired_at))
+    with transaction.atomic():
+        TriggerFiring.objects.bulk_create(firings)
+        AgentTrigger.objects.bulk_update(
+            [AgentTrigger(id=trigger_id, last_triggered=fired_at) for trigger_id, fired_at in last_triggered.items()],
+            ['last_triggered'],
+        )
+    return len(firings)
+
+
+class FiringBuffer:
+    """
+    Collects `TriggerFiring` records in memory and writes them in bulk.
+
+    The buffer is flushed once it holds `max_records` records, or
+    `flush_interval` seconds after the first record was added, whichever
+    comes first.
+    """
+
+    def __init__(self, max_records=100, flush_interval=1.0):
+        self.max_records = max_records
+        self.flush_interval = flush_interval
+        self._firings = []
+        self._timer = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._firings)
+
+    def add(self, *firings):
+        with self._lock:
+            self._firings.extend(firings)
+            full = len(self._firings) >= self.max_records
+            if not full and self._timer is None and self.flush_interval:
+                self._timer = threading.Timer(self.flush_interval, self._flush_from_timer)
+                self._timer.daemon = True
+                self._timer.start()
+        if full:
+            self.flush()
+
+    def flush(self):
+        """
+        Writes every buffered record.
+
+        Returns:
+            The number of records written.
+        """
+        with self._lock:
+            firings, self._firings = self._firings, []
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        if not firings:
+            return 0
+        try:
+            return write_firings(firings)
+        except Exception as e:
+            logger.error(f"Could not write {len(firings)} trigger firings: {e}")
+            return 0
+
+    def _flush_from_timer(self):
+        try:
+            self.flush()
+        finally:
+            connection.close()
+
+
+# Outside a Celery worker there is no shutdown hook to flush on, so firings
+# are written straight through until `enable_buffering` swaps this out.
+_buffer = FiringBuffer(max_records=1, flush_interval=None)
+
+
+def get_firing_buffer():
+    return _buffer
+
+
+def enable_buffering(**kwargs):
+    """
+    Switches the process to a buffered `FiringBuffer` sized by the
+    `AGENT_GATEWAY_FIRING_BUFFER_SIZE` and `AGENT_GATEWAY_FIRING_FLUSH_MS`
+    settings. Connected to the Celery worker start-up signals.
+    """
+    global _buffer
+    _buffer.flush()
+    _buffer = FiringBuffer(
+        max_records=getattr(settings, 'AGENT_GATEWAY_FIRING_BUFFER_SIZE', 100),
+        flush_interval=getattr(settings, 'AGENT_GATEWAY_FIRING_FLUSH_MS', 1000) / 1000,
+    )
+
+
+def flush_firings(**kwargs):
+    _buffer.flush()
+
+
+def firing_for(trigger_id, payload_version=None, error=None, fired_at=None, count=1):
+    return TriggerFiring(
+        trigger_id=trigger_id,
+        fired_at=fired_at or timezone.now(),
+        payload_version=payload_version if isinstance(payload_version, int) else None,
+        count=count,
+        succeeded=error is None,
+        error='' if error is None else str(error),
+    )
+
+
+def record_firing(trigger_id, payload_version=None, error=None, fired_at=None, count=1):
+    """
+    Records one firing of a trigger.
+
+    Args:
+        trigger_id: The ID of the `AgentTrigger` that fired.
+        payload_version: The payload version that was sent, if known.
+        error: The exception the agent call raised, or None on success.
+        fired_at: When the trigger fired. Defaults to now.
+        count: The number of prompt firings coalesced into this action.
+    """
+    get_firing_buffer().add(firing_for(trigger_id, payload_version, error, fired_at, count))
+
+
+worker_init.connect(enable_buffering)
+worker_process_init.connect(enable_buffering)
+worker_process_shutdown.connect(flush_firings)
+worker_shutdown.connect(flush_firings)
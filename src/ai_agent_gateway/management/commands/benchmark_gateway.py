@@ -0,0 +1,94 @@
+"""
+Django management command to benchmark the AI agent gateway.
+
+Seeds synthetic `AgentTrigger` populations into a throwaway test database and
+reports p50/p99 latency, queries per call and throughput for `handle_prompt`
+and the scheduled/periodic trigger scans. See `ai_agent_gateway.benchmark`.
+
+Example:
+    python manage.py benchmark_gateway --sizes 1000 10000 --output bench.json
+    python manage.py benchmark_gateway --compare bench.json
+"""
+
+import json
+import logging
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+from ai_agent_gateway import benchmark
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Benchmark prompt matching and trigger scans against synthetic trigger populations.'
+
+    def add_arguments(self, parser):
+        """
+        Add command line arguments.
+        """
+        parser.add_argument(
+            '--sizes',
+            type=int,
+            nargs='+',
+            default=list(benchmark.DEFAULT_SIZES),
+            help='Trigger population sizes to benchmark (default: 1000 10000 100000)',
+        )
+        parser.add_argument(
+            '--prompts',
+            type=int,
+            default=500,
+            help='Prompts sent through handle_prompt per size (default: 500)',
+        )
+        parser.add_argument(
+            '--scans',
+            type=int,
+            default=5,
+            help='Scheduled and periodic scans timed per size (default: 5)',
+        )
+        parser.add_argument(
+            '--celery',
+            choices=['mock', 'eager'],
+            default='mock',
+            help='Replace process_agent_action.delay with a no-op, or run it inline (default: mock)',
+        )
+        parser.add_argument('--seed', type=int, default=0, help='Random seed for the synthetic data (default: 0)')
+        parser.add_argument('--output', help='Write the JSON report to this file')
+        parser.add_argument('--compare', help='Compare the results with a JSON report saved earlier')
+
+    def handle(self, *args, **options):
+        """
+        Execute the command.
+        """
+        baseline = None
+        if options['compare']:
+            try:
+                with open(options['compare']) as f:
+                    baseline = json.load(f)
+            except (OSError, ValueError) as e:
+                raise CommandError(f"Could not read baseline {options['compare']}: {e}")
+
+        setup_test_environment(debug=False)
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        self.stdout.write(f"Benchmarking against test database {connection.settings_dict['NAME']}")
+        try:
+            report = benchmark.run_benchmarks(
+                sizes=options['sizes'],
+                prompts=options['prompts'],
+                scans=options['scans'],
+                celery=options['celery'],
+                seed=options['seed'],
+                log=self.stdout.write,
+            )
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        if baseline is not None:
+            self.stdout.write(f"Compared with {options['compare']} (commit {baseline.get('commit')}):")
+            for line in benchmark.compare(report, baseline):
+                self.stdout.write(line)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Report written to {options['output']}"))
@@ -0,0 +1,56 @@
+"""
+Django management command to export agent triggers as NDJSON.
+
+Writes one trigger definition per line, reading the triggers in chunks so
+memory use stays constant. See `ai_agent_gateway.transfer`.
+
+Example:
+    python manage.py export_triggers --output triggers.ndjson
+    python manage.py export_triggers --trigger-type prompt --active
+"""
+
+import logging
+from django.core.management.base import BaseCommand
+from ai_agent_gateway.models import AgentTrigger
+from ai_agent_gateway.transfer import export_triggers
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Export agent trigger definitions as NDJSON.'
+
+    def add_arguments(self, parser):
+        """
+        Add command line arguments.
+        """
+        parser.add_argument('--output', help='Write to this file instead of standard output')
+        parser.add_argument('--trigger-type', choices=[choice for choice, _ in AgentTrigger.TRIGGER_TYPES])
+        parser.add_argument('--active', action='store_true', help='Only export active triggers')
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=2000,
+            help='Triggers read per query (default: 2000)',
+        )
+
+    def handle(self, *args, **options):
+        """
+        Execute the command.
+        """
+        queryset = AgentTrigger.objects.all()
+        if options['trigger_type']:
+            queryset = queryset.filter(trigger_type=options['trigger_type'])
+        if options['active']:
+            queryset = queryset.filter(active=True)
+        lines = export_triggers(queryset, chunk_size=options['chunk_size'])
+        if options['output']:
+            count = 0
+            with open(options['output'], 'w', encoding='utf-8') as output:
+                for line in lines:
+                    output.write(line)
+                    count += 1
+            self.stdout.write(self.style.SUCCESS(f"Exported {count} triggers to {options['output']}"))
+        else:
+            for line in lines:
+                self.stdout.write(line, ending='')
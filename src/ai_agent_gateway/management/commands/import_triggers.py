@@ -0,0 +1,54 @@
+"""
+Django management command to create agent triggers in bulk from NDJSON.
+
+Each line is one trigger definition, as written by `export_triggers`. See
+`ai_agent_gateway.transfer`.
+
+Example:
+    python manage.py import_triggers triggers.ndjson --batch-size 2000
+    python manage.py export_triggers | python manage.py import_triggers -
+"""
+
+import logging
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from ai_agent_gateway.transfer import import_triggers
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Create agent triggers in bulk from an NDJSON file.'
+
+    def add_arguments(self, parser):
+        """
+        Add command line arguments.
+        """
+        parser.add_argument('path', help="NDJSON file to import, or '-' for standard input")
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Triggers written per transaction (default: 1000)',
+        )
+        parser.add_argument('--dry-run', action='store_true', help='Validate the file without writing anything')
+
+    def handle(self, *args, **options):
+        """
+        Execute the command.
+        """
+        try:
+            if options['path'] == '-':
+                result = import_triggers(sys.stdin, options['batch_size'], options['dry_run'])
+            else:
+                with open(options['path'], encoding='utf-8') as lines:
+                    result = import_triggers(lines, options['batch_size'], options['dry_run'])
+        except OSError as e:
+            raise CommandError(f"Could not read {options['path']}: {e}")
+
+        for line, error in result.errors:
+            self.stderr.write(f"Line {line}: {error}")
+        if result.failed > len(result.errors):
+            self.stderr.write(f"... and {result.failed - len(result.errors)} more rejected lines")
+        verb = 'Validated' if options['dry_run'] else 'Imported'
+        self.stdout.write(self.style.SUCCESS(f"{verb} {result.created} triggers, rejected {result.failed}"))
@@ -0,0 +1,47 @@
+"""
+Django management command to start a Celery worker for one agent gateway role.
+
+`scans` workers consume only the trigger scan queue, `actions` workers only
+the agent action queue, and `all` runs everything in one worker for
+development. See `ai_agent_gateway.routing`.
+
+Example:
+    python manage.py run_agent_worker scans --beat
+    python manage.py run_agent_worker actions --concurrency 32
+"""
+
+import logging
+from django.core.management.base import BaseCommand, CommandError
+from ai_agent_gateway.celery import app
+from ai_agent_gateway.routing import WORKER_PROFILES, worker_argv
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Start a Celery worker with the queues, concurrency and prefetch of an agent gateway role.'
+
+    def add_arguments(self, parser):
+        """
+        Add command line arguments.
+        """
+        parser.add_argument('role', choices=sorted(WORKER_PROFILES), help='The worker profile to start')
+        parser.add_argument('--concurrency', type=int, help="Override the profile's concurrency")
+        parser.add_argument('--prefetch-multiplier', type=int, help="Override the profile's prefetch multiplier")
+        parser.add_argument('--beat', action='store_true', help='Also run the Celery Beat scheduler in this worker')
+        parser.add_argument('--loglevel', default='INFO', help='Worker log level (default: INFO)')
+
+    def handle(self, *args, **options):
+        """
+        Execute the command.
+        """
+        try:
+            argv = worker_argv(options['role'], loglevel=options['loglevel'], beat=options['beat'])
+        except KeyError:
+            raise CommandError(f"Unknown worker role {options['role']}")
+        for option in ('concurrency', 'prefetch_multiplier'):
+            if options[option] is not None:
+                flag = f"--{option.replace('_', '-')}"
+                argv[argv.index(flag) + 1] = str(options[option])
+        self.stdout.write(f"Starting {options['role']} worker: celery {' '.join(argv)}")
+        app.worker_main(argv)
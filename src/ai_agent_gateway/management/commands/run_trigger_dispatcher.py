@@ -0,0 +1,55 @@
+"""
+Django management command to run the sub-second trigger dispatcher.
+
+Fires scheduled and periodic triggers at their exact due time instead of on
+the next minute-granularity Celery Beat scan. See `ai_agent_gateway.dispatcher`.
+"""
+
+import logging
+import signal
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from ai_agent_gateway.dispatcher import TriggerDispatcher
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Run the long-running dispatcher that fires scheduled and periodic triggers when they are due.'
+
+    def add_arguments(self, parser):
+        """
+        Add command line arguments.
+        """
+        parser.add_argument(
+            '--lookahead',
+            type=int,
+            default=300,
+            help='Seconds of upcoming fire times to hold in memory (default: 300)',
+        )
+        parser.add_argument(
+            '--poll-interval',
+            type=float,
+            default=1.0,
+            help='Maximum seconds between checks for trigger changes (default: 1.0)',
+        )
+
+    def handle(self, *args, **options):
+        """
+        Execute the command.
+        """
+        dispatcher = TriggerDispatcher(
+            lookahead=timedelta(seconds=options['lookahead']),
+            poll_interval=options['poll_interval'],
+        )
+
+        def shutdown(signum, frame):
+            self.stdout.write("Stopping trigger dispatcher...")
+            dispatcher.stop()
+
+        signal.signal(signal.SIGTERM, shutdown)
+        signal.signal(signal.SIGINT, shutdown)
+
+        self.stdout.write(self.style.SUCCESS("Trigger dispatcher running"))
+        dispatcher.run_forever()
+        self.stdout.write(self.style.SUCCESS("Trigger dispatcher stopped"))
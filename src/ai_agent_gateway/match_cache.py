@@ -0,0 +1,123 @@
+import logging
+# agent_gateway/match_cache.py
+import hashlib
+import threading
+from collections import OrderedDict
+from django.conf import settings
+from django.core.cache import caches
+from .metrics import increment
+
+logger = logging.getLogger(__name__)
+
+MATCH_CACHE_KEY_PREFIX = 'ai_agent_gateway:match'
+
+# Cached in place of a trigger id when a prompt matched nothing. Trigger ids
+# start at 1, so 0 never collides with a real one.
+NO_MATCH = 0
+
+
+def prompt_digest(prompt):
+    """
+    Returns a short digest of the exact prompt text.
+
+    The prompt is not case-folded or whitespace-normalized: regex triggers
+    can tell those variants apart, so they must not share a cache entry.
+    """
+    return hashlib.blake2b(prompt.encode('utf-8', 'surrogatepass'), digest_size=16).hexdigest()
+
+
+class MatchCache:
+    """
+    A bounded LRU cache from prompt to matched trigger id.
+
+    Entries are keyed by the trigger set version as well as the prompt, so an
+    edit to any trigger (which bumps the version) can never serve a stale
+    result. An optional shared tier (any Django cache, e.g. Redis) lets
+    processes reuse each other's results.
+
+    Args:
+        maxsize: The maximum number of prompts kept in process.
+        shared: An optional Django cache used as a second tier.
+        timeout: How long shared-tier entries live, in seconds.
+    """
+
+    def __init__(self, maxsize=10000, shared=None, timeout=300):
+        self.maxsize = maxsize
+        self.shared = shared
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @classmethod
+    def from_settings(cls):
+        """
+        Returns the cache configured by the `AGENT_GATEWAY_MATCH_CACHE_*`
+        settings, or None if it is disabled.
+        """
+        maxsize = getattr(settings, 'AGENT_GATEWAY_MATCH_CACHE_SIZE', 10000)
+        if not maxsize:
+            return None
+        alias = getattr(settings, 'AGENT_GATEWAY_MATCH_CACHE_ALIAS', None)
+        return cls(
+            maxsize=maxsize,
+            shared=caches[alias] if alias else None,
+            timeout=getattr(settings, 'AGENT_GATEWAY_MATCH_CACHE_TIMEOUT', 300),
+        )
+
+    @staticmethod
+    def _shared_key(version, digest):
+        return f'{MATCH_CACHE_KEY_PREFIX}:{version}:{digest}'
+
+    def get(self, version, prompt, shared=True):
+        """
+        Looks up the trigger id cached for `prompt` at `version`.
+
+        Returns:
+            A `(hit, trigger_id)` tuple. `trigger_id` is `NO_MATCH` for a
+            prompt that is known to match nothing.
+        """
+        key = (version, prompt_digest(prompt))
+        with self._lock:
+            trigger_id = self._entries.get(key)
+            if trigger_id is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+        if trigger_id is not None:
+            increment('match_cache_hits')
+            return True, trigger_id
+        if shared and self.shared is not None:
+            try:
+                trigger_id = self.shared.get(self._shared_key(*key))
+            except Exception as e:
+                logger.warning(f"Shared prompt match cache lookup failed: {e}")
+                trigger_id = None
+            if trigger_id is not None:
+                self._put(key, trigger_id)
+                self.hits += 1
+                increment('match_cache_hits')
+                return True, trigger_id
+        self.misses += 1
+        increment('match_cache_misses')
+        return False, None
+
+    def set(self, version, prompt, trigger_id, shared=True):
+        key = (version, prompt_digest(prompt))
+        trigger_id = trigger_id or NO_MATCH
+        self._put(key, trigger_id)
+        if shared and self.shared is not None:
+            try:
+                self.shared.set(self._shared_key(*key), trigger_id, timeout=self.timeout)
+            except Exception as e:
+                logger.warning(f"Shared prompt match cache update failed: {e}")
+
+    def _put(self, key, trigger_id):
+        with self._lock:
+            self._entries[key] = trigger_id
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
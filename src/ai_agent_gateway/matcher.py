@@ -0,0 +1,452 @@
+import logging
+# agent_gateway/matcher.py
+import re
+import secrets
+import threading
+import time
+from dataclasses import dataclass, field
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils import timezone
+from .match_cache import MatchCache
+from .patterns import DANGEROUS, SAFE, classify_pattern
+from .similarity import build_index
+from .throttling import ActionPolicy
+
+try:
+    # Supports a per-match timeout, so risky patterns can be cut off mid-match.
+    import regex
+except ImportError:
+    regex = None
+
+logger = logging.getLogger(__name__)
+
+# Number of patterns folded into a single alternation regex. Large enough to
+# amortise the per-call overhead of the regex engine, small enough to keep
+# compile times and the size of each compiled program reasonable.
+ALTERNATION_GROUP_SIZE = 200
+
+_REGEX_METACHARS = frozenset('.^$*+?{}[]\\|()')
+_QUANTIFIERS = frozenset('*?{')
+
+
+class PatternError(re.error):
+    """
+    Raised when a trigger's `prompt_pattern` cannot be compiled.
+
+    Carries the offending trigger's name so callers can report it the same
+    way the per-request `re.match` loop used to.
+    """
+    def __init__(self, trigger_name, error):
+        super().__init__(str(error))
+        self.trigger_name = trigger_name
+
+
+@dataclass
+class PatternEntry:
+    """
+    A compiled, in-memory view of a single active prompt trigger.
+    """
+    id: int
+    name: str
+    pattern: str
+    payload_version: int
+    regex: re.Pattern = None
+    error: re.error = None
+    risk: str = SAFE
+    bounded: object = None
+    quarantined: bool = False
+    policy: ActionPolicy = None
+
+
+@dataclass
+class _TrieNode:
+    children: dict = field(default_factory=dict)
+    entries: list = field(default_factory=list)
+    groups: list = None
+
+
+def trigger_set_version():
+    """
+    Returns the current version of the active trigger set.
+
+    The version is a single database row (see `models.TriggerSetVersion`), so
+    every process notices changes made by the others with one primary key
+    lookup, whatever cache backends are configured.
+    """
+    from .models import TriggerSetVersion
+    version = TriggerSetVersion.objects.filter(pk=1).values_list('version', flat=True).first()
+    return version or 1
+
+
+def bump_trigger_set_version():
+    """
+    Invalidates every process-local index built from the current trigger set.
+
+    The new version is random rather than the old one plus one: a bump in a
+    transaction that rolls back must not hand its number to the next bump,
+    or a matcher built from the rolled-back triggers would look current.
+    """
+    from .models import TriggerSetVersion
+    version = secrets.randbits(62) + 1
+    if not TriggerSetVersion.objects.filter(pk=1).update(version=version):
+        TriggerSetVersion.objects.update_or_create(pk=1, defaults={'version': version})
+    return version
+
+
+def literal_prefix(pattern):
+    """
+    Returns the literal text every `re.match` of `pattern` must start with.
+
+    The scan is deliberately conservative: it stops at the first construct it
+    does not understand and gives up entirely on alternations, so the prefix
+    is only ever a necessary condition for a match, never a sufficient one.
+    """
+    if '|' in pattern:
+        return ''
+    i = 0
+    if pattern.startswith('^'):
+        i = 1
+    elif pattern.startswith('\\A'):
+        i = 2
+    prefix = []
+    while i < len(pattern):
+        char = pattern[i]
+        if char == '\\':
+            if i + 1 >= len(pattern) or pattern[i + 1].isalnum():
+                break
+            literal, width = pattern[i + 1], 2
+        elif char in _REGEX_METACHARS:
+            break
+        else:
+            literal, width = char, 1
+        following = pattern[i + width:i + width + 1]
+        if following and following in _QUANTIFIERS:
+            # The character is optional (or repeated zero times), so it cannot
+            # be part of the required prefix.
+            break
+        prefix.append(literal)
+        i += width
+        if following == '+':
+            break
+    return ''.join(prefix)
+
+
+def _is_combinable(entry):
+    """
+    Whether `entry` can be folded into a shared alternation without changing
+    its meaning: no named groups, backreferences or inline global flags.
+    """
+    if entry.regex is None or entry.risk != SAFE:
+        return False
+    if entry.regex.groupindex or entry.regex.flags & ~re.UNICODE:
+        return False
+    if re.search(r'\\[1-9]|\(\?P=|\(\?\(|\(\?[aiLmsux]', entry.pattern):
+        return False
+    return True
+
+
+def _compile_group(entries):
+    """
+    Compiles `entries` into one alternation with an empty marker group closing
+    each branch, so `match.lastindex` identifies the winning pattern. Python
+    tries alternatives left to right, which preserves first-match-wins order.
+    """
+    branches = []
+    markers = {}
+    group_index = 0
+    for entry in entries:
+        group_index += entry.regex.groups + 1
+        markers[group_index] = entry
+        branches.append(f'(?:{entry.pattern})()')
+    return _PatternGroup(entries[0].id, re.compile('|'.join(branches)), markers)
+
+
+def _compile_groups(entries):
+    try:
+        return [_compile_group(entries)]
+    except re.error as e:
+        # Should not happen for combinable patterns, but never let one odd
+        # pattern take the whole group down with it.
+        logger.warning("Falling back to per-pattern matching for %s triggers: %s", len(entries), e)
+        return [_PatternGroup(entry.id, entry.regex, entry=entry) for entry in entries]
+
+
+@dataclass
+class _PatternGroup:
+    first_id: int
+    regex: re.Pattern
+    markers: dict = None
+    entry: PatternEntry = None
+
+    def match(self, prompt):
+        match = self.regex.match(prompt)
+        if not match:
+            return None
+        if self.entry is not None:
+            return self.entry
+        return self.markers[match.lastindex]
+
+
+class PromptMatcher:
+    """
+    A compiled index over every active prompt trigger.
+
+    Patterns are bucketed in a trie keyed by their literal prefix, so a prompt
+    only ever reaches the patterns whose prefix it starts with. Within a trie
+    node the safe patterns are folded into a few large alternations that the
+    regex engine evaluates in a single call each.
+
+    Risky patterns (see `patterns.classify_pattern`) are matched on their own
+    under a time budget of `AGENT_GATEWAY_MATCH_BUDGET_MS`. With the `regex`
+    package installed the match is cut off at the budget; otherwise it is
+    timed after the fact. Either way a pattern that overruns the budget is
+    quarantined, as is any dangerous pattern that predates validation.
+
+    Prompts that no regex matches are then scored against the 'similarity'
+    triggers, if any, through a `similarity.SimilarityIndex`.
+
+    Results are memoised in an optional `MatchCache` keyed by this matcher's
+    trigger set version, so repeated prompts skip matching entirely.
+    """
+
+    def __init__(self, entries, version=None, budget=None, similarity=None, cache=None):
+        self.version = version
+        self.similarity = similarity
+        self.cache = cache
+        self.size = len(entries) + (similarity.size if similarity is not None else 0)
+        self._by_id = {entry.id: entry for entry in entries}
+        if similarity is not None:
+            self._by_id.update((entry.id, entry) for entry in similarity.entries)
+        if budget is None:
+            budget = getattr(settings, 'AGENT_GATEWAY_MATCH_BUDGET_MS', 50) / 1000
+        self.budget = budget
+        self._root = _TrieNode()
+        self._invalid = []
+        for entry in sorted(entries, key=lambda e: e.id):
+            if entry.error is not None:
+                self._invalid.append(entry)
+                continue
+            node = self._root
+            for char in literal_prefix(entry.pattern):
+                node = node.children.setdefault(char, _TrieNode())
+            node.entries.append(entry)
+
+    @classmethod
+    def from_triggers(cls, triggers, version=None, budget=None, cache=None):
+        entries = []
+        similar = []
+        for trigger in triggers:
+            if trigger.trigger_type == 'similarity':
+                similar.append(trigger)
+                continue
+            if trigger.prompt_pattern is None:
+                continue
+            entry = PatternEntry(
+                id=trigger.id,
+                name=trigger.name,
+                pattern=trigger.prompt_pattern,
+                payload_version=trigger.payload_version,
+                policy=ActionPolicy.for_trigger(trigger),
+            )
+            try:
+                entry.regex = re.compile(trigger.prompt_pattern)
+                entry.risk = classify_pattern(trigger.prompt_pattern).level
+            except re.error as e:
+                logger.error("Regex error for trigger %s: %s", trigger.name, e)
+                entry.error = e
+            if entry.risk == DANGEROUS:
+                quarantine(entry, 'pattern is prone to catastrophic backtracking')
+                continue
+            if entry.risk != SAFE and regex is not None:
+                try:
+                    entry.bounded = regex.compile(trigger.prompt_pattern)
+                except regex.error:
+                    pass
+            entries.append(entry)
+        return cls(entries, version=version, budget=budget, similarity=build_index(similar), cache=cache)
+
+    def _node_groups(self, node):
+        """
+        Lazily splits a node's entries into runs of combinable patterns, each
+        compiled as one alternation, and standalone patterns that must be
+        evaluated on their own. Order is preserved throughout.
+        """
+        if node.groups is None:
+            groups = []
+            run = []
+            for entry in node.entries:
+                if _is_combinable(entry):
+                    run.append(entry)
+                    if len(run) >= ALTERNATION_GROUP_SIZE:
+                        groups.extend(_compile_groups(run))
+                        run = []
+                    continue
+                if run:
+                    groups.extend(_compile_groups(run))
+                    run = []
+                groups.append(_PatternGroup(entry.id, entry.regex, entry=entry))
+            if run:
+                groups.extend(_compile_groups(run))
+            node.groups = groups
+        return node.groups
+
+    def _match_group(self, group, prompt):
+        entry = group.entry
+        if entry is None or entry.risk == SAFE:
+            return group.match(prompt)
+        if entry.quarantined:
+            return None
+        started = time.perf_counter()
+        try:
+            if entry.bounded is not None:
+                found = entry if entry.bounded.match(prompt, timeout=self.budget) else None
+            else:
+                found = group.match(prompt)
+        except TimeoutError:
+            quarantine(entry, f'match exceeded the {self.budget * 1000:g} ms budget')
+            return None
+        elapsed = time.perf_counter() - started
+        if elapsed > self.budget:
+            quarantine(entry, f'match took {elapsed * 1000:.0f} ms, over the {self.budget * 1000:g} ms budget')
+        return found
+
+    def match(self, prompt, shared=True):
+        """
+        Returns the first (lowest id) trigger whose pattern `re.match`es the
+        prompt, failing that the most similar 'similarity' trigger above its
+        threshold, or None.
+
+        Args:
+            prompt: The prompt to match.
+            shared: Whether the shared tier of the match cache may be used.
+                Async callers pass False to keep cache I/O off the event loop.
+
+        Raises:
+            PatternError: If a trigger with an invalid pattern would have been
+                evaluated before the first match.
+        """
+        if self.cache is None:
+            return self._match(prompt)
+        hit, trigger_id = self.cache.get(self.version, prompt, shared=shared)
+        if hit:
+            return self._by_id.get(trigger_id)
+        found = self._match(prompt)
+        self.cache.set(self.version, prompt, found.id if found is not None else None, shared=shared)
+        return found
+
+    def _match(self, prompt):
+        best = None
+        node = self._root
+        depth = 0
+        while node is not None:
+            for group in self._node_groups(node):
+                if best is not None and group.first_id > best.id:
+                    break
+                found = self._match_group(group, prompt)
+                if found is not None:
+                    if best is None or found.id < best.id:
+                        best = found
+                    break
+            if depth >= len(prompt):
+                break
+            node = node.children.get(prompt[depth])
+            depth += 1
+
+        for entry in self._invalid:
+            if best is not None and entry.id > best.id:
+                break
+            raise PatternError(entry.name, entry.error)
+        if best is None and self.similarity is not None:
+            best = self.similarity.best(prompt)
+        return best
+
+
+_matcher = None
+_matcher_lock = threading.Lock()
+_pending_quarantines = {}
+_quarantine_lock = threading.Lock()
+
+
+def quarantine(entry, reason):
+    """
+    Takes a trigger out of prompt matching in this process straight away and
+    queues the quarantine to be saved by `persist_quarantines`.
+    """
+    entry.quarantined = True
+    logger.warning(f"Quarantining trigger {entry.name}: {reason}")
+    with _quarantine_lock:
+        _pending_quarantines.setdefault(entry.id, reason)
+
+
+def persist_quarantines():
+    """
+    Saves queued quarantines and bumps the trigger set version so every
+    process drops the quarantined triggers from its matcher.
+
+    Returns:
+        The number of triggers quarantined.
+    """
+    from .models import AgentTrigger
+    with _quarantine_lock:
+        pending = dict(_pending_quarantines)
+        _pending_quarantines.clear()
+    now = timezone.now()
+    for trigger_id, reason in pending.items():
+        AgentTrigger.objects.filter(id=trigger_id, quarantined_at__isnull=True).update(
+            quarantined_at=now, quarantine_reason=reason[:255]
+        )
+    if pending:
+        bump_trigger_set_version()
+    return len(pending)
+
+
+def _prompt_triggers():
+    from .models import AgentTrigger
+    return AgentTrigger.objects.filter(
+        trigger_type__in=('prompt', 'similarity'), active=True, quarantined_at__isnull=True
+    ).only(
+        'id', 'name', 'trigger_type', 'prompt_pattern', 'payload_version', 'example_utterances', 'similarity_threshold',
+        'rate_limit', 'rate_burst', 'coalesce_window',
+    )
+
+
+def _install_matcher(triggers, version):
+    global _matcher
+    _matcher = PromptMatcher.from_triggers(triggers, version=version, cache=MatchCache.from_settings())
+    logger.info("Prompt matcher rebuilt with %s triggers (version %s)", _matcher.size, version)
+    return _matcher
+
+
+def get_prompt_matcher():
+    """
+    Returns the process-local `PromptMatcher`, rebuilding it only when the
+    trigger set version has moved on since it was last built.
+    """
+    if _pending_quarantines:
+        persist_quarantines()
+    version = trigger_set_version()
+    matcher = _matcher
+    if matcher is not None and matcher.version == version:
+        return matcher
+    with _matcher_lock:
+        if _matcher is None or _matcher.version != version:
+            return _install_matcher(_prompt_triggers(), version)
+        return _matcher
+
+
+async def aget_prompt_matcher():
+    """
+    Async counterpart of `get_prompt_matcher` for ASGI views.
+
+    The version lookup runs off the event loop, and a rebuild streams the
+    triggers with the async ORM.
+    """
+    if _pending_quarantines:
+        await sync_to_async(persist_quarantines)()
+    version = await sync_to_async(trigger_set_version)()
+    matcher = _matcher
+    if matcher is not None and matcher.version == version:
+        return matcher
+    triggers = [trigger async for trigger in _prompt_triggers()]
+    return _install_matcher(triggers, version)
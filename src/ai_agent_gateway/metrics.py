@@ -0,0 +1,322 @@
+import logging
+# agent_gateway/metrics.py
+import os
+import socket
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from asgiref.sync import sync_to_async
+from celery.signals import before_task_publish, task_postrun
+from django.conf import settings
+from django.core.cache import caches
+
+logger = logging.getLogger(__name__)
+
+METRICS_KEY_PREFIX = 'ai_agent_gateway:metrics'
+PROCESS_INDEX_KEY = f'{METRICS_KEY_PREFIX}:processes'
+
+# Histogram bucket upper bounds, in seconds. They span sub-millisecond regex
+# matches up to agent calls that time out after minutes.
+BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+    0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0,
+)
+
+# Series label used for stages that are not tied to one trigger, and for
+# triggers past the series cap.
+NO_TRIGGER = '-'
+OTHER_TRIGGERS = 'other'
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class Histogram:
+    """
+    A fixed-bucket latency histogram. Buckets (rather than raw samples) keep
+    memory constant and let histograms from different processes be merged
+    by adding their counts.
+    """
+    __slots__ = ('counts', 'sum', 'count')
+
+    def __init__(self, counts=None, total=0.0, count=0):
+        self.counts = list(counts) if counts is not None else [0] * (len(BUCKETS) + 1)
+        self.sum = total
+        self.count = count
+
+    def observe(self, seconds):
+        self.counts[bisect_left(BUCKETS, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+
+    def merge(self, other):
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.sum += other.sum
+        self.count += other.count
+
+    def quantile(self, q):
+        """
+        Estimates the `q` quantile, interpolating linearly within a bucket.
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, bucket_count in enumerate(self.counts):
+            if bucket_count and seen + bucket_count >= rank:
+                if i == len(BUCKETS):
+                    return BUCKETS[-1]
+                lower = BUCKETS[i - 1] if i else 0.0
+                return lower + (BUCKETS[i] - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+        return BUCKETS[-1]
+
+
+class MetricsRegistry:
+    """
+    Timing histograms per `(stage, trigger)`, plus plain event counters.
+
+    At most `AGENT_GATEWAY_METRICS_MAX_SERIES` series are kept per process;
+    once the cap is reached, new triggers are counted under 'other'.
+    """
+
+    def __init__(self, max_series=None):
+        if max_series is None:
+            max_series = getattr(settings, 'AGENT_GATEWAY_METRICS_MAX_SERIES', 5000)
+        self.max_series = max_series
+        self.series = {}
+        self.names = {}
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    def increment(self, name, amount=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def observe(self, stage, seconds, trigger=None, name=None):
+        trigger = NO_TRIGGER if trigger is None else str(trigger)
+        with self._lock:
+            key = (stage, trigger)
+            histogram = self.series.get(key)
+            if histogram is None:
+                if len(self.series) >= self.max_series:
+                    key = (stage, OTHER_TRIGGERS)
+                    histogram = self.series.get(key)
+                if histogram is None:
+                    histogram = self.series[key] = Histogram()
+            histogram.observe(seconds)
+            if name is not None and key[1] == trigger:
+                self.names[trigger] = name
+
+    def snapshot(self):
+        """
+        Returns a JSON-serializable copy of every series.
+        """
+        with self._lock:
+            return {
+                'series': [[stage, trigger, h.counts, h.sum, h.count] for (stage, trigger), h in self.series.items()],
+                'names': dict(self.names),
+                'counters': dict(self.counters),
+            }
+
+    def merge_snapshot(self, snapshot):
+        with self._lock:
+            for stage, trigger, counts, total, count in snapshot['series']:
+                other = Histogram(counts, total, count)
+                histogram = self.series.get((stage, trigger))
+                if histogram is None:
+                    self.series[(stage, trigger)] = other
+                else:
+                    histogram.merge(other)
+            self.names.update(snapshot['names'])
+            for name, value in snapshot.get('counters', {}).items():
+                self.counters[name] = self.counters.get(name, 0) + value
+
+    def summary(self):
+        """
+        Returns one row per series with its count and p50/p95/p99/mean in
+        milliseconds, slowest p99 first.
+        """
+        rows = []
+        with self._lock:
+            for (stage, trigger), histogram in self.series.items():
+                row = {
+                    'stage': stage,
+                    'trigger': trigger,
+                    'name': self.names.get(trigger, ''),
+                    'count': histogram.count,
+                    'mean_ms': round(histogram.sum / histogram.count * 1000, 3) if histogram.count else None,
+                }
+                for q in QUANTILES:
+                    value = histogram.quantile(q)
+                    row[f'p{int(q * 100)}_ms'] = round(value * 1000, 3) if value is not None else None
+                rows.append(row)
+        rows.sort(key=lambda row: -(row['p99_ms'] or 0))
+        return rows
+
+    def prometheus(self):
+        """
+        Renders every series and counter in the Prometheus text exposition
+        format.
+        """
+        lines = [
+            '# HELP agent_gateway_stage_seconds Time spent per gateway stage and trigger.',
+            '# TYPE agent_gateway_stage_seconds histogram',
+        ]
+        with self._lock:
+            for (stage, trigger), histogram in sorted(self.series.items()):
+                labels = f'stage="{stage}",trigger="{trigger}"'
+                cumulative = 0
+                for bound, bucket_count in zip((*BUCKETS, '+Inf'), histogram.counts):
+                    cumulative += bucket_count
+                    lines.append(f'agent_gateway_stage_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+                lines.append(f'agent_gateway_stage_seconds_sum{{{labels}}} {histogram.sum:.6f}')
+                lines.append(f'agent_gateway_stage_seconds_count{{{labels}}} {histogram.count}')
+            counters = sorted(self.counters.items())
+        for name, value in counters:
+            lines += [f'# TYPE agent_gateway_{name}_total counter', f'agent_gateway_{name}_total {value}']
+        return '\n'.join(lines) + '\n'
+
+
+class Span:
+    """
+    A timed stage, as yielded by `span`. The trigger can be set once known,
+    e.g. after matching.
+    """
+    __slots__ = ('stage', 'trigger', 'name', 'started')
+
+    def __init__(self, stage, trigger=None, name=None):
+        self.stage = stage
+        self.trigger = trigger
+        self.name = name
+        self.started = time.perf_counter()
+
+
+registry = MetricsRegistry()
+
+
+@contextmanager
+def span(stage, trigger=None, name=None):
+    """
+    Times the enclosed block as `stage`, records it in the process registry
+    and logs it as a structured DEBUG record.
+    """
+    current = Span(stage, trigger, name)
+    try:
+        yield current
+    finally:
+        elapsed = time.perf_counter() - current.started
+        observe(current.stage, elapsed, current.trigger, current.name)
+
+
+def increment(name, amount=1):
+    registry.increment(name, amount)
+
+
+def observe(stage, seconds, trigger=None, name=None):
+    registry.observe(stage, seconds, trigger, name)
+    logger.debug(
+        f"{stage} took {seconds * 1000:.3f} ms",
+        extra={'stage': stage, 'trigger_id': trigger, 'trigger_name': name, 'duration_ms': round(seconds * 1000, 3)},
+    )
+
+
+def shared_cache():
+    """
+    Returns the cache the processes publish their metrics to, from
+    `AGENT_GATEWAY_SHARED_CACHE_ALIAS`, or None if none is configured.
+    """
+    alias = getattr(settings, 'AGENT_GATEWAY_SHARED_CACHE_ALIAS', None)
+    return caches[alias] if alias else None
+
+
+def _process_key():
+    return f'{METRICS_KEY_PREFIX}:{socket.gethostname()}:{os.getpid()}'
+
+
+_last_publish = 0.0
+
+
+def _publish_interval():
+    return getattr(settings, 'AGENT_GATEWAY_METRICS_PUBLISH_SECONDS', 10)
+
+
+def maybe_publish(force=False):
+    """
+    Publishes this process's histograms to the shared cache, at most once per
+    `AGENT_GATEWAY_METRICS_PUBLISH_SECONDS` (default 10), so the scrape
+    endpoint can include the Celery workers' stages. Does nothing without a
+    shared cache (see `shared_cache`).
+    """
+    global _last_publish
+    cache = shared_cache()
+    if cache is None:
+        return False
+    interval = _publish_interval()
+    now = time.monotonic()
+    if not force and now - _last_publish < interval:
+        return False
+    _last_publish = now
+    key = _process_key()
+    timeout = max(interval * 30, 300)
+    try:
+        cache.set(key, registry.snapshot(), timeout=timeout)
+        processes = cache.get(PROCESS_INDEX_KEY) or []
+        if key not in processes:
+            cache.set(PROCESS_INDEX_KEY, [*processes, key], timeout=None)
+    except Exception as e:
+        logger.warning(f"Could not publish gateway metrics: {e}")
+        return False
+    return True
+
+
+async def amaybe_publish():
+    """
+    Async counterpart of `maybe_publish` for ASGI views. The cache writes run
+    off the event loop, and only when a publish is due.
+    """
+    if shared_cache() is None or time.monotonic() - _last_publish < _publish_interval():
+        return False
+    return await sync_to_async(maybe_publish, thread_sensitive=False)()
+
+
+def collect():
+    """
+    Returns a registry merging this process's histograms with those recently
+    published by other processes.
+    """
+    merged = MetricsRegistry(max_series=float('inf'))
+    merged.merge_snapshot(registry.snapshot())
+    cache = shared_cache()
+    if cache is None:
+        return merged
+    own = _process_key()
+    try:
+        processes = cache.get(PROCESS_INDEX_KEY) or []
+        snapshots = cache.get_many([key for key in processes if key != own])
+    except Exception as e:
+        logger.warning(f"Could not read published gateway metrics: {e}")
+        return merged
+    for snapshot in snapshots.values():
+        merged.merge_snapshot(snapshot)
+    stale = [key for key in processes if key != own and key not in snapshots]
+    if stale:
+        cache.set(PROCESS_INDEX_KEY, [key for key in processes if key not in stale], timeout=None)
+    return merged
+
+
+def stamp_published_at(headers=None, **kwargs):
+    """
+    Adds the publish time to every task message, so workers can record how
+    long the message waited in the queue.
+    """
+    if headers is not None:
+        headers.setdefault('published_at', time.time())
+
+
+def publish_after_task(**kwargs):
+    maybe_publish()
+
+
+before_task_publish.connect(stamp_published_at)
+task_postrun.connect(publish_after_task)
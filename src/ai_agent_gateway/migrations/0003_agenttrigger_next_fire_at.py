@@ -0,0 +1,48 @@
+# Generated by Django 5.1.15 on 2026-10-17 06:11
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def populate_next_fire_at(apps, schema_editor):
+    AgentTrigger = apps.get_model("ai_agent_gateway", "AgentTrigger")
+    now = timezone.now()
+    triggers = AgentTrigger.objects.filter(
+        active=True, trigger_type__in=["scheduled", "periodic"]
+    )
+    for trigger in triggers.iterator():
+        if trigger.trigger_type == "scheduled":
+            next_fire_at = trigger.scheduled_time
+        elif trigger.periodic_interval is None:
+            continue
+        elif trigger.last_triggered is None:
+            next_fire_at = now
+        else:
+            try:
+                next_fire_at = trigger.last_triggered + trigger.periodic_interval
+            except OverflowError:
+                continue
+        AgentTrigger.objects.filter(pk=trigger.pk).update(next_fire_at=next_fire_at)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("ai_agent_gateway", "0002_alter_agenttrigger_action_payload"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="agenttrigger",
+            name="next_fire_at",
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name="agenttrigger",
+            index=models.Index(
+                condition=models.Q(("active", True), ("next_fire_at__isnull", False)),
+                fields=["trigger_type", "next_fire_at"],
+                name="agent_trigger_due_idx",
+            ),
+        ),
+        migrations.RunPython(populate_next_fire_at, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.1.15 on 2026-10-17 06:17
+
+from django.db import migrations, models
+
+from ai_agent_gateway.payloads import payload_digest
+
+
+def populate_payload_hash(apps, schema_editor):
+    AgentTrigger = apps.get_model('ai_agent_gateway', 'AgentTrigger')
+    for trigger in AgentTrigger.objects.only('id', 'action_payload').iterator():
+        AgentTrigger.objects.filter(pk=trigger.pk).update(payload_hash=payload_digest(trigger.action_payload))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ai_agent_gateway', '0003_agenttrigger_next_fire_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='agenttrigger',
+            name='payload_hash',
+            field=models.CharField(blank=True, editable=False, max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name='agenttrigger',
+            name='payload_version',
+            field=models.PositiveIntegerField(default=1, editable=False),
+        ),
+        migrations.RunPython(populate_payload_hash, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.1.15 on 2026-10-17 06:19
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ai_agent_gateway', '0004_agenttrigger_payload_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TriggerFiring',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('trigger_name', models.CharField(blank=True, max_length=255)),
+                ('fired_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('payload_version', models.PositiveIntegerField(blank=True, null=True)),
+                ('succeeded', models.BooleanField(default=True)),
+                ('error', models.TextField(blank=True)),
+                ('trigger', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='firings', to='ai_agent_gateway.agenttrigger')),
+            ],
+            options={
+                'ordering': ['-fired_at'],
+                'indexes': [models.Index(fields=['trigger', '-fired_at'], name='ai_agent_ga_trigger_76b5c3_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 5.1.15 on 2026-10-17 06:25
+
+import re
+
+import ai_agent_gateway.patterns
+from django.db import migrations, models
+
+
+def populate_pattern_risk(apps, schema_editor):
+    AgentTrigger = apps.get_model('ai_agent_gateway', 'AgentTrigger')
+    triggers = AgentTrigger.objects.exclude(prompt_pattern__isnull=True).exclude(prompt_pattern='')
+    for trigger in triggers.only('id', 'prompt_pattern').iterator():
+        try:
+            risk = ai_agent_gateway.patterns.classify_pattern(trigger.prompt_pattern).level
+        except re.error:
+            continue
+        AgentTrigger.objects.filter(pk=trigger.pk).update(pattern_risk=risk)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ai_agent_gateway', '0005_triggerfiring'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='agenttrigger',
+            name='pattern_risk',
+            field=models.CharField(blank=True, choices=[('safe', 'Safe'), ('risky', 'Risky'), ('dangerous', 'Dangerous')], editable=False, max_length=10),
+        ),
+        migrations.AddField(
+            model_name='agenttrigger',
+            name='quarantine_reason',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='agenttrigger',
+            name='quarantined_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='agenttrigger',
+            name='prompt_pattern',
+            field=models.CharField(blank=True, help_text='Regex pattern for prompt trigger', max_length=255, null=True, validators=[ai_agent_gateway.patterns.validate_prompt_pattern]),
+        ),
+        migrations.RunPython(populate_pattern_risk, migrations.RunPython.noop),
+    ]
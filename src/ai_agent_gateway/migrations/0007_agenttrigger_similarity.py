@@ -0,0 +1,28 @@
+# Generated by Django 5.1.15 on 2026-10-17 06:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ai_agent_gateway', '0006_agenttrigger_pattern_quarantine'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='agenttrigger',
+            name='example_utterances',
+            field=models.JSONField(blank=True, default=list, help_text='Example prompts for similarity trigger'),
+        ),
+        migrations.AddField(
+            model_name='agenttrigger',
+            name='similarity_threshold',
+            field=models.FloatField(blank=True, help_text='Minimum cosine similarity for similarity trigger', null=True),
+        ),
+        migrations.AlterField(
+            model_name='agenttrigger',
+            name='trigger_type',
+            field=models.CharField(choices=[('prompt', 'Prompt'), ('scheduled', 'Scheduled'), ('periodic', 'Periodic'), ('similarity', 'Similarity')], max_length=20),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.1.15 on 2026-10-17 06:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ai_agent_gateway', '0007_agenttrigger_similarity'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='agenttrigger',
+            name='coalesce_window',
+            field=models.DurationField(blank=True, help_text='Merge firings within this window into one action', null=True),
+        ),
+        migrations.AddField(
+            model_name='agenttrigger',
+            name='rate_burst',
+            field=models.PositiveIntegerField(blank=True, help_text='Token bucket capacity, defaults to the rate limit', null=True),
+        ),
+        migrations.AddField(
+            model_name='agenttrigger',
+            name='rate_limit',
+            field=models.PositiveIntegerField(blank=True, help_text='Maximum agent actions per minute', null=True),
+        ),
+        migrations.AddField(
+            model_name='triggerfiring',
+            name='count',
+            field=models.PositiveIntegerField(default=1),
+        ),
+    ]
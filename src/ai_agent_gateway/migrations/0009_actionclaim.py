@@ -0,0 +1,22 @@
+# Generated by Django 5.1.15 on 2026-10-17 06:46
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ai_agent_gateway', '0008_agenttrigger_throttling'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ActionClaim',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=255, unique=True)),
+                ('claimed_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+            ],
+        ),
+    ]
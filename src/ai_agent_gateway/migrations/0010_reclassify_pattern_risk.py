@@ -0,0 +1,39 @@
+# Generated by Django 5.1.15 on 2026-10-17 14:02
+
+import re
+
+import ai_agent_gateway.patterns
+from django.db import migrations
+
+BATCH_SIZE = 500
+
+
+def reclassify_pattern_risk(apps, schema_editor):
+    # Bounded repeats are now checked too, so some stored levels are stale.
+    AgentTrigger = apps.get_model('ai_agent_gateway', 'AgentTrigger')
+    triggers = AgentTrigger.objects.exclude(prompt_pattern__isnull=True).exclude(prompt_pattern='')
+    changed = []
+    for trigger in triggers.only('id', 'prompt_pattern', 'pattern_risk').iterator(chunk_size=BATCH_SIZE):
+        try:
+            risk = ai_agent_gateway.patterns.classify_pattern(trigger.prompt_pattern).level
+        except re.error:
+            continue
+        if risk != trigger.pattern_risk:
+            trigger.pattern_risk = risk
+            changed.append(trigger)
+        if len(changed) >= BATCH_SIZE:
+            AgentTrigger.objects.bulk_update(changed, ['pattern_risk'])
+            changed = []
+    if changed:
+        AgentTrigger.objects.bulk_update(changed, ['pattern_risk'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ai_agent_gateway', '0009_actionclaim'),
+    ]
+
+    operations = [
+        migrations.RunPython(reclassify_pattern_risk, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.1.15 on 2026-10-17 14:20
+
+from django.db import migrations, models
+
+
+def create_version_row(apps, schema_editor):
+    TriggerSetVersion = apps.get_model('ai_agent_gateway', 'TriggerSetVersion')
+    TriggerSetVersion.objects.get_or_create(pk=1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ai_agent_gateway', '0010_reclassify_pattern_risk'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TriggerSetVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.PositiveBigIntegerField(default=1)),
+            ],
+        ),
+        migrations.RunPython(create_version_row, migrations.RunPython.noop),
+    ]
@@ -1,7 +1,16 @@
 import logging
 # agent_gateway/models.py
+import hashlib
+import re
+from datetime import datetime, timedelta, timezone as dt_timezone
+from django.conf import settings
+from django.core.exceptions import ValidationError
 from django.db import models
+from django.db.models.signals import post_save, post_delete
 from django.utils import timezone
+from .matcher import bump_trigger_set_version
+from .patterns import RISK_LEVELS, classify_pattern, validate_prompt_pattern
+from .payloads import payload_digest
 
 logger = logging.getLogger(__name__)
 
@@ -21,26 +30,112 @@ class AgentTrigger(models.Model):
         last_triggered (datetime, optional): The last time the trigger was activated.
         active (bool): Whether the trigger is currently active.
         action_payload (dict): A JSON object containing instructions for the agent.
+        example_utterances (list): Example prompts that a 'similarity' trigger matches.
+        similarity_threshold (float, optional): The cosine similarity a prompt must reach
+            to activate a 'similarity' trigger. Defaults to `similarity.DEFAULT_THRESHOLD`.
+        next_fire_at (datetime, optional): When a scheduled or periodic trigger is next
+            due. Denormalized from the fields above on save and after each firing so
+            the Beat scans can use an index range scan.
+        payload_version (int): Incremented whenever `action_payload` changes. Task
+            messages carry `(id, payload_version)` instead of the payload itself.
+        payload_hash (str): SHA-256 digest of the canonical `action_payload`, used to
+            detect payload changes on save.
+        pattern_risk (str): The backtracking risk of `prompt_pattern`, classified on save.
+        quarantined_at (datetime, optional): When the trigger was taken out of prompt
+            matching because its pattern overran the match budget.
+        quarantine_reason (str): Why the trigger was quarantined.
+        rate_limit (int, optional): The maximum number of agent actions per minute the
+            trigger may start from prompts. Enforced with a token bucket.
+        rate_burst (int, optional): The token bucket capacity. Defaults to `rate_limit`.
+        coalesce_window (timedelta, optional): Prompt firings within this window are
+            merged into a single agent action carrying the number of firings.
     """
     TRIGGER_TYPES = (
         ('prompt', 'Prompt'),
         ('scheduled', 'Scheduled'),
         ('periodic', 'Periodic'),
+        ('similarity', 'Similarity'),
     )
     name = models.CharField(max_length=255)
     trigger_type = models.CharField(max_length=20, choices=TRIGGER_TYPES)
-    prompt_pattern = models.CharField(max_length=255, blank=True, null=True, help_text="Regex pattern for prompt trigger")
+    prompt_pattern = models.CharField(max_length=255, blank=True, null=True, help_text="Regex pattern for prompt trigger", validators=[validate_prompt_pattern])
     scheduled_time = models.DateTimeField(blank=True, null=True, help_text="Time for scheduled trigger")
     periodic_interval = models.DurationField(blank=True, null=True, help_text="Interval for periodic trigger")
     last_triggered = models.DateTimeField(blank=True, null=True)
     active = models.BooleanField(default=True)
     action_payload = models.JSONField(default=dict, blank=True, null=True)
+    example_utterances = models.JSONField(default=list, blank=True, help_text="Example prompts for similarity trigger")
+    similarity_threshold = models.FloatField(blank=True, null=True, help_text="Minimum cosine similarity for similarity trigger")
+    next_fire_at = models.DateTimeField(blank=True, null=True, editable=False)
+    payload_version = models.PositiveIntegerField(default=1, editable=False)
+    payload_hash = models.CharField(max_length=64, blank=True, null=True, editable=False)
+    pattern_risk = models.CharField(max_length=10, choices=RISK_LEVELS, blank=True, editable=False)
+    quarantined_at = models.DateTimeField(blank=True, null=True)
+    quarantine_reason = models.CharField(max_length=255, blank=True)
+    rate_limit = models.PositiveIntegerField(blank=True, null=True, help_text="Maximum agent actions per minute")
+    rate_burst = models.PositiveIntegerField(blank=True, null=True, help_text="Token bucket capacity, defaults to the rate limit")
+    coalesce_window = models.DurationField(blank=True, null=True, help_text="Merge firings within this window into one action")
 
     def __str__(self):
         return self.name
 
+    def compute_next_fire_at(self, now=None):
+        """
+        Returns when this trigger is next due, or None if it never fires on a timer.
+
+        Scheduled triggers are due at `scheduled_time`. Periodic triggers are due
+        one `periodic_interval` after `last_triggered` (on their phase, see
+        `next_periodic_fire_at`), or straight away if they have never fired.
+        """
+        if not self.active:
+            return None
+        if self.trigger_type == 'scheduled':
+            return self.scheduled_time
+        if self.trigger_type == 'periodic' and self.periodic_interval is not None:
+            if self.last_triggered is None:
+                return now or timezone.now()
+            return next_periodic_fire_at(self.id, self.periodic_interval, self.last_triggered)
+        return None
+
+    def clean(self):
+        if self.trigger_type == 'similarity':
+            utterances = self.example_utterances
+            if not isinstance(utterances, list) or not utterances or not all(isinstance(u, str) and u.strip() for u in utterances):
+                raise ValidationError({'example_utterances': 'Similarity triggers need a list of non-empty example prompts.'})
+        if self.similarity_threshold is not None and not -1 <= self.similarity_threshold <= 1:
+            raise ValidationError({'similarity_threshold': 'The threshold must be between -1 and 1.'})
+        if self.rate_burst and not self.rate_limit:
+            raise ValidationError({'rate_burst': 'A burst size needs a rate limit.'})
+        if self.coalesce_window is not None and self.coalesce_window.total_seconds() <= 0:
+            raise ValidationError({'coalesce_window': 'The coalescing window must be positive.'})
+
+    def compute_pattern_risk(self):
+        """
+        Returns the backtracking risk level of `prompt_pattern`, or '' if there
+        is no valid pattern to classify.
+        """
+        if not self.prompt_pattern:
+            return ''
+        try:
+            return classify_pattern(self.prompt_pattern).level
+        except re.error:
+            return ''
+
     def save(self, *args, **kwargs):
         is_new = self._state.adding
+        self.next_fire_at = self.compute_next_fire_at()
+        self.pattern_risk = self.compute_pattern_risk()
+        changed = ['next_fire_at', 'pattern_risk']
+        if 'action_payload' not in self.get_deferred_fields():
+            digest = payload_digest(self.action_payload)
+            if digest != self.payload_hash:
+                if self.payload_hash is not None:
+                    self.payload_version += 1
+                self.payload_hash = digest
+                changed += ['payload_hash', 'payload_version']
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = [*update_fields, *(f for f in changed if f not in update_fields)]
         super().save(*args, **kwargs)
         if is_new:
             logger.info(f"New AgentTrigger created: {self.name}")
@@ -54,4 +149,149 @@ class AgentTrigger(models.Model):
     class Meta:
         indexes = [
             models.Index(fields=['trigger_type', 'active']),
+            models.Index(
+                fields=['trigger_type', 'next_fire_at'],
+                condition=models.Q(active=True, next_fire_at__isnull=False),
+                name='agent_trigger_due_idx',
+            ),
+        ]
+
+class TriggerFiring(models.Model):
+    """
+    One firing of an `AgentTrigger`, kept as an audit trail.
+
+    Firings are written in bulk by the worker's `history.FiringBuffer`. The
+    trigger's name is copied in so the record stays readable after the trigger
+    is deleted.
+
+    Attributes:
+        trigger (AgentTrigger, optional): The trigger that fired.
+        trigger_name (str): The trigger's name when the firing was written.
+        fired_at (datetime): When the agent action was performed.
+        payload_version (int, optional): The payload version that was sent.
+        succeeded (bool): Whether the agent call succeeded.
+        error (str): The error the agent call failed with, if any.
+        count (int): The number of firings coalesced into this agent action.
+    """
+    trigger = models.ForeignKey(AgentTrigger, on_delete=models.SET_NULL, null=True, blank=True, related_name='firings')
+    trigger_name = models.CharField(max_length=255, blank=True)
+    fired_at = models.DateTimeField(default=timezone.now)
+    payload_version = models.PositiveIntegerField(blank=True, null=True)
+    succeeded = models.BooleanField(default=True)
+    error = models.TextField(blank=True)
+    count = models.PositiveIntegerField(default=1)
+
+    def __str__(self):
+        return f"{self.trigger_name} at {self.fired_at}"
+
+    class Meta:
+        ordering = ['-fired_at']
+        indexes = [
+            models.Index(fields=['trigger', '-fired_at']),
         ]
+
+class ActionClaim(models.Model):
+    """
+    An idempotency key claimed by an agent action, used by
+    `dedup.DatabaseDedupSet` when Redis is not configured.
+
+    Attributes:
+        key (str): The idempotency key, e.g. `<trigger id>:<fire time>`.
+        claimed_at (datetime): When the key was claimed. Claims older than
+            `AGENT_GATEWAY_DEDUP_TTL` seconds are expired.
+    """
+    key = models.CharField(max_length=255, unique=True)
+    claimed_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    def __str__(self):
+        return self.key
+
+class TriggerSetVersion(models.Model):
+    """
+    The version of the active trigger set, a single row rewritten by
+    `matcher.bump_trigger_set_version`.
+
+    It lives in the database rather than a cache so that every web and worker
+    process sees the same version without a shared cache backend.
+    """
+    version = models.PositiveBigIntegerField(default=1)
+
+    def __str__(self):
+        return str(self.version)
+
+def add_interval(moment, interval):
+    """
+    Returns `moment + interval`, or None if the result is past `datetime.max`
+    (i.e. the trigger will never be due).
+    """
+    try:
+        return moment + interval
+    except OverflowError:
+        return None
+
+# Periodic triggers are spread over their interval relative to this moment.
+PHASE_EPOCH = datetime(2000, 1, 1, tzinfo=dt_timezone.utc)
+
+def periodic_spread():
+    """
+    How periodic firings are spread out, from `AGENT_GATEWAY_PERIODIC_SPREAD`:
+
+    - 'off' (the default): a trigger is next due one interval after it fired,
+      so triggers created or fired together stay in lockstep.
+    - 'phase': each trigger is due at its own fixed offset into its interval
+      (see `phase_offset`).
+    - 'smooth': as 'phase', and the periodic scan also claims firings due
+      before its next run and sends each one at its due time (see
+      `tasks.fire_due_triggers`).
+    """
+    mode = getattr(settings, 'AGENT_GATEWAY_PERIODIC_SPREAD', 'off')
+    return mode if mode in ('phase', 'smooth') else 'off'
+
+def phase_offset(trigger_id, interval):
+    """
+    Returns a deterministic offset in `[0, interval)` hashed from the trigger
+    id. Hashing spreads consecutive ids uniformly, and every process and
+    scheduler node derives the same offset without coordination.
+    """
+    period = interval // timedelta(microseconds=1)
+    if period <= 0:
+        return timedelta(0)
+    digest = hashlib.blake2b(str(trigger_id).encode(), digest_size=8).digest()
+    return timedelta(microseconds=int.from_bytes(digest, 'big') % period)
+
+def next_phase_slot(trigger_id, interval, after):
+    """
+    Returns the first moment strictly after `after` that is a whole number of
+    intervals past `PHASE_EPOCH + phase_offset(trigger_id, interval)`, or None
+    if that is past `datetime.max`. Missed slots are skipped rather than
+    fired in a burst.
+    """
+    if interval <= timedelta(0):
+        return add_interval(after, interval)
+    try:
+        origin = PHASE_EPOCH + phase_offset(trigger_id, interval)
+        return origin + interval * ((after - origin) // interval + 1)
+    except OverflowError:
+        return None
+
+def next_periodic_fire_at(trigger_id, interval, fired_at):
+    """
+    Returns when a periodic trigger that fired at `fired_at` is next due: on
+    its phase when periodic firings are spread, else one interval later.
+    """
+    if trigger_id is None or periodic_spread() == 'off':
+        return add_interval(fired_at, interval)
+    return next_phase_slot(trigger_id, interval, fired_at)
+
+def agent_trigger_changed(sender, instance, *args, **kwargs):
+    """
+    A post-save/post-delete signal handler for the AgentTrigger model.
+
+    Bumps the trigger set version so every process rebuilds its compiled
+    prompt matcher. The bump is part of the same transaction as the change,
+    so other processes see the new version and the new trigger set together.
+    """
+    bump_trigger_set_version()
+
+post_save.connect(agent_trigger_changed, sender=AgentTrigger)
+post_delete.connect(agent_trigger_changed, sender=AgentTrigger)
@@ -0,0 +1,219 @@
+import logging
+# agent_gateway/patterns.py
+import re
+from dataclasses import dataclass, field
+from django.core.exceptions import ValidationError
+
+try:
+    from re import _constants as sre_constants, _parser as sre_parse
+except ImportError:  # Python < 3.11
+    import sre_constants
+    import sre_parse
+
+logger = logging.getLogger(__name__)
+
+SAFE = 'safe'
+RISKY = 'risky'
+DANGEROUS = 'dangerous'
+
+RISK_LEVELS = (
+    (SAFE, 'Safe'),
+    (RISKY, 'Risky'),
+    (DANGEROUS, 'Dangerous'),
+)
+
+_REPEATS = (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT)
+# Character classes wider than this are treated as "could be anything".
+_MAX_EXPANDED_RANGE = 256
+# A bounded repeat that can run more times than this, counting the repeats
+# around it, is checked like an unbounded one: `(a|a){1,40}` backtracks as
+# badly as `(a|a)+` on any prompt of realistic length.
+_MAX_BOUNDED_REPEAT = 10
+
+
+@dataclass
+class PatternCheck:
+    """
+    The backtracking risk of a regex.
+
+    `dangerous` patterns can take exponential time (nested quantifiers,
+    overlapping alternatives under a quantifier) and are rejected on save.
+    `risky` patterns can take polynomial time or use backreferences; they are
+    allowed but matched one at a time under the match budget.
+    """
+    level: str = SAFE
+    reasons: list = field(default_factory=list)
+
+    def flag(self, level, reason):
+        if level == DANGEROUS or self.level == SAFE:
+            self.level = level
+        if reason not in self.reasons:
+            self.reasons.append(reason)
+
+
+_CATEGORIES = {
+    sre_constants.CATEGORY_DIGIT: re.compile(r'\d'),
+    sre_constants.CATEGORY_NOT_DIGIT: re.compile(r'\D'),
+    sre_constants.CATEGORY_SPACE: re.compile(r'\s'),
+    sre_constants.CATEGORY_NOT_SPACE: re.compile(r'\S'),
+    sre_constants.CATEGORY_WORD: re.compile(r'\w'),
+    sre_constants.CATEGORY_NOT_WORD: re.compile(r'\W'),
+}
+
+
+def _class_contains(items, char):
+    """
+    Whether the parsed character class `items` matches `char`, or None if
+    the class uses a construct this check does not know.
+    """
+    negate = False
+    found = False
+    for op, av in items:
+        if op == sre_constants.NEGATE:
+            negate = True
+        elif op == sre_constants.LITERAL:
+            found = found or chr(av) == char
+        elif op == sre_constants.RANGE:
+            found = found or av[0] <= ord(char) <= av[1]
+        elif op == sre_constants.CATEGORY and av in _CATEGORIES:
+            found = found or bool(_CATEGORIES[av].match(char))
+        else:
+            return None
+    return found != negate
+
+
+def _charset(items):
+    """
+    Describes the characters the first element of `items` can match.
+
+    Returns:
+        A frozenset of (lower-cased) characters when the set is small and
+        known, a membership test for a known but large class, or None when
+        the element could match anything.
+    """
+    if not items:
+        return frozenset()
+    op, av = items[0]
+    if op == sre_constants.LITERAL:
+        return frozenset(chr(av).lower())
+    if op == sre_constants.NOT_LITERAL:
+        return lambda char: char.lower() != chr(av).lower()
+    if op == sre_constants.IN:
+        chars = set()
+        for item_op, item_av in av:
+            if item_op == sre_constants.LITERAL:
+                chars.add(chr(item_av).lower())
+            elif item_op == sre_constants.RANGE and item_av[1] - item_av[0] < _MAX_EXPANDED_RANGE:
+                chars.update(chr(c).lower() for c in range(item_av[0], item_av[1] + 1))
+            else:
+                return lambda char: _class_contains(av, char) is not False or _class_contains(av, char.upper()) is not False
+        return frozenset(chars)
+    if op == sre_constants.SUBPATTERN:
+        return _charset(av[-1])
+    if op in _REPEATS and av[0] > 0:
+        return _charset(av[2])
+    return None
+
+
+def _overlaps(first, second):
+    if first is None or second is None:
+        return True
+    if isinstance(first, frozenset) and isinstance(second, frozenset):
+        return bool(first & second)
+    if isinstance(second, frozenset):
+        first, second = second, first
+    if isinstance(first, frozenset):
+        return any(second(char) for char in first)
+    return True
+
+
+def _walk(items, check, in_loop, loop_chars=None, bound=1):
+    # Variable-length repeats seen so far at this level that could still be
+    # extended by what follows them, e.g. the `\d+` in `\d+\d+`.
+    open_repeats = []
+    for op, av in items:
+        if op in _REPEATS:
+            low, high, body = av
+            repeat_bound = bound * high
+            loops = high == sre_constants.MAXREPEAT or repeat_bound > _MAX_BOUNDED_REPEAT
+            if loops and low != high:
+                if in_loop:
+                    check.flag(DANGEROUS, 'nested quantifiers')
+                chars = _charset(body)
+                if any(_overlaps(chars, previous) for previous in open_repeats):
+                    check.flag(RISKY, 'adjacent quantifiers over overlapping characters')
+                open_repeats.append(chars)
+            if loops:
+                _walk(body, check, True, _charset(body), repeat_bound)
+            else:
+                _walk(body, check, in_loop, loop_chars, repeat_bound)
+            continue
+        if op == sre_constants.SUBPATTERN:
+            _walk(av[-1], check, in_loop, loop_chars, bound)
+        elif op == sre_constants.BRANCH:
+            if in_loop:
+                # The parser factors common prefixes out, so `(a|aa)` arrives
+                # as `a(?:|a)`. An empty alternative is followed by the next
+                # iteration of the loop.
+                firsts = [_charset(branch) if branch else loop_chars for branch in av[1]]
+                for i, first in enumerate(firsts):
+                    if any(_overlaps(first, other) for other in firsts[i + 1:]):
+                        check.flag(DANGEROUS, 'overlapping alternatives under a quantifier')
+                        break
+            for branch in av[1]:
+                _walk(branch, check, in_loop, loop_chars, bound)
+        elif op in (sre_constants.ASSERT, sre_constants.ASSERT_NOT):
+            _walk(av[1], check, False)
+        elif op == getattr(sre_constants, 'ATOMIC_GROUP', None):
+            # Atomic groups never backtrack into themselves.
+            _walk(av, check, False)
+            open_repeats = []
+            continue
+        elif op in (sre_constants.GROUPREF, sre_constants.GROUPREF_EXISTS):
+            check.flag(RISKY, 'backreferences')
+            if op == sre_constants.GROUPREF_EXISTS:
+                _walk(av[1], check, in_loop, loop_chars, bound)
+                if av[2]:
+                    _walk(av[2], check, in_loop, loop_chars, bound)
+        # A repeat can only run on past an element that it could also match.
+        chars = _charset([(op, av)])
+        open_repeats = [previous for previous in open_repeats if _overlaps(previous, chars)]
+
+
+def classify_pattern(pattern):
+    """
+    Classifies `pattern` by its worst-case backtracking behaviour.
+
+    The analysis is static and conservative: it may flag a pattern that is in
+    fact linear, but it does not miss the classic exponential shapes such as
+    `(a+)+`, `(\w+\s?)*` or `(a|aa)+`, nor their bounded forms such as
+    `(a|aa){1,40}` or `(a?){26}`.
+
+    Returns:
+        A `PatternCheck`.
+
+    Raises:
+        re.error: If `pattern` is not a valid regex.
+    """
+    check = PatternCheck()
+    _walk(sre_parse.parse(pattern).data, check, False)
+    return check
+
+
+def validate_prompt_pattern(value):
+    """
+    Validates a `prompt_pattern`: it must compile and must not be prone to
+    catastrophic backtracking.
+    """
+    if not value:
+        return
+    try:
+        re.compile(value)
+        check = classify_pattern(value)
+    except re.error as e:
+        raise ValidationError(f'Invalid regex: {e}', code='invalid_regex')
+    if check.level == DANGEROUS:
+        raise ValidationError(
+            f"Pattern is prone to catastrophic backtracking ({', '.join(check.reasons)})",
+            code='redos',
+        )
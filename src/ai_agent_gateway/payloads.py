@@ -0,0 +1,109 @@
+import logging
+# agent_gateway/payloads.py
+import hashlib
+import json
+import threading
+from collections import OrderedDict, defaultdict
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Cached for references to triggers that no longer exist, so they are not
+# looked up again. Trigger ids are never reused.
+_NOT_FOUND = object()
+_MISSING = object()
+
+
+def payload_digest(payload):
+    """
+    Returns the SHA-256 hex digest of a payload's canonical JSON encoding.
+    """
+    canonical = json.dumps(payload, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode('utf-8', 'surrogatepass')).hexdigest()
+
+
+class PayloadStore:
+    """
+    A process-local LRU cache of deserialized action payloads.
+
+    Entries are keyed by `(trigger_id, payload_version)`. A version's content
+    never changes, so entries never need invalidating: editing a payload bumps
+    the version and the old entry simply ages out. References to deleted
+    triggers are cached as not found.
+    """
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _get(self, key, default=None):
+        with self._lock:
+            if key not in self._entries:
+                return default
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def _put(self, key, payload):
+        with self._lock:
+            self._entries[key] = payload
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def get_many(self, refs):
+        """
+        Resolves `(trigger_id, payload_version)` references to payloads.
+
+        Misses are loaded with a single query. If a trigger's payload has been
+        edited since the reference was published, the current payload is used.
+
+        Returns:
+            A dict mapping each resolvable reference to its payload. Triggers
+            that no longer exist are left out.
+        """
+        from .models import AgentTrigger
+        resolved = {}
+        # Several versions of one trigger can be requested together, so the
+        # misses are grouped per trigger.
+        missing = defaultdict(set)
+        for trigger_id, version in refs:
+            key = (trigger_id, version)
+            payload = self._get(key, _MISSING)
+            if payload is _MISSING:
+                missing[trigger_id].add(version)
+            elif payload is not _NOT_FOUND:
+                resolved[key] = payload
+        if missing:
+            rows = AgentTrigger.objects.filter(id__in=missing).values_list('id', 'payload_version', 'action_payload')
+            for trigger_id, current_version, payload in rows:
+                self._put((trigger_id, current_version), payload)
+                for requested in missing.pop(trigger_id):
+                    if current_version != requested:
+                        logger.info(
+                            f"Trigger {trigger_id} payload moved from version {requested} to {current_version}, using current"
+                        )
+                    resolved[(trigger_id, requested)] = payload
+            for trigger_id, versions in missing.items():
+                for version in versions:
+                    self._put((trigger_id, version), _NOT_FOUND)
+        return resolved
+
+    def get(self, trigger_id, version):
+        return self.get_many([(trigger_id, version)]).get((trigger_id, version))
+
+
+_store = None
+
+
+def get_payload_store():
+    """
+    Returns the process-wide `PayloadStore`.
+    """
+    global _store
+    if _store is None:
+        _store = PayloadStore(maxsize=getattr(settings, 'AGENT_GATEWAY_PAYLOAD_CACHE_SIZE', 1024))
+    return _store
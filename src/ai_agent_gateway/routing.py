@@ -0,0 +1,100 @@
+import logging
+# agent_gateway/routing.py
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Queue names. The scans are cheap and must run on time, agent actions are
+# slow and bursty; giving each its own queue (and its own workers) stops a
+# backlog of actions from delaying the next scan.
+SCAN_QUEUE = 'agent_scans'
+ACTION_QUEUE = 'agent_actions'
+
+# Message priorities within a queue, in the Redis transport's order (0 is
+# served first; see `CELERY_BROKER_TRANSPORT_OPTIONS`). Single prompt-driven
+# actions go ahead of batch chunks so one large batch cannot starve them.
+SCAN_PRIORITY = 0
+ACTION_PRIORITY = 3
+BATCH_PRIORITY = 6
+
+# Worker profiles started by `run_agent_worker`. Scan workers take one message
+# at a time so a scan is never stuck behind another prefetched one; action
+# workers are I/O-bound and run more processes with a deeper prefetch.
+WORKER_PROFILES = {
+    'scans': {'queues': [SCAN_QUEUE], 'concurrency': 2, 'prefetch_multiplier': 1},
+    'actions': {'queues': [ACTION_QUEUE], 'concurrency': 16, 'prefetch_multiplier': 4},
+    'all': {'queues': [SCAN_QUEUE, ACTION_QUEUE, 'celery'], 'concurrency': 4, 'prefetch_multiplier': 1},
+}
+
+
+def scan_queue():
+    return getattr(settings, 'AGENT_GATEWAY_SCAN_QUEUE', SCAN_QUEUE)
+
+
+def action_queue():
+    return getattr(settings, 'AGENT_GATEWAY_ACTION_QUEUE', ACTION_QUEUE)
+
+
+def task_routes():
+    """
+    Returns the Celery routes for the agent gateway tasks.
+    """
+    scans = {'queue': scan_queue(), 'priority': SCAN_PRIORITY}
+    return {
+        'ai_agent_gateway.tasks.check_scheduled_triggers': scans,
+        'ai_agent_gateway.tasks.check_periodic_triggers': scans,
+        'ai_agent_gateway.tasks.process_agent_action': {'queue': action_queue(), 'priority': ACTION_PRIORITY},
+        'ai_agent_gateway.tasks.process_agent_actions': {'queue': action_queue(), 'priority': BATCH_PRIORITY},
+    }
+
+
+def configure_routing(app):
+    """
+    Routes the agent gateway tasks to their queues on `app`.
+
+    Routes from `CELERY_TASK_ROUTES` are kept and take precedence, so a
+    deployment can still send any of these tasks elsewhere.
+    """
+    routes = app.conf.task_routes
+    if routes is None:
+        routes = []
+    elif isinstance(routes, (dict, str)) or callable(routes):
+        routes = [routes]
+    app.conf.task_routes = [*routes, task_routes()]
+    logger.info(f"Agent gateway tasks routed to queues {scan_queue()} and {action_queue()}")
+
+
+def worker_profile(role):
+    """
+    Returns the worker settings for `role`, with any overrides from the
+    `AGENT_GATEWAY_WORKER_PROFILES` setting applied.
+
+    Raises:
+        KeyError: If `role` is not a known profile.
+    """
+    overrides = getattr(settings, 'AGENT_GATEWAY_WORKER_PROFILES', {})
+    profile = {**WORKER_PROFILES.get(role, {}), **overrides.get(role, {})}
+    if not profile:
+        raise KeyError(role)
+    # The default profiles name the default queues; follow any renames.
+    renamed = {SCAN_QUEUE: scan_queue(), ACTION_QUEUE: action_queue()}
+    profile['queues'] = [renamed.get(queue, queue) for queue in profile['queues']]
+    return profile
+
+
+def worker_argv(role, loglevel='INFO', beat=False):
+    """
+    Returns the `celery worker` arguments for a worker of the given role.
+    """
+    profile = worker_profile(role)
+    argv = [
+        'worker',
+        '--queues', ','.join(profile['queues']),
+        '--concurrency', str(profile['concurrency']),
+        '--prefetch-multiplier', str(profile['prefetch_multiplier']),
+        '--hostname', f'{role}@%h',
+        '--loglevel', loglevel,
+    ]
+    if beat:
+        argv.append('--beat')
+    return argv
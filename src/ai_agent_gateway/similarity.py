@@ -0,0 +1,173 @@
+import logging
+# agent_gateway/similarity.py
+import math
+import re
+import zlib
+from collections import Counter
+from dataclasses import dataclass
+from django.conf import settings
+from .throttling import ActionPolicy
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_THRESHOLD = 0.6
+
+_WHITESPACE = re.compile(r'\s+')
+_WORD = re.compile(r'\w+')
+
+
+@dataclass
+class SimilarityEntry:
+    """
+    An in-memory view of a single active similarity trigger.
+    """
+    id: int
+    name: str
+    payload_version: int
+    threshold: float
+    policy: ActionPolicy = None
+
+
+def n_features():
+    return getattr(settings, 'AGENT_GATEWAY_SIMILARITY_FEATURES', 1024)
+
+
+def _features(text):
+    """
+    Yields the hashed features of `text`: its words and the character
+    trigrams of its whitespace-normalized form.
+    """
+    text = _WHITESPACE.sub(' ', text.lower()).strip()
+    for word in _WORD.findall(text):
+        yield f'w:{word}'
+    padded = f' {text} '
+    for i in range(len(padded) - 2):
+        yield padded[i:i + 3]
+
+
+def vectorize(texts, dimensions=None):
+    """
+    Embeds `texts` as L2-normalized hashed n-gram vectors.
+
+    Each feature is hashed (with a stable CRC32, not Python's salted `hash`)
+    into one of `dimensions` buckets with a hash-derived sign, so collisions
+    tend to cancel out. Term counts are damped with `1 + log(tf)`. Because no
+    vocabulary is shared between texts, each text's vector is independent of
+    every other trigger's, which is what lets the index be rebuilt
+    incrementally.
+
+    Returns:
+        A float32 array of shape `(len(texts), dimensions)`.
+    """
+    dimensions = dimensions or n_features()
+    matrix = np.zeros((len(texts), dimensions), dtype=np.float32)
+    for row, text in enumerate(texts):
+        for feature, count in Counter(_features(text)).items():
+            digest = zlib.crc32(feature.encode('utf-8'))
+            sign = 1.0 if digest & 0x80000000 else -1.0
+            matrix[row, digest % dimensions] += sign * (1.0 + math.log(count))
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    np.divide(matrix, norms, out=matrix, where=norms > 0)
+    return matrix
+
+
+class SimilarityIndex:
+    """
+    Scores prompts against every similarity trigger with one matrix product.
+
+    Each example utterance is one row of the matrix; a trigger's rows are
+    contiguous, and its score is the best cosine similarity among them.
+    """
+
+    def __init__(self, entries, blocks):
+        self.entries = entries
+        self.size = len(entries)
+        if entries:
+            self.matrix = np.vstack(blocks)
+            counts = np.array([len(block) for block in blocks])
+            self.starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+            self.thresholds = np.array([entry.threshold for entry in entries], dtype=np.float32)
+            self.dimensions = self.matrix.shape[1]
+
+    def scores(self, prompt):
+        """
+        Returns each trigger's similarity to `prompt`, in `entries` order.
+        """
+        vector = vectorize([prompt], self.dimensions)[0]
+        return np.maximum.reduceat(self.matrix @ vector, self.starts)
+
+    def match(self, prompt, top_k=1):
+        """
+        Returns up to `top_k` `(entry, score)` pairs for the triggers whose
+        similarity to `prompt` reaches their threshold, best first.
+        """
+        if not self.entries:
+            return []
+        scores = self.scores(prompt)
+        hits = np.flatnonzero(scores >= self.thresholds)
+        if len(hits) > top_k:
+            hits = hits[np.argpartition(-scores[hits], top_k - 1)[:top_k]]
+        ranked = sorted(hits, key=lambda i: (-scores[i], self.entries[i].id))
+        return [(self.entries[i], float(scores[i])) for i in ranked]
+
+    def best(self, prompt):
+        """
+        Returns the most similar trigger above its threshold, or None.
+        """
+        matches = self.match(prompt, top_k=1)
+        return matches[0][0] if matches else None
+
+
+# Vectorized utterances by trigger id, reused across rebuilds for triggers
+# whose utterances have not changed.
+_blocks = {}
+
+
+def build_index(triggers):
+    """
+    Builds a `SimilarityIndex` over `triggers`, re-embedding only the
+    triggers whose example utterances changed since the last build.
+
+    Returns:
+        The index, or None if NumPy is not installed or there is nothing to
+        index.
+    """
+    triggers = [trigger for trigger in triggers if trigger.example_utterances]
+    if not triggers:
+        _blocks.clear()
+        return None
+    if np is None:
+        logger.warning(f"NumPy is not installed; ignoring {len(triggers)} similarity triggers")
+        return None
+
+    dimensions = n_features()
+    entries, blocks = [], []
+    embedded = 0
+    live = set()
+    for trigger in sorted(triggers, key=lambda t: t.id):
+        utterances = tuple(str(utterance) for utterance in trigger.example_utterances)
+        key = (utterances, dimensions)
+        cached = _blocks.get(trigger.id)
+        if cached is None or cached[0] != key:
+            cached = (key, vectorize(utterances, dimensions))
+            _blocks[trigger.id] = cached
+            embedded += 1
+        live.add(trigger.id)
+        threshold = trigger.similarity_threshold
+        entries.append(SimilarityEntry(
+            id=trigger.id,
+            name=trigger.name,
+            payload_version=trigger.payload_version,
+            threshold=DEFAULT_THRESHOLD if threshold is None else threshold,
+            policy=ActionPolicy.for_trigger(trigger),
+        ))
+        blocks.append(cached[1])
+    for trigger_id in set(_blocks) - live:
+        del _blocks[trigger_id]
+    logger.info(f"Similarity index built with {len(entries)} triggers ({embedded} re-embedded)")
+    return SimilarityIndex(entries, blocks)
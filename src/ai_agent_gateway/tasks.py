@@ -1,89 +1,292 @@
 # agent_gateway/tasks.py (using Celery for asynchronous tasks)
-from celery import shared_task
+from celery import group, shared_task
+from django.conf import settings
 from django.utils import timezone
 from django.contrib.auth.decorators import login_required
-from .models import AgentTrigger
+from .agent_client import get_agent_client
+from .claims import claim_due_triggers
+from .dedup import firing_key, get_deduplicator, task_key
+from .history import firing_for, get_firing_buffer, record_firing
+from .metrics import observe, span
+from .models import AgentTrigger, periodic_spread, phase_offset
+from .payloads import get_payload_store
+from .throttling import get_throttle
 import re
-import requests  # Or your chosen agent interaction library
 import logging
+import time
+from datetime import timedelta
 
 logger = logging.getLogger(__name__)
 
-@shared_task
-def process_agent_action(trigger_id, payload):
+def _resolve_payload(trigger_id, payload_version, payloads):
+    """
+    Returns the payload a task message refers to. Messages published before
+    payload references carry the payload itself, which is used as is.
+    """
+    if isinstance(payload_version, int):
+        return payloads.get((trigger_id, payload_version))
+    return payload_version
+
+def with_count(payload, count):
+    """
+    Returns the payload sent for `count` coalesced firings. Dict payloads gain
+    a `coalesced_count` key; a single firing is sent unchanged.
+    """
+    if count > 1 and isinstance(payload, dict):
+        return {**payload, 'coalesced_count': count}
+    return payload
+
+def _observe_queue_wait(request, trigger_id=None, name=None):
+    """
+    Records how long a task message waited in the queue, from the publish
+    time stamped by `metrics.stamp_published_at`. Workers expose custom
+    message headers as request attributes; eager calls keep them in
+    `request.headers`.
+    """
+    published_at = getattr(request, 'published_at', None)
+    if published_at is None:
+        published_at = (getattr(request, 'headers', None) or {}).get('published_at')
+    if published_at is not None:
+        observe('queue_wait', max(0.0, time.time() - published_at), trigger_id, name)
+
+def _claim(key):
+    """
+    Claims an idempotency key, returning False if the action already ran.
+    """
+    if key is None:
+        return True
+    if get_deduplicator().claim(key):
+        return True
+    logger.info(f"Dropping duplicate agent action {key}")
+    return False
+
+@shared_task(bind=True, max_retries=5)
+def process_agent_action(self, trigger_id, payload_version, count=1, coalesced=False, idempotency_key=None):
     """
     Processes an agent action triggered by a specific event or schedule.
 
     This task is responsible for executing the action associated with a
-    triggered `AgentTrigger`. It logs the action, interacts with the agent,
-    and updates the trigger's `last_triggered` timestamp.
+    triggered `AgentTrigger`. It resolves the action payload from the worker's
+    `PayloadStore`, logs the action, sends the payload to the agent API
+    through the worker's pooled `AgentClient` (when `AGENT_API_URL` is
+    configured), and records the firing through the worker's `FiringBuffer`,
+    which also moves the trigger's `last_triggered` timestamp forward. If the
+    agent call fails, the idempotency key is released and the task retried
+    with exponential backoff, up to `max_retries` times.
 
     Args:
         trigger_id: The ID of the `AgentTrigger` that was activated.
-        payload: The action payload associated with the trigger.
+        payload_version: The trigger's `payload_version` when it was activated.
+        count: The number of firings merged into this action by the trigger's
+            coalescing window.
+        coalesced: Whether the count is still in Redis, to be collected
+            when the window's task runs (see `throttling.Throttle`).
+        idempotency_key: The firing's key (see `dedup.firing_key`). Messages
+            without one are keyed by their Celery task id, which survives
+            redelivery and retries. A key that was already claimed within
+            `AGENT_GATEWAY_DEDUP_TTL` means the action already ran, so it is
+            dropped.
     """
+    started = time.perf_counter()
+    key = idempotency_key or (task_key(self.request.id) if self.request.id else None)
+    if not _claim(key):
+        return
+    failure = None
     try:
-        trigger = AgentTrigger.objects.get(pk=trigger_id)
-        # Replace with your actual agent interaction logic
-        logger.info(f"Trigger {trigger.name} fired with payload: {payload}")
-        # Example: Send payload to an external agent API
-        # response = requests.post("your_agent_api_endpoint", json=payload)
-        # print(response.json())
-        trigger.last_triggered = timezone.now()
-        trigger.save()
+        if coalesced:
+            count = get_throttle().take_coalesced(trigger_id) or count
+        name = AgentTrigger.objects.values_list('name', flat=True).get(pk=trigger_id)
+        _observe_queue_wait(self.request, trigger_id, name)
+        payload = payload_version
+        if isinstance(payload_version, int):
+            payload = get_payload_store().get(trigger_id, payload_version)
+        payload = with_count(payload, count)
+        client = get_agent_client()
+        if client is not None:
+            try:
+                with span('agent_call', trigger_id, name):
+                    # The task retries failed calls itself, so the client
+                    # makes a single attempt.
+                    client.post(payload, retries=0)
+            except Exception as e:
+                record_firing(trigger_id, payload_version, error=e, count=count)
+                failure = e
+        if failure is None:
+            if count > 1:
+                logger.info(f"Trigger {name} fired {count} times (coalesced) with payload: {payload}")
+            else:
+                logger.info(f"Trigger {name} fired with payload: {payload}")
+            record_firing(trigger_id, payload_version, count=count)
+            observe('action', time.perf_counter() - started, trigger_id, name)
 
     except AgentTrigger.DoesNotExist:
         logger.info(f"Trigger with ID {trigger_id} not found.")
     except Exception as e:
         logger.info(f"Error processing trigger {trigger_id}: {e}")
 
-from django.db.models import F, Q
+    if failure is not None:
+        logger.info(f"Agent call for trigger {trigger_id} failed, retrying: {failure}")
+        if key is not None:
+            get_deduplicator().release(key)
+        # The coalesced count was already taken from Redis, so the retry
+        # carries it instead.
+        raise self.retry(
+            args=(trigger_id, payload_version),
+            kwargs={'count': count, 'coalesced': False, 'idempotency_key': idempotency_key},
+            exc=failure,
+            countdown=10 * 2 ** self.request.retries,
+        )
+
+@shared_task(bind=True)
+def process_agent_actions(self, calls):
+    """
+    Processes a chunk of agent actions in one task.
+
+    The agent calls for the whole chunk are kept in flight concurrently (up to
+    `AGENT_API_MAX_CONCURRENCY`) instead of one blocking call per task, and
+    the triggers are read with one query. Payloads already in the worker's
+    `PayloadStore` are not read again, and the firings are recorded through
+    the worker's `FiringBuffer` in one batch. A redelivered chunk is dropped,
+    keyed by its Celery task id as in `process_agent_action`.
+
+    Each agent call is attempted once. A call that fails is recorded as a
+    failed firing and re-dispatched as its own `process_agent_action` task,
+    which retries it with backoff.
+
+    Args:
+        calls: A list of `(trigger_id, payload_version)` pairs.
+    """
+    if self.request.id and not _claim(task_key(self.request.id)):
+        return 0
+    _observe_queue_wait(self.request)
+    calls = [tuple(call) for call in calls]
+    names = dict(AgentTrigger.objects.filter(id__in=[trigger_id for trigger_id, _ in calls]).values_list('id', 'name'))
+    payloads = get_payload_store().get_many(
+        [(trigger_id, version) for trigger_id, version in calls if isinstance(version, int)]
+    )
+    found = []
+    for trigger_id, payload_version in calls:
+        if trigger_id in names:
+            found.append((trigger_id, payload_version, _resolve_payload(trigger_id, payload_version, payloads)))
+        else:
+            logger.info(f"Trigger with ID {trigger_id} not found.")
+
+    client = get_agent_client()
+    if client is not None:
+        with span('agent_call_batch'):
+            results = client.post_many([payload for _, _, payload in found], retries=0)
+    else:
+        results = [None] * len(found)
+
+    firings = []
+    for (trigger_id, payload_version, payload), result in zip(found, results):
+        if isinstance(result, Exception):
+            logger.info(f"Error processing trigger {trigger_id}: {result}")
+            firings.append(firing_for(trigger_id, payload_version, error=result))
+            process_agent_action.delay(trigger_id, payload_version)
+            continue
+        logger.info(f"Trigger {names[trigger_id]} fired with payload: {payload}")
+        firings.append(firing_for(trigger_id, payload_version))
+    if firings:
+        get_firing_buffer().add(*firings)
+    return sum(firing.succeeded for firing in firings)
+
+def dispatch_agent_actions(calls, chunk_size=None):
+    """
+    Publishes many agent actions to the broker at once.
+
+    The calls are split into chunks that each travel as a single
+    `process_agent_actions` message, and all chunks are published together as
+    one Celery group, so a burst of N actions costs N / chunk_size broker
+    round trips instead of N, and each chunk's agent calls run concurrently.
+
+    Args:
+        calls: An iterable of `(trigger_id, payload_version)` argument tuples.
+        chunk_size: The number of calls per message. Defaults to the
+            `AGENT_GATEWAY_DISPATCH_CHUNK_SIZE` setting.
+
+    Returns:
+        The number of calls that were published.
+    """
+    calls = [tuple(call) for call in calls]
+    if not calls:
+        return 0
+    if len(calls) == 1:
+        process_agent_action.delay(*calls[0])
+        return 1
+    chunk_size = chunk_size or getattr(settings, 'AGENT_GATEWAY_DISPATCH_CHUNK_SIZE', 100)
+    group(
+        process_agent_actions.s(calls[i:i + chunk_size])
+        for i in range(0, len(calls), chunk_size)
+    ).apply_async()
+    logger.info(f"Dispatched {len(calls)} agent actions in chunks of {chunk_size}")
+    return len(calls)
+
+def _smoothing_window():
+    """
+    The span a smoothed periodic scan spreads its firings over: the Beat
+    interval of the scans, `AGENT_GATEWAY_SMOOTHING_WINDOW` seconds (default 60).
+    """
+    return timedelta(seconds=getattr(settings, 'AGENT_GATEWAY_SMOOTHING_WINDOW', 60))
+
+def fire_due_triggers(trigger_type, shard=None, shard_count=None):
+    """
+    Claims every due trigger of `trigger_type` in this shard, batch by batch,
+    and dispatches an agent action for each one, keyed by the trigger and the
+    due time it was claimed for (see `dedup.firing_key`).
+
+    With `AGENT_GATEWAY_PERIODIC_SPREAD = 'smooth'`, the periodic scan also
+    claims the firings due before its next run and sends each one with an ETA
+    of its due time, so firings reach the workers spread over the window
+    rather than all at the scan. Overdue firings (new triggers, or a backlog
+    after an outage) are spread by a phase offset within the window.
+
+    Returns:
+        The number of triggers fired.
+    """
+    now = timezone.now()
+    window = _smoothing_window() if trigger_type == 'periodic' and periodic_spread() == 'smooth' else None
+    fired = set()
+    with span(f'scan_{trigger_type}'):
+        while True:
+            # A claimed trigger is never due again at `now` (see
+            # `claims.due_triggers`), so every claim is a new firing.
+            claimed = claim_due_triggers(trigger_type, now, shard=shard, shard_count=shard_count, lookahead=window)
+            if not claimed:
+                break
+            for trigger_id, payload_version, fire_at in claimed:
+                # How late the scan picked the firing up after it fell due.
+                observe('schedule_lag', max(0.0, (now - fire_at).total_seconds()), trigger_id)
+                key = firing_key(trigger_id, fire_at)
+                with span('enqueue', trigger_id):
+                    if window is None:
+                        process_agent_action.delay(trigger_id, payload_version, idempotency_key=key)
+                    else:
+                        eta = fire_at if fire_at > now else now + phase_offset(trigger_id, window)
+                        process_agent_action.apply_async((trigger_id, payload_version), {'idempotency_key': key}, eta=eta)
+                fired.add(trigger_id)
+    if fired:
+        logger.info(f"Fired {len(fired)} {trigger_type} triggers (shard {shard} of {shard_count})")
+    return len(fired)
 
 @shared_task
-def check_scheduled_triggers():
+def check_scheduled_triggers(shard=None, shard_count=None):
     """
     Checks for and processes scheduled triggers that are due.
+
+    Due triggers are found through the partial index on `next_fire_at` and
+    claimed in batches (see `claims.claim_due_triggers`), so several scheduler
+    nodes can run this task concurrently, each on its own shard of the id
+    space, without firing a trigger twice.
     """
-    now = timezone.now()
-    triggers = AgentTrigger.objects.filter(
-        trigger_type='scheduled', 
-        scheduled_time__lte=now, 
-        active=True
-    )
-    
-    trigger_ids = []
-    for trigger in triggers:
-        process_agent_action.delay(trigger.id, trigger.action_payload)
-        trigger_ids.append(trigger.id)
-    
-    if trigger_ids:
-        # Bulk update to avoid N+1 queries
-        AgentTrigger.objects.filter(id__in=trigger_ids).update(scheduled_time=None, last_triggered=now)
+    return fire_due_triggers('scheduled', shard=shard, shard_count=shard_count)
 
 @shared_task
-def check_periodic_triggers():
+def check_periodic_triggers(shard=None, shard_count=None):
     """
     Checks for and processes periodic triggers that are due.
+
+    Claiming a periodic trigger moves its `next_fire_at` one interval ahead in
+    the same statement, so concurrent scans never fire it twice.
     """
-    now = timezone.now()
-    
-    # Efficiently filter for due periodic triggers in the database
-    due_triggers = AgentTrigger.objects.filter(
-        trigger_type='periodic',
-        active=True
-    ).filter(
-        Q(last_triggered__isnull=True) |
-        Q(last_triggered__lte=now - F('periodic_interval'))
-    )
-    
-    trigger_ids = [trigger.id for trigger in due_triggers]
-
-    if trigger_ids:
-        # Atomically update last_triggered to prevent race conditions
-        updated_count = AgentTrigger.objects.filter(id__in=trigger_ids).update(last_triggered=now)
-        
-        if updated_count > 0:
-            # Fetch the updated triggers to get the correct payload for the task
-            updated_triggers = AgentTrigger.objects.filter(id__in=trigger_ids)
-            for trigger in updated_triggers:
-                process_agent_action.delay(trigger.id, trigger.action_payload)
+    return fire_due_triggers('periodic', shard=shard, shard_count=shard_count)
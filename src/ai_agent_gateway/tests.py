@@ -1,13 +1,39 @@
 import logging
 import re
-from django.test import TestCase, Client
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction
+from django.conf import settings as django_settings
+from django.test import TestCase, Client, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.utils import timezone
-from unittest.mock import patch
+from unittest.mock import MagicMock, patch
+from asgiref.sync import async_to_sync
 import json
-from .models import AgentTrigger
-from .tasks import process_agent_action, check_scheduled_triggers, check_periodic_triggers
+from .models import PHASE_EPOCH, ActionClaim, AgentTrigger, TriggerFiring, next_phase_slot, phase_offset
+from .agent_client import AgentClient, AgentClientError, CircuitBreaker, CircuitOpenError
+from .benchmark import run_benchmarks
+from .claims import claim_due_triggers
+from .dedup import CacheDedupSet, DatabaseDedupSet, Deduplicator, firing_key, task_key
+from .dispatcher import TriggerDispatcher
+from .history import FiringBuffer, firing_for
+from .similarity import build_index, vectorize
+from .payloads import PayloadStore, payload_digest
+from .match_cache import MatchCache
+from .checks import check_shared_caches
+from .metrics import BUCKETS, Histogram, MetricsRegistry, amaybe_publish, collect, maybe_publish, span
+from .matcher import PromptMatcher, PatternError, get_prompt_matcher, literal_prefix, trigger_set_version
+from .patterns import DANGEROUS, RISKY, SAFE, classify_pattern, validate_prompt_pattern
+from .routing import worker_argv
+from .transfer import export_triggers, import_triggers
+from .throttling import COALESCED, LIMITED, SEND, LocalTokenBucket, Throttle
+from .tasks import process_agent_action, process_agent_actions, check_scheduled_triggers, check_periodic_triggers, dispatch_agent_actions
 import datetime
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from hypothesis.extra.django import TestCase as HypothesisTestCase
 from hypothesis import given, strategies as st, settings
 
@@ -61,7 +87,7 @@ class AgentGatewayViewsTest(TestCase):
         )
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.json()['message'], f'Trigger {self.trigger.name} activated')
-        mock_delay.assert_called_once_with(self.trigger.id, self.trigger.action_payload)
+        mock_delay.assert_called_once_with(self.trigger.id, self.trigger.payload_version)
 
     def test_handle_prompt_no_match(self):
         response = self.client.post(
@@ -88,6 +114,124 @@ class AgentGatewayViewsTest(TestCase):
         self.assertEqual(response.status_code, 302)
         self.assertTrue(AgentTrigger.objects.filter(name='New Trigger').exists())
 
+class AsyncGatewayViewsTest(TestCase):
+    def setUp(self):
+        self.trigger = AgentTrigger.objects.create(
+            name='Async Prompt Trigger',
+            trigger_type='prompt',
+            prompt_pattern='^hello$',
+            active=True,
+            action_payload={'message': 'Hello, async!'}
+        )
+
+    @patch('ai_agent_gateway.views.process_agent_action.delay')
+    async def test_handle_prompt_async_success(self, mock_delay):
+        response = await self.async_client.post(
+            reverse('agent_gateway:handle_prompt_async'),
+            json.dumps({'prompt': 'hello'}),
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['message'], f'Trigger {self.trigger.name} activated')
+        mock_delay.assert_called_once_with(self.trigger.id, self.trigger.payload_version)
+
+    @patch('ai_agent_gateway.views.process_agent_action.delay')
+    async def test_handle_prompt_async_errors(self, mock_delay):
+        url = reverse('agent_gateway:handle_prompt_async')
+        response = await self.async_client.get(url)
+        self.assertEqual(response.status_code, 405)
+        response = await self.async_client.post(url, json.dumps({'prompt': 'goodbye'}), content_type='application/json')
+        self.assertEqual(response.json()['message'], 'No matching triggers found')
+        response = await self.async_client.post(url, json.dumps({}), content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        mock_delay.assert_not_called()
+
+    @patch('ai_agent_gateway.views.process_agent_action.delay')
+    @patch('ai_agent_gateway.views.amaybe_publish')
+    async def test_handle_prompt_async_publishes_metrics(self, mock_publish, mock_delay):
+        url = reverse('agent_gateway:handle_prompt_async')
+        await self.async_client.post(url, json.dumps({'prompt': 'hello'}), content_type='application/json')
+        await self.async_client.post(url, json.dumps({'prompt': 'goodbye'}), content_type='application/json')
+        self.assertEqual(mock_publish.await_count, 2)
+
+    async def test_trigger_list_async(self):
+        response = await self.async_client.get(reverse('agent_gateway:trigger_list_async'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, 'agent_gateway/trigger_list.html')
+        self.assertContains(response, self.trigger.name)
+
+class PromptBatchViewTest(TestCase):
+    def setUp(self):
+        self.hello = AgentTrigger.objects.create(
+            name='Hello Trigger',
+            trigger_type='prompt',
+            prompt_pattern='^hello',
+            action_payload={'message': 'hello'}
+        )
+        self.bye = AgentTrigger.objects.create(
+            name='Bye Trigger',
+            trigger_type='prompt',
+            prompt_pattern='^bye',
+            action_payload={'message': 'bye'}
+        )
+
+    @patch('ai_agent_gateway.views.dispatch_agent_actions')
+    def test_json_array(self, mock_dispatch):
+        response = self.client.post(
+            reverse('agent_gateway:handle_prompt_batch'),
+            json.dumps(['hello there', {'prompt': 'bye now'}, 'unknown', '', 'hello again']),
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['activated'], 3)
+        self.assertEqual([r['status'] for r in data['results']],
+                         ['activated', 'activated', 'no_match', 'error', 'activated'])
+        self.assertEqual(data['results'][1]['trigger'], 'Bye Trigger')
+        mock_dispatch.assert_called_once_with([
+            (self.hello.id, self.hello.payload_version),
+            (self.bye.id, self.bye.payload_version),
+            (self.hello.id, self.hello.payload_version),
+        ])
+
+    @patch('ai_agent_gateway.views.dispatch_agent_actions')
+    def test_ndjson_stream(self, mock_dispatch):
+        body = '\n'.join(json.dumps({'prompt': p}) for p in ['bye', 'nothing']) + '\n'
+        response = self.client.post(
+            reverse('agent_gateway:handle_prompt_batch'),
+            body,
+            content_type='application/x-ndjson'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([r['status'] for r in response.json()['results']], ['activated', 'no_match'])
+        mock_dispatch.assert_called_once_with([(self.bye.id, self.bye.payload_version)])
+
+    @patch('ai_agent_gateway.views.dispatch_agent_actions')
+    def test_rejects_invalid_batches(self, mock_dispatch):
+        url = reverse('agent_gateway:handle_prompt_batch')
+        response = self.client.post(url, '{"prompt": "hello"}', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post(url, 'not json', content_type='application/json')
+        self.assertEqual(response.json()['error'], 'Invalid JSON')
+        with self.settings(AGENT_GATEWAY_MAX_BATCH_SIZE=2):
+            response = self.client.post(url, json.dumps(['a', 'b', 'c']), content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        mock_dispatch.assert_not_called()
+
+    @patch('ai_agent_gateway.tasks.process_agent_action.delay')
+    @patch('ai_agent_gateway.tasks.group')
+    def test_dispatch_agent_actions_chunks(self, mock_group, mock_delay):
+        calls = [(i, {'n': i}) for i in range(5)]
+        self.assertEqual(dispatch_agent_actions(calls, chunk_size=2), 5)
+        chunks = [sig.args[0] for sig in mock_group.call_args.args[0]]
+        self.assertEqual(chunks, [calls[0:2], calls[2:4], calls[4:5]])
+        mock_group.return_value.apply_async.assert_called_once_with()
+        mock_delay.assert_not_called()
+
+        self.assertEqual(dispatch_agent_actions([(1, {})]), 1)
+        mock_delay.assert_called_once_with(1, {})
+        self.assertEqual(dispatch_agent_actions([]), 0)
+
 class AgentGatewayTasksTest(TestCase):
     @patch('ai_agent_gateway.tasks.logger.info')
     def test_process_agent_action(self, mock_logger):
@@ -112,7 +256,9 @@ class AgentGatewayTasksTest(TestCase):
             action_payload={'message': 'Scheduled task'}
         )
         check_scheduled_triggers()
-        mock_delay.assert_called_once_with(trigger.id, trigger.action_payload)
+        mock_delay.assert_called_once_with(
+            trigger.id, trigger.payload_version, idempotency_key=f'{trigger.id}:{scheduled_time.isoformat()}'
+        )
         trigger.refresh_from_db()
         self.assertIsNone(trigger.scheduled_time)
 
@@ -129,7 +275,465 @@ class AgentGatewayTasksTest(TestCase):
             action_payload={'message': 'Periodic task'}
         )
         check_periodic_triggers()
-        mock_delay.assert_called_once_with(trigger.id, trigger.action_payload)
+        mock_delay.assert_called_once_with(
+            trigger.id, trigger.payload_version, idempotency_key=firing_key(trigger.id, last_triggered + interval)
+        )
+
+class NextFireAtTest(TestCase):
+    def test_next_fire_at_is_kept_up_to_date_on_save(self):
+        now = timezone.now()
+        scheduled = AgentTrigger.objects.create(
+            name='Scheduled', trigger_type='scheduled', scheduled_time=now
+        )
+        self.assertEqual(scheduled.next_fire_at, now)
+
+        periodic = AgentTrigger.objects.create(
+            name='Periodic', trigger_type='periodic', periodic_interval=datetime.timedelta(minutes=5)
+        )
+        self.assertIsNotNone(periodic.next_fire_at)
+        periodic.last_triggered = now
+        periodic.save(update_fields=['last_triggered'])
+        periodic.refresh_from_db()
+        self.assertEqual(periodic.next_fire_at, now + datetime.timedelta(minutes=5))
+
+        periodic.active = False
+        periodic.save()
+        self.assertIsNone(periodic.next_fire_at)
+
+        prompt = AgentTrigger.objects.create(name='Prompt', trigger_type='prompt', prompt_pattern='x')
+        self.assertIsNone(prompt.next_fire_at)
+
+    def test_huge_interval_never_fires(self):
+        trigger = AgentTrigger(
+            name='Never', trigger_type='periodic',
+            periodic_interval=datetime.timedelta(days=999999999),
+            last_triggered=timezone.now(),
+        )
+        self.assertIsNone(trigger.compute_next_fire_at())
+
+    @patch('ai_agent_gateway.tasks.process_agent_action.delay')
+    def test_periodic_scan_advances_next_fire_at(self, mock_delay):
+        interval = datetime.timedelta(minutes=5)
+        due = AgentTrigger.objects.create(
+            name='Due', trigger_type='periodic', periodic_interval=interval,
+            last_triggered=timezone.now() - datetime.timedelta(minutes=6),
+        )
+        AgentTrigger.objects.create(
+            name='Not Due', trigger_type='periodic', periodic_interval=interval,
+            last_triggered=timezone.now() - datetime.timedelta(minutes=1),
+        )
+        fire_at = due.next_fire_at
+        with self.assertNumQueries(3):
+            check_periodic_triggers()
+        mock_delay.assert_called_once_with(due.id, due.payload_version, idempotency_key=firing_key(due.id, fire_at))
+        due.refresh_from_db()
+        self.assertEqual(due.next_fire_at, due.last_triggered + interval)
+
+        mock_delay.reset_mock()
+        check_periodic_triggers()
+        mock_delay.assert_not_called()
+
+    @patch('ai_agent_gateway.tasks.process_agent_action.delay')
+    def test_scheduled_scan_clears_next_fire_at(self, mock_delay):
+        future = AgentTrigger.objects.create(
+            name='Future', trigger_type='scheduled',
+            scheduled_time=timezone.now() + datetime.timedelta(hours=1),
+        )
+        check_scheduled_triggers()
+        mock_delay.assert_not_called()
+        future.refresh_from_db()
+        self.assertIsNotNone(future.next_fire_at)
+
+class ClaimDueTriggersTest(TestCase):
+    def setUp(self):
+        self.now = timezone.now()
+        self.triggers = [
+            AgentTrigger.objects.create(
+                name=f'Periodic {i}', trigger_type='periodic',
+                periodic_interval=datetime.timedelta(minutes=5),
+                last_triggered=self.now - datetime.timedelta(minutes=10),
+                action_payload={'n': i},
+            )
+            for i in range(6)
+        ]
+
+    def test_shards_split_due_triggers(self):
+        claimed = []
+        for shard in range(3):
+            claimed.extend(claim_due_triggers('periodic', self.now, shard=shard, shard_count=3))
+        self.assertCountEqual([c[0] for c in claimed], [t.id for t in self.triggers])
+        self.assertEqual(claim_due_triggers('periodic', self.now), [])
+
+    def test_batches_are_disjoint(self):
+        first = claim_due_triggers('periodic', self.now, batch_size=4)
+        second = claim_due_triggers('periodic', self.now, batch_size=4)
+        self.assertEqual(len(first), 4)
+        self.assertEqual(len(second), 2)
+        self.assertFalse({c[0] for c in first} & {c[0] for c in second})
+        for trigger in self.triggers:
+            trigger.refresh_from_db()
+            self.assertEqual(trigger.last_triggered, self.now)
+            self.assertEqual(trigger.next_fire_at, self.now + datetime.timedelta(minutes=5))
+
+    def test_skip_locked_path(self):
+        with patch.object(connection.features, 'has_select_for_update_skip_locked', True):
+            with self.assertNumQueries(4):
+                claimed = claim_due_triggers('periodic', self.now)
+        self.assertEqual(len(claimed), 6)
+        self.assertEqual(claim_due_triggers('periodic', self.now), [])
+
+    @override_settings(AGENT_GATEWAY_CLAIM_BATCH_SIZE=2)
+    @patch('ai_agent_gateway.tasks.process_agent_action.delay')
+    def test_batched_scan_does_not_pass_fired_ids(self, mock_delay):
+        for i in range(5):
+            AgentTrigger.objects.create(name=f'Scheduled {i}', trigger_type='scheduled', scheduled_time=self.now)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(check_scheduled_triggers(), 5)
+        selects = [q['sql'] for q in queries if q['sql'].startswith('SELECT')]
+        self.assertEqual(len(selects), 4)
+        self.assertFalse(any(' IN (' in sql for sql in selects))
+
+    @patch('ai_agent_gateway.tasks.process_agent_action.delay')
+    def test_scan_fires_each_trigger_once(self, mock_delay):
+        self.assertEqual(check_periodic_triggers(shard=0, shard_count=2), 3)
+        self.assertEqual(check_periodic_triggers(shard=1, shard_count=2), 3)
+        self.assertEqual(check_periodic_triggers(), 0)
+        self.assertCountEqual([c.args[0] for c in mock_delay.call_args_list], [t.id for t in self.triggers])
+
+class TriggerDispatcherTest(TestCase):
+    def setUp(self):
+        self.now = timezone.now()
+        self.dispatcher = TriggerDispatcher(
+            lookahead=datetime.timedelta(minutes=5),
+            poll_interval=1.0,
+            clock=lambda: self.now,
+        )
+
+    @patch('ai_agent_gateway.dispatcher.process_agent_action.delay')
+    def test_fires_exactly_when_due(self, mock_delay):
+        trigger = AgentTrigger.objects.create(
+            name='Soon', trigger_type='scheduled',
+            scheduled_time=self.now + datetime.timedelta(seconds=0.25),
+            action_payload={'message': 'soon'},
+        )
+        self.assertAlmostEqual(self.dispatcher.run_once(), 0.25, places=3)
+        mock_delay.assert_not_called()
+
+        self.now += datetime.timedelta(seconds=0.25)
+        # The trigger set version, then the claim.
+        with self.assertNumQueries(2):
+            self.dispatcher.run_once()
+        mock_delay.assert_called_once_with(
+            trigger.id, trigger.payload_version, idempotency_key=firing_key(trigger.id, trigger.scheduled_time)
+        )
+        trigger.refresh_from_db()
+        self.assertIsNone(trigger.next_fire_at)
+        self.assertIsNone(trigger.scheduled_time)
+
+    @patch('ai_agent_gateway.dispatcher.process_agent_action.delay')
+    def test_periodic_trigger_is_rescheduled_in_memory(self, mock_delay):
+        trigger = AgentTrigger.objects.create(
+            name='Every minute', trigger_type='periodic',
+            periodic_interval=datetime.timedelta(minutes=1),
+            last_triggered=self.now - datetime.timedelta(minutes=1),
+        )
+        self.dispatcher.run_once()
+        self.assertEqual(mock_delay.call_count, 1)
+        self.assertEqual(len(self.dispatcher), 1)
+
+        self.now += datetime.timedelta(minutes=1)
+        with self.assertNumQueries(1):
+            self.dispatcher.fire_due()
+        self.assertEqual(mock_delay.call_count, 2)
+        trigger.refresh_from_db()
+        self.assertEqual(trigger.next_fire_at, self.now + datetime.timedelta(minutes=1))
+
+    @patch('ai_agent_gateway.dispatcher.process_agent_action.delay')
+    def test_reloads_on_trigger_change_and_skips_claimed_firings(self, mock_delay):
+        self.dispatcher.run_once()
+        self.assertEqual(len(self.dispatcher), 0)
+
+        trigger = AgentTrigger.objects.create(
+            name='New', trigger_type='scheduled',
+            scheduled_time=self.now + datetime.timedelta(seconds=10),
+        )
+        self.assertEqual(self.dispatcher.run_once(), 1.0)
+        self.assertEqual(len(self.dispatcher), 1)
+
+        # Another node fires the trigger first.
+        AgentTrigger.objects.filter(id=trigger.id).update(next_fire_at=None)
+        self.now += datetime.timedelta(seconds=10)
+        self.dispatcher.fire_due()
+        mock_delay.assert_not_called()
+
+class StubAgentHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        server = self.server
+        with server.lock:
+            server.requests.append(json.loads(body))
+            server.clients.add(self.client_address)
+            status = server.statuses.pop(0) if server.statuses else 200
+        time.sleep(server.delay)
+        response = server.body if server.body is not None else json.dumps({'ok': status == 200}).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', server.content_type)
+        self.send_header('Content-Length', str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def log_message(self, *args):
+        pass
+
+
+class StubAgentServerMixin:
+    """Runs a local agent API stub on an ephemeral port for each test."""
+
+    def setUp(self):
+        super().setUp()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), StubAgentHandler)
+        self.server.daemon_threads = True
+        self.server.lock = threading.Lock()
+        self.server.requests = []
+        self.server.clients = set()
+        self.server.statuses = []
+        self.server.delay = 0
+        self.server.content_type = 'application/json'
+        self.server.body = None
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}/actions'
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+    def make_client(self, **kwargs):
+        kwargs.setdefault('backoff_base', 0.001)
+        client = AgentClient(self.url, timeout=2, **kwargs)
+        self.addCleanup(client.close)
+        return client
+
+
+class AgentClientTest(StubAgentServerMixin, TestCase):
+    def test_reuses_pooled_connection(self):
+        client = self.make_client()
+        for i in range(3):
+            self.assertEqual(client.post({'n': i}), {'ok': True})
+        self.assertEqual(self.server.requests, [{'n': 0}, {'n': 1}, {'n': 2}])
+        self.assertEqual(len(self.server.clients), 1)
+
+    def test_retries_server_errors(self):
+        self.server.statuses = [503, 500]
+        client = self.make_client(max_retries=2)
+        self.assertEqual(client.post({'n': 1}), {'ok': True})
+        self.assertEqual(len(self.server.requests), 3)
+
+    def test_client_errors_are_not_retried(self):
+        self.server.statuses = [400]
+        client = self.make_client()
+        with self.assertRaises(AgentClientError):
+            client.post({'n': 1})
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_circuit_breaker_fails_fast(self):
+        self.server.statuses = [503] * 4
+        client = self.make_client(max_retries=1, breaker=CircuitBreaker(failure_threshold=2, reset_timeout=60))
+        with self.assertRaises(AgentClientError):
+            client.post({'n': 1})
+        self.assertTrue(client.breaker.is_open)
+        with self.assertRaises(CircuitOpenError):
+            client.post({'n': 2})
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_non_json_success_is_not_retried(self):
+        self.server.content_type = 'text/plain'
+        self.server.body = b'accepted'
+        client = self.make_client()
+        self.assertEqual(client.post({'n': 1}), 'accepted')
+        self.assertEqual(len(self.server.requests), 1)
+        self.assertFalse(client.breaker.is_open)
+
+    def test_invalid_json_success_is_not_retried(self):
+        self.server.body = b'not json'
+        client = self.make_client()
+        self.assertEqual(client.post({'n': 1}), 'not json')
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_post_many_keeps_calls_in_flight(self):
+        self.server.delay = 0.2
+        client = self.make_client(max_concurrency=10)
+        started = time.monotonic()
+        results = client.post_many([{'n': i} for i in range(10)])
+        self.assertLess(time.monotonic() - started, 1.5)
+        self.assertEqual(results, [{'ok': True}] * 10)
+
+    def test_process_agent_action_posts_payload(self):
+        trigger = AgentTrigger.objects.create(
+            name='API Trigger', trigger_type='prompt', action_payload={'message': 'call me'}
+        )
+        with self.settings(AGENT_API_URL=self.url), \
+                patch('ai_agent_gateway.tasks.get_payload_store', return_value=PayloadStore()):
+            process_agent_action(trigger.id, trigger.payload_version)
+            self.assertEqual(process_agent_actions([(trigger.id, trigger.payload_version), (0, 1)]), 1)
+        self.assertEqual(self.server.requests, [{'message': 'call me'}, {'message': 'call me'}])
+        trigger.refresh_from_db()
+        self.assertIsNotNone(trigger.last_triggered)
+
+    def test_task_retries_make_one_call_per_attempt(self):
+        trigger = AgentTrigger.objects.create(name='API Trigger', trigger_type='prompt', action_payload={'n': 1})
+        self.server.statuses = [503, 503]
+        with self.settings(AGENT_API_URL=self.url, AGENT_API_MAX_RETRIES=3), \
+                patch('ai_agent_gateway.tasks.get_payload_store', return_value=PayloadStore()):
+            result = process_agent_action.apply(args=(trigger.id, trigger.payload_version))
+        self.assertTrue(result.successful())
+        self.assertEqual(len(self.server.requests), 3)
+        self.assertEqual(
+            list(TriggerFiring.objects.filter(trigger=trigger).order_by('id').values_list('succeeded', flat=True)),
+            [False, False, True],
+        )
+
+    def test_failed_batched_calls_are_redispatched(self):
+        ok = AgentTrigger.objects.create(name='Ok', trigger_type='prompt', action_payload={'n': 1})
+        failing = AgentTrigger.objects.create(name='Failing', trigger_type='prompt', action_payload={'n': 2})
+        self.server.statuses = [200, 503]
+        with self.settings(AGENT_API_URL=self.url, AGENT_API_MAX_RETRIES=3, AGENT_API_MAX_CONCURRENCY=1), \
+                patch('ai_agent_gateway.tasks.get_payload_store', return_value=PayloadStore()), \
+                patch('ai_agent_gateway.tasks.process_agent_action.delay') as mock_delay:
+            calls = [(ok.id, ok.payload_version), (failing.id, failing.payload_version)]
+            self.assertEqual(process_agent_actions(calls), 1)
+        self.assertEqual(len(self.server.requests), 2)
+        mock_delay.assert_called_once_with(failing.id, failing.payload_version)
+
+class PayloadVersionTest(TestCase):
+    def setUp(self):
+        self.trigger = AgentTrigger.objects.create(
+            name='Versioned Trigger', trigger_type='prompt', action_payload={'b': 1, 'a': [1, 2]}
+        )
+
+    def test_digest_is_canonical(self):
+        self.assertEqual(payload_digest({'a': [1, 2], 'b': 1}), payload_digest({'b': 1, 'a': [1, 2]}))
+        self.assertNotEqual(payload_digest({'a': 1}), payload_digest({'a': 2}))
+
+    def test_version_bumps_only_when_payload_changes(self):
+        self.assertEqual(self.trigger.payload_version, 1)
+        self.assertEqual(self.trigger.payload_hash, payload_digest({'a': [1, 2], 'b': 1}))
+        self.trigger.name = 'Renamed'
+        self.trigger.save()
+        self.assertEqual(self.trigger.payload_version, 1)
+        self.trigger.action_payload = {'a': 'changed'}
+        self.trigger.save(update_fields=['action_payload'])
+        self.trigger.refresh_from_db()
+        self.assertEqual(self.trigger.payload_version, 2)
+        self.assertEqual(self.trigger.payload_hash, payload_digest({'a': 'changed'}))
+
+    def test_store_caches_resolved_payloads(self):
+        store = PayloadStore(maxsize=1)
+        with self.assertNumQueries(1):
+            self.assertEqual(store.get(self.trigger.id, 1), {'b': 1, 'a': [1, 2]})
+            self.assertEqual(store.get(self.trigger.id, 1), {'b': 1, 'a': [1, 2]})
+        self.assertIsNone(store.get(0, 1))
+
+    def test_store_resolves_stale_version_to_current_payload(self):
+        store = PayloadStore()
+        self.trigger.action_payload = {'new': True}
+        self.trigger.save()
+        self.assertEqual(store.get_many([(self.trigger.id, 1)]), {(self.trigger.id, 1): {'new': True}})
+        with self.assertNumQueries(0):
+            self.assertEqual(store.get(self.trigger.id, 2), {'new': True})
+
+    def test_store_resolves_several_versions_of_one_trigger(self):
+        store = PayloadStore()
+        self.trigger.action_payload = {'new': True}
+        self.trigger.save()
+        refs = [(self.trigger.id, 1), (self.trigger.id, 2)]
+        with self.assertNumQueries(1):
+            self.assertEqual(store.get_many(refs), {ref: {'new': True} for ref in refs})
+
+    def test_store_caches_deleted_triggers(self):
+        store = PayloadStore()
+        trigger_id = self.trigger.id
+        self.trigger.delete()
+        self.assertEqual(store.get_many([(trigger_id, 1)]), {})
+        with self.assertNumQueries(0):
+            self.assertIsNone(store.get(trigger_id, 1))
+
+    def test_store_evicts_least_recently_used(self):
+        other = AgentTrigger.objects.create(name='Other', trigger_type='prompt', action_payload={'n': 2})
+        store = PayloadStore(maxsize=1)
+        store.get(self.trigger.id, 1)
+        store.get(other.id, 1)
+        self.assertEqual(len(store), 1)
+        with self.assertNumQueries(1):
+            store.get(self.trigger.id, 1)
+
+class TriggerFiringTest(TestCase):
+    def setUp(self):
+        self.trigger = AgentTrigger.objects.create(
+            name='History Trigger', trigger_type='prompt', action_payload={'message': 'log me'}
+        )
+
+    def test_process_agent_action_records_firing(self):
+        version = trigger_set_version()
+        with self.assertNumQueries(7), \
+                patch('ai_agent_gateway.tasks.get_payload_store', return_value=PayloadStore()):
+            # Name and payload, then the flush: names, insert and
+            # last_triggered inside a savepoint.
+            process_agent_action(self.trigger.id, self.trigger.payload_version)
+        firing = TriggerFiring.objects.get()
+        self.assertEqual(firing.trigger, self.trigger)
+        self.assertEqual(firing.trigger_name, 'History Trigger')
+        self.assertEqual(firing.payload_version, 1)
+        self.assertTrue(firing.succeeded)
+        self.trigger.refresh_from_db()
+        self.assertEqual(self.trigger.last_triggered, firing.fired_at)
+        self.assertEqual(trigger_set_version(), version)
+
+    def test_buffer_flushes_every_n_records(self):
+        buffer = FiringBuffer(max_records=3, flush_interval=None)
+        now = timezone.now()
+        buffer.add(firing_for(self.trigger.id, 1, fired_at=now - datetime.timedelta(seconds=5)))
+        buffer.add(firing_for(self.trigger.id, 1, fired_at=now))
+        self.assertEqual(TriggerFiring.objects.count(), 0)
+        buffer.add(firing_for(self.trigger.id, 1, error=ValueError('boom'), fired_at=now + datetime.timedelta(seconds=5)))
+        self.assertEqual(len(buffer), 0)
+        self.assertEqual(TriggerFiring.objects.count(), 3)
+        self.assertEqual(TriggerFiring.objects.get(succeeded=False).error, 'boom')
+        self.trigger.refresh_from_db()
+        self.assertEqual(self.trigger.last_triggered, now)
+
+    def test_buffer_flushes_after_interval(self):
+        flushed = threading.Event()
+        buffer = FiringBuffer(max_records=100, flush_interval=0.05)
+        with patch('ai_agent_gateway.history.write_firings', side_effect=lambda firings: flushed.set()) as mock_write:
+            buffer.add(firing_for(self.trigger.id, 1))
+            self.assertTrue(flushed.wait(2))
+        self.assertEqual(len(mock_write.call_args[0][0]), 1)
+        self.assertEqual(len(buffer), 0)
+
+    def test_firing_of_deleted_trigger_is_kept(self):
+        buffer = FiringBuffer(max_records=10, flush_interval=None)
+        buffer.add(firing_for(self.trigger.id, 1))
+        AgentTrigger.objects.filter(id=self.trigger.id).delete()
+        self.assertEqual(buffer.flush(), 1)
+        firing = TriggerFiring.objects.get()
+        self.assertIsNone(firing.trigger)
+        self.assertEqual(firing.trigger_name, '')
+
+class BenchmarkTest(TestCase):
+    def test_run_benchmarks_reports_every_scenario(self):
+        report = run_benchmarks(sizes=[40, 20], prompts=10, scans=2, log=lambda line: None)
+        self.assertEqual(AgentTrigger.objects.count(), 40)
+        self.assertEqual(
+            [(result['size'], result['scenario']) for result in report['results']],
+            [(size, scenario) for size in (20, 40) for scenario in (
+                'matcher_build', 'handle_prompt', 'check_scheduled_triggers', 'check_periodic_triggers'
+            )],
+        )
+        prompt_result = report['results'][1]
+        self.assertEqual(prompt_result['calls'], 10)
+        self.assertLessEqual(prompt_result['p50_ms'], prompt_result['p99_ms'])
+        self.assertEqual(prompt_result['queries_per_call'], 1)
+        json.dumps(report)
 
 class AgentTriggerHypothesisTest(HypothesisTestCase):
     @given(
@@ -207,7 +811,828 @@ class AgentTriggerHypothesisTest(HypothesisTestCase):
         
         if re.search(f"^{escaped_prompt}$", prompt):
             self.assertEqual(response.json()['message'], f'Trigger {trigger.name} activated')
-            mock_delay.assert_called_once_with(trigger.id, trigger.action_payload)
+            mock_delay.assert_called_once_with(trigger.id, trigger.payload_version)
         else:
             self.assertEqual(response.json()['message'], 'No matching triggers found')
             mock_delay.assert_not_called()
+
+class PromptMatcherTest(TestCase):
+    def _trigger(self, name, pattern, active=True):
+        return AgentTrigger.objects.create(
+            name=name,
+            trigger_type='prompt',
+            prompt_pattern=pattern,
+            active=active,
+            action_payload={'name': name}
+        )
+
+    def test_literal_prefix(self):
+        self.assertEqual(literal_prefix('^hello$'), 'hello')
+        self.assertEqual(literal_prefix('hello world.*'), 'hello world')
+        self.assertEqual(literal_prefix(r'price\$\d+'), 'price$')
+        self.assertEqual(literal_prefix('colou?r'), 'colo')
+        self.assertEqual(literal_prefix('ab+c'), 'ab')
+        self.assertEqual(literal_prefix('yes|no'), '')
+        self.assertEqual(literal_prefix('(?i)hello'), '')
+
+    def test_first_match_wins_across_prefixes(self):
+        broad = self._trigger('Broad', 'he')
+        self._trigger('Narrow', '^hello world$')
+        self._trigger('Grouped', '(h)(e)llo')
+        matcher = get_prompt_matcher()
+        self.assertEqual(matcher.match('hello world').id, broad.id)
+        self.assertIsNone(matcher.match('goodbye'))
+
+    def test_patterns_with_groups_and_flags(self):
+        self._trigger('Inactive', '.*', active=False)
+        backref = self._trigger('Backref', r'(\w+) \1')
+        flagged = self._trigger('Flagged', '(?i)HELLO')
+        named = self._trigger('Named', '(?P<word>bye)')
+        matcher = get_prompt_matcher()
+        self.assertEqual(matcher.match('echo echo').id, backref.id)
+        self.assertEqual(matcher.match('hello').id, flagged.id)
+        self.assertEqual(matcher.match('bye').id, named.id)
+        self.assertIsNone(matcher.match('anything else'))
+
+    def test_invalid_pattern_raises_only_when_reached(self):
+        first = self._trigger('First', 'ok')
+        self._trigger('Broken', '(unclosed')
+        matcher = get_prompt_matcher()
+        self.assertEqual(matcher.match('ok').id, first.id)
+        with self.assertRaises(PatternError) as ctx:
+            matcher.match('nope')
+        self.assertEqual(ctx.exception.trigger_name, 'Broken')
+
+    def test_matcher_is_cached_until_triggers_change(self):
+        trigger = self._trigger('Cached', '^hi')
+        matcher = get_prompt_matcher()
+        # Only the trigger set version is read.
+        with self.assertNumQueries(1):
+            self.assertIs(get_prompt_matcher(), matcher)
+
+        trigger.prompt_pattern = '^hey'
+        trigger.save()
+        rebuilt = get_prompt_matcher()
+        self.assertIsNot(rebuilt, matcher)
+        self.assertIsNone(rebuilt.match('hi'))
+        self.assertEqual(rebuilt.match('hey').id, trigger.id)
+
+        trigger.delete()
+        self.assertIsNone(get_prompt_matcher().match('hey'))
+
+    def test_trigger_set_version_is_stored_in_the_database(self):
+        version = trigger_set_version()
+        caches['default'].clear()
+        self.assertEqual(trigger_set_version(), version)
+        try:
+            with transaction.atomic():
+                self._trigger('Rolled back', '^rolled')
+                rolled_back = get_prompt_matcher()
+                raise RuntimeError('roll back')
+        except RuntimeError:
+            pass
+        self.assertEqual(trigger_set_version(), version)
+        self._trigger('Committed', '^committed')
+        matcher = get_prompt_matcher()
+        self.assertIsNot(matcher, rolled_back)
+        self.assertIsNone(matcher.match('rolled'))
+
+
+class SharedCacheCheckTest(TestCase):
+    def ids(self):
+        return [message.id for message in check_shared_caches(None)]
+
+    def test_process_local_caches_are_flagged(self):
+        with self.settings(AGENT_GATEWAY_SHARED_CACHE_ALIAS=None, AGENT_GATEWAY_MATCH_CACHE_ALIAS=None):
+            self.assertEqual(self.ids(), ['ai_agent_gateway.W001'])
+        with self.settings(AGENT_GATEWAY_SHARED_CACHE_ALIAS='default', AGENT_GATEWAY_MATCH_CACHE_ALIAS='missing'):
+            self.assertEqual(self.ids(), ['ai_agent_gateway.E001', 'ai_agent_gateway.E001'])
+
+    def test_shared_cache_passes(self):
+        shared = {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': 'redis://127.0.0.1:6379/1'}
+        with self.settings(CACHES={**django_settings.CACHES, 'shared': shared},
+                           AGENT_GATEWAY_SHARED_CACHE_ALIAS='shared', AGENT_GATEWAY_MATCH_CACHE_ALIAS='shared'):
+            self.assertEqual(self.ids(), [])
+
+
+class PatternSafetyTest(TestCase):
+    def test_classify_pattern(self):
+        for pattern in ['^order \\d+', 'hello world', r'\d+-\d+', '(foo|bar)+', '(a|ab)*', '(?i)hi\\s+there', '(?>a+)+', r'(\d{1,3}\.){3}\d{1,3}', '(?:a|a){1,5}']:
+            self.assertEqual(classify_pattern(pattern).level, SAFE, pattern)
+        for pattern in [r'\d+\d+', '.*foo.*', r'(\w)\1']:
+            self.assertEqual(classify_pattern(pattern).level, RISKY, pattern)
+        for pattern in ['(a+)+b', r'^(\w+\s?)*$', '(a|aa)+', '(x|.)*y', '(?:a|a){1,40}$', '(?:a?){26}a{26}$', '((a{1,4}){1,4}){1,4}']:
+            self.assertEqual(classify_pattern(pattern).level, DANGEROUS, pattern)
+
+    def test_validation_rejects_dangerous_and_invalid_patterns(self):
+        validate_prompt_pattern('.*foo.*')
+        with self.assertRaises(ValidationError):
+            validate_prompt_pattern('(a+)+b')
+        with self.assertRaises(ValidationError):
+            validate_prompt_pattern('(unclosed')
+        trigger = AgentTrigger(name='Admin Trigger', trigger_type='prompt', prompt_pattern='(a+)+b', action_payload={})
+        with self.assertRaises(ValidationError) as ctx:
+            trigger.full_clean()
+        self.assertIn('prompt_pattern', ctx.exception.message_dict)
+
+    def test_create_trigger_rejects_dangerous_pattern(self):
+        response = self.client.post(reverse('create_trigger'), {
+            'name': 'ReDoS Trigger',
+            'trigger_type': 'prompt',
+            'prompt_pattern': '(a+)+b',
+            'action_payload': '{}',
+            'active': 'on',
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(AgentTrigger.objects.filter(name='ReDoS Trigger').exists())
+
+    def test_pattern_risk_is_stored_on_save(self):
+        trigger = AgentTrigger.objects.create(name='Risky', trigger_type='prompt', prompt_pattern='.*a.*b')
+        self.assertEqual(trigger.pattern_risk, RISKY)
+
+    def test_dangerous_legacy_pattern_is_quarantined(self):
+        safe = AgentTrigger.objects.create(name='Safe', trigger_type='prompt', prompt_pattern='^aaa')
+        legacy = AgentTrigger.objects.create(name='Legacy', trigger_type='prompt', prompt_pattern='(a+)+b')
+        self.assertEqual(get_prompt_matcher().match('aaaaaaaaaaaaaaaaaaaaaaaaaaaaaa!').id, safe.id)
+        self.assertIsNone(get_prompt_matcher().match('ab'))
+        legacy.refresh_from_db()
+        self.assertIsNotNone(legacy.quarantined_at)
+        self.assertIn('catastrophic backtracking', legacy.quarantine_reason)
+
+    def test_pattern_over_budget_is_quarantined(self):
+        risky = AgentTrigger(id=1, name='Slow', trigger_type='prompt', prompt_pattern='.*a.*b')
+        with patch.dict('ai_agent_gateway.matcher._pending_quarantines'):
+            matcher = PromptMatcher.from_triggers([risky], budget=0)
+            matcher.match('xaxb')
+            self.assertIsNone(matcher.match('xaxb'))
+            self.assertTrue(matcher._root.entries[0].quarantined)
+
+    @patch('ai_agent_gateway.views.process_agent_action.delay')
+    def test_handle_prompt_rejects_long_prompts(self, mock_delay):
+        with self.settings(AGENT_GATEWAY_MAX_PROMPT_LENGTH=10):
+            response = self.client.post(
+                reverse('handle_prompt'), json.dumps({'prompt': 'x' * 11}), content_type='application/json'
+            )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'error': 'Prompt is too long'})
+        mock_delay.assert_not_called()
+
+
+class SimilarityTriggerTest(TestCase):
+    def _trigger(self, name, utterances, threshold=None):
+        return AgentTrigger.objects.create(
+            name=name,
+            trigger_type='similarity',
+            example_utterances=utterances,
+            similarity_threshold=threshold,
+            action_payload={'name': name},
+        )
+
+    def setUp(self):
+        self.refund = self._trigger('Refund', ['I want a refund for my order', 'please refund my payment'])
+        self.password = self._trigger('Password', ['reset my password', 'I forgot my password'])
+
+    def test_vectors_are_normalized_and_similar_texts_score_higher(self):
+        vectors = vectorize(['refund my order', 'please refund my order', 'what is the weather'])
+        self.assertEqual(vectors.shape[1], 1024)
+        self.assertAlmostEqual(float((vectors[0] ** 2).sum()), 1.0, places=5)
+        self.assertGreater(vectors[0] @ vectors[1], vectors[0] @ vectors[2])
+
+    def test_matcher_scores_similarity_triggers(self):
+        matcher = get_prompt_matcher()
+        self.assertEqual(matcher.match('can I get a refund for my order?').id, self.refund.id)
+        self.assertEqual(matcher.match('I forgot the password').id, self.password.id)
+        self.assertIsNone(matcher.match('what time is the meeting tomorrow'))
+
+    def test_regex_triggers_take_precedence(self):
+        regex_trigger = AgentTrigger.objects.create(name='Regex', trigger_type='prompt', prompt_pattern='^please refund')
+        self.assertEqual(get_prompt_matcher().match('please refund my payment').id, regex_trigger.id)
+
+    def test_top_k_ranks_by_score_and_applies_thresholds(self):
+        strict = self._trigger('Strict', ['refund my payment'], threshold=0.99)
+        index = get_prompt_matcher().similarity
+        matches = index.match('please refund my payment now', top_k=2)
+        self.assertEqual([entry.id for entry, _ in matches], [self.refund.id])
+        self.assertNotIn(strict.id, [entry.id for entry, _ in index.match('please refund my payment now', top_k=5)])
+        self.assertEqual(index.match('please refund my payment', top_k=1)[0][0].id, self.refund.id)
+
+    def test_index_is_rebuilt_incrementally(self):
+        with patch.dict('ai_agent_gateway.similarity._blocks', clear=True), \
+                patch('ai_agent_gateway.similarity.vectorize', wraps=vectorize) as mock_vectorize:
+            get_prompt_matcher()
+            self.assertEqual(mock_vectorize.call_count, 2)
+            self.password.example_utterances = ['change my password']
+            self.password.save()
+            get_prompt_matcher()
+            self.assertEqual(mock_vectorize.call_count, 3)
+            self.assertEqual(mock_vectorize.call_args[0][0], ('change my password',))
+
+    def test_build_index_without_utterances(self):
+        self.assertIsNone(build_index([]))
+
+    @patch('ai_agent_gateway.views.process_agent_action.delay')
+    def test_handle_prompt_activates_similarity_trigger(self, mock_delay):
+        response = self.client.post(
+            reverse('handle_prompt'), json.dumps({'prompt': 'refund my order please'}), content_type='application/json'
+        )
+        self.assertEqual(response.json(), {'message': 'Trigger Refund activated'})
+        mock_delay.assert_called_once_with(self.refund.id, self.refund.payload_version)
+
+    def test_create_similarity_trigger(self):
+        response = self.client.post(reverse('create_trigger'), {
+            'name': 'Shipping',
+            'trigger_type': 'similarity',
+            'example_utterances': 'where is my parcel\n\ntrack my shipment\n',
+            'similarity_threshold': '0.5',
+            'action_payload': '{}',
+            'active': 'on',
+        })
+        self.assertEqual(response.status_code, 302)
+        trigger = AgentTrigger.objects.get(name='Shipping')
+        self.assertEqual(trigger.example_utterances, ['where is my parcel', 'track my shipment'])
+        self.assertEqual(trigger.similarity_threshold, 0.5)
+
+        self.client.post(reverse('create_trigger'), {
+            'name': 'Empty', 'trigger_type': 'similarity', 'action_payload': '{}', 'active': 'on',
+        })
+        self.assertFalse(AgentTrigger.objects.filter(name='Empty').exists())
+
+
+class MatchCacheTest(TestCase):
+    def setUp(self):
+        self.trigger = AgentTrigger.objects.create(name='Cached Match', trigger_type='prompt', prompt_pattern='^hi')
+
+    def test_repeated_prompts_skip_matching(self):
+        matcher = get_prompt_matcher()
+        with patch.object(matcher, '_match', wraps=matcher._match) as mock_match:
+            self.assertEqual(matcher.match('hi there').id, self.trigger.id)
+            self.assertEqual(matcher.match('hi there').id, self.trigger.id)
+            self.assertIsNone(matcher.match('nothing'))
+            self.assertIsNone(matcher.match('nothing'))
+        self.assertEqual(mock_match.call_count, 2)
+        self.assertEqual((matcher.cache.hits, matcher.cache.misses), (2, 2))
+
+    def test_trigger_edit_never_serves_stale_results(self):
+        self.assertEqual(get_prompt_matcher().match('hi').id, self.trigger.id)
+        self.trigger.prompt_pattern = '^hey'
+        self.trigger.save()
+        self.assertIsNone(get_prompt_matcher().match('hi'))
+        self.assertEqual(get_prompt_matcher().match('hey').id, self.trigger.id)
+
+    def test_shared_tier_is_keyed_by_version(self):
+        first = MatchCache(shared=caches['default'])
+        second = MatchCache(shared=caches['default'])
+        first.set(1, 'hello', 7)
+        first.set(1, 'nothing', None)
+        self.assertEqual(second.get(1, 'hello'), (True, 7))
+        self.assertEqual(second.get(1, 'nothing'), (True, 0))
+        self.assertEqual(second.get(2, 'hello'), (False, None))
+        self.assertEqual(second.get(1, 'Hello'), (False, None))
+
+    def test_lru_eviction_and_settings(self):
+        cache = MatchCache(maxsize=1)
+        cache.set(1, 'a', 1)
+        cache.set(1, 'b', 2)
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.get(1, 'a'), (False, None))
+        with self.settings(AGENT_GATEWAY_MATCH_CACHE_SIZE=0):
+            self.assertIsNone(MatchCache.from_settings())
+
+
+class TriggerListPaginationTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.triggers = [
+            AgentTrigger.objects.create(
+                name=f'Trigger {i}', trigger_type='prompt' if i % 2 else 'scheduled',
+                prompt_pattern=f'^t{i}', active=i != 3, action_payload={'big': 'x' * 100},
+            )
+            for i in range(1, 6)
+        ]
+        self.ids = [trigger.id for trigger in self.triggers]
+
+    def get_json(self, **params):
+        response = self.client.get(reverse('agent_gateway:trigger_list_json'), params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_keyset_pages_walk_forward_and_back(self):
+        with self.assertNumQueries(1):
+            first = self.get_json(limit=2)
+        self.assertEqual([t['id'] for t in first['triggers']], self.ids[:2])
+        self.assertIsNone(first['previous_cursor'])
+        second = self.get_json(limit=2, after=first['next_cursor'])
+        self.assertEqual([t['id'] for t in second['triggers']], self.ids[2:4])
+        last = self.get_json(limit=2, after=second['next_cursor'])
+        self.assertEqual([t['id'] for t in last['triggers']], self.ids[4:])
+        self.assertIsNone(last['next_cursor'])
+        back = self.get_json(limit=2, before=last['previous_cursor'])
+        self.assertEqual([t['id'] for t in back['triggers']], self.ids[2:4])
+        self.assertNotIn('action_payload', first['triggers'][0])
+
+    def test_filters(self):
+        page = self.get_json(trigger_type='prompt', active='true')
+        self.assertEqual([t['id'] for t in page['triggers']], [self.ids[0], self.ids[4]])
+
+    def test_html_page_defers_payload(self):
+        response = self.client.get(reverse('trigger_list'), {'limit': 2})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('action_payload', response.context['triggers'][0].get_deferred_fields())
+        self.assertEqual(response.context['next_cursor'], self.ids[1])
+        self.assertContains(response, f'limit=2&amp;after={self.ids[1]}')
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse('agent_gateway:trigger_list_json'), {'after': 'abc'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.get(reverse('trigger_list'), {'limit': '0'}).status_code, 400)
+
+
+class TriggerTransferTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.staff = get_user_model().objects.create_user('staff', password='pw', is_staff=True)
+        self.client.force_login(self.staff)
+        AgentTrigger.objects.create(name='Prompt', trigger_type='prompt', prompt_pattern=r'^order \d+', action_payload={'é': [1, 2]}, rate_limit=5)
+        AgentTrigger.objects.create(
+            name='Periodic', trigger_type='periodic', periodic_interval=datetime.timedelta(minutes=5),
+            coalesce_window=datetime.timedelta(seconds=30),
+        )
+        AgentTrigger.objects.create(
+            name='Scheduled', trigger_type='scheduled', scheduled_time=timezone.now() + datetime.timedelta(days=1), active=False,
+        )
+        AgentTrigger.objects.create(name='Similar', trigger_type='similarity', example_utterances=['refund please'], similarity_threshold=0.5)
+
+    def snapshot(self):
+        return [
+            (t.name, t.trigger_type, t.prompt_pattern, t.scheduled_time, t.periodic_interval, t.active, t.action_payload,
+             t.example_utterances, t.similarity_threshold, t.rate_limit, t.coalesce_window,
+             t.payload_hash, t.pattern_risk, t.next_fire_at is not None)
+            for t in AgentTrigger.objects.order_by('name')
+        ]
+
+    def test_export_import_round_trip(self):
+        before = self.snapshot()
+        response = self.client.get(reverse('agent_gateway:trigger_export'))
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        body = b''.join(response.streaming_content)
+        AgentTrigger.objects.all().delete()
+        self.assertIsNone(get_prompt_matcher().match('order 7'))
+
+        response = self.client.post(reverse('agent_gateway:trigger_import'), body, content_type='application/x-ndjson')
+        self.assertEqual(response.json(), {'created': 4, 'failed': 0, 'errors': []})
+        self.assertEqual(self.snapshot(), before)
+        self.assertEqual(get_prompt_matcher().match('order 7').name, 'Prompt')
+
+    def test_invalid_lines_are_rejected(self):
+        lines = [
+            json.dumps({'name': 'ok', 'trigger_type': 'prompt', 'prompt_pattern': '^ok'}),
+            '{not json',
+            '',
+            json.dumps({'name': 'redos', 'trigger_type': 'prompt', 'prompt_pattern': '(a+)+$'}),
+            json.dumps({'name': 'extra', 'trigger_type': 'prompt', 'id': 1}),
+            json.dumps({'name': 'bad type', 'trigger_type': 'nope'}),
+            json.dumps({'name': 'when', 'trigger_type': 'scheduled', 'scheduled_time': 'tomorrow'}),
+            json.dumps({'name': 'ok too', 'trigger_type': 'periodic', 'periodic_interval': 'PT1H'}),
+        ]
+        result = import_triggers(lines, batch_size=1)
+        self.assertEqual(result.created, 2)
+        self.assertEqual([line for line, _ in result.errors], [2, 4, 5, 6, 7])
+        self.assertTrue(AgentTrigger.objects.filter(name='ok too', periodic_interval=datetime.timedelta(hours=1)).exists())
+
+        dry = import_triggers(lines[:1], dry_run=True)
+        self.assertEqual((dry.created, AgentTrigger.objects.filter(name='ok').count()), (1, 1))
+
+    def test_export_reads_in_chunks(self):
+        with self.assertNumQueries(3):
+            lines = list(export_triggers(chunk_size=2))
+        self.assertEqual(len(lines), 4)
+        self.assertEqual(json.loads(lines[0])['name'], 'Prompt')
+
+    def test_requires_staff(self):
+        self.client.logout()
+        self.assertEqual(self.client.get(reverse('agent_gateway:trigger_export')).status_code, 302)
+        response = self.client.post(reverse('agent_gateway:trigger_import'), b'', content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 302)
+
+    def test_import_requires_a_csrf_token(self):
+        client = Client(enforce_csrf_checks=True)
+        client.force_login(self.staff)
+        line = json.dumps({'name': 'forged', 'trigger_type': 'prompt', 'prompt_pattern': '^forged'})
+        url = reverse('agent_gateway:trigger_import')
+        self.assertEqual(client.post(url, line, content_type='application/x-ndjson').status_code, 403)
+        self.assertFalse(AgentTrigger.objects.filter(name='forged').exists())
+
+
+class TaskRoutingTest(TestCase):
+    def route(self, name):
+        from celery import current_app
+        route = current_app.amqp.router.route({}, name)
+        return route['queue'].name, route.get('priority')
+
+    def test_scans_and_actions_use_separate_queues(self):
+        self.assertEqual(self.route('ai_agent_gateway.tasks.check_scheduled_triggers'), ('agent_scans', 0))
+        self.assertEqual(self.route('ai_agent_gateway.tasks.check_periodic_triggers'), ('agent_scans', 0))
+        self.assertEqual(self.route('ai_agent_gateway.tasks.process_agent_action'), ('agent_actions', 3))
+        self.assertEqual(self.route('ai_agent_gateway.tasks.process_agent_actions'), ('agent_actions', 6))
+
+    def test_beat_schedule_is_configured(self):
+        from celery import current_app
+        entry = current_app.conf.beat_schedule['check-scheduled-triggers']
+        self.assertEqual(entry['task'], 'ai_agent_gateway.tasks.check_scheduled_triggers')
+        self.assertEqual(entry['options'], {'expires': 55})
+
+    def test_worker_profiles(self):
+        argv = worker_argv('scans', beat=True)
+        self.assertEqual(argv[argv.index('--queues') + 1], 'agent_scans')
+        self.assertEqual(argv[argv.index('--prefetch-multiplier') + 1], '1')
+        self.assertIn('--beat', argv)
+        with self.settings(AGENT_GATEWAY_ACTION_QUEUE='actions', AGENT_GATEWAY_WORKER_PROFILES={'actions': {'concurrency': 64}}):
+            argv = worker_argv('actions')
+        self.assertEqual(argv[argv.index('--queues') + 1], 'actions')
+        self.assertEqual(argv[argv.index('--concurrency') + 1], '64')
+
+
+class IdempotencyTest(TestCase):
+    def setUp(self):
+        self.trigger = AgentTrigger.objects.create(name='Once', trigger_type='scheduled', action_payload={'a': 1})
+        self.dedup = Deduplicator(DatabaseDedupSet(), ttl=60)
+        patcher = patch('ai_agent_gateway.tasks.get_deduplicator', return_value=self.dedup)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_duplicate_firing_runs_once(self):
+        key = firing_key(self.trigger.id, timezone.now())
+        for _ in range(3):
+            process_agent_action.apply(args=(self.trigger.id, self.trigger.payload_version), kwargs={'idempotency_key': key})
+        self.assertEqual(TriggerFiring.objects.filter(trigger=self.trigger).count(), 1)
+        self.assertEqual(self.dedup.stats(), {'hits': 2, 'misses': 1, 'hit_rate': 0.6667})
+
+    def test_redelivered_message_is_dropped(self):
+        for _ in range(2):
+            process_agent_action.apply(args=(self.trigger.id, self.trigger.payload_version), task_id='same-message')
+        process_agent_action.apply(args=(self.trigger.id, self.trigger.payload_version), task_id='other-message')
+        self.assertEqual(TriggerFiring.objects.filter(trigger=self.trigger).count(), 2)
+
+    def test_failed_action_is_retried(self):
+        key = firing_key(self.trigger.id, timezone.now())
+        client = MagicMock()
+        client.post.side_effect = [AgentClientError('boom'), None]
+        with patch('ai_agent_gateway.tasks.get_agent_client', return_value=client):
+            result = process_agent_action.apply(args=(self.trigger.id, self.trigger.payload_version), kwargs={'idempotency_key': key})
+            self.assertTrue(result.successful())
+            process_agent_action.apply(args=(self.trigger.id, self.trigger.payload_version), kwargs={'idempotency_key': key})
+        self.assertEqual(client.post.call_count, 2)
+        self.assertEqual(list(TriggerFiring.objects.filter(trigger=self.trigger).values_list('succeeded', flat=True)), [True, False])
+
+    def test_failed_action_gives_up_after_max_retries(self):
+        client = MagicMock()
+        client.post.side_effect = AgentClientError('down')
+        with patch('ai_agent_gateway.tasks.get_agent_client', return_value=client):
+            result = process_agent_action.apply(args=(self.trigger.id, self.trigger.payload_version), task_id='failing')
+        self.assertTrue(result.failed())
+        self.assertEqual(client.post.call_count, process_agent_action.max_retries + 1)
+        # The key was released, so a later redelivery can still run.
+        self.assertTrue(self.dedup.claim(task_key('failing')))
+
+    def test_task_keys_do_not_write_claims(self):
+        dedup = Deduplicator(DatabaseDedupSet(), ttl=60, task_backend=CacheDedupSet(caches['default']))
+        self.addCleanup(caches['default'].clear)
+        self.assertTrue(dedup.claim(task_key('message')))
+        self.assertFalse(dedup.claim(task_key('message')))
+        self.assertFalse(ActionClaim.objects.exists())
+        self.assertTrue(dedup.claim(firing_key(self.trigger.id, timezone.now())))
+        self.assertEqual(ActionClaim.objects.count(), 1)
+
+    def test_expired_claims_can_be_taken_over(self):
+        backend = DatabaseDedupSet()
+        self.assertTrue(backend.claim('k', ttl=60))
+        self.assertFalse(backend.claim('k', ttl=60))
+        self.assertTrue(backend.claim('k', ttl=0))
+        self.assertEqual(backend.purge(ttl=0, now=timezone.now() + datetime.timedelta(seconds=1)), 1)
+
+
+class ThrottlingTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.throttle = Throttle()
+        patcher = patch('ai_agent_gateway.views.get_throttle', return_value=self.throttle)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_token_bucket_refills_over_time(self):
+        now = [0.0]
+        bucket = LocalTokenBucket(clock=lambda: now[0])
+        self.assertEqual([bucket.allow(1, 1.0, 2) for _ in range(3)], [True, True, False])
+        now[0] = 1.0
+        self.assertTrue(bucket.allow(1, 1.0, 2))
+        self.assertFalse(bucket.allow(1, 1.0, 2))
+        self.assertTrue(bucket.allow(2, 1.0, 2))
+
+    @patch('ai_agent_gateway.views.process_agent_action.delay')
+    def test_rate_limited_prompt_gets_429(self, mock_delay):
+        AgentTrigger.objects.create(name='Limited', trigger_type='prompt', prompt_pattern='^limit', rate_limit=1, rate_burst=2)
+        statuses = [
+            self.client.post(reverse('handle_prompt'), json.dumps({'prompt': 'limit me'}), content_type='application/json').status_code
+            for _ in range(3)
+        ]
+        self.assertEqual(statuses, [200, 200, 429])
+        self.assertEqual(mock_delay.call_count, 2)
+
+    @patch('ai_agent_gateway.throttling.threading.Timer')
+    @patch('ai_agent_gateway.tasks.process_agent_action.delay')
+    def test_firings_in_window_are_coalesced(self, mock_delay, mock_timer):
+        trigger = AgentTrigger.objects.create(
+            name='Coalesced', trigger_type='prompt', prompt_pattern='^merge',
+            coalesce_window=datetime.timedelta(seconds=30),
+        )
+        for _ in range(3):
+            response = self.client.post(reverse('handle_prompt'), json.dumps({'prompt': 'merge'}), content_type='application/json')
+            self.assertTrue(response.json()['coalesced'])
+        mock_timer.assert_called_once()
+        self.assertEqual(mock_timer.call_args.args[0], 30.0)
+        mock_delay.assert_not_called()
+
+        self.assertEqual(self.throttle.local_coalescer.flush(trigger.id, trigger.payload_version), 3)
+        mock_delay.assert_called_once_with(trigger.id, trigger.payload_version, count=3)
+
+    def test_coalesced_count_is_recorded(self):
+        trigger = AgentTrigger.objects.create(name='Counted', trigger_type='prompt', action_payload={'do': 'it'})
+        with patch('ai_agent_gateway.tasks.get_payload_store', return_value=PayloadStore()), \
+                self.assertLogs('ai_agent_gateway.tasks', level='INFO') as logs:
+            process_agent_action(trigger.id, trigger.payload_version, count=3)
+        self.assertEqual(TriggerFiring.objects.get(trigger=trigger).count, 3)
+        self.assertIn("'coalesced_count': 3", logs.output[-1])
+
+    def test_redis_errors_fall_back_to_local_bucket(self):
+        redis_client = MagicMock()
+        redis_client.register_script.return_value.side_effect = ConnectionError('down')
+        redis_client.getdel.side_effect = ConnectionError('down')
+        throttle = Throttle(redis_client)
+        trigger = PromptMatcher.from_triggers([
+            AgentTrigger(id=1, name='r', trigger_type='prompt', prompt_pattern='x', rate_limit=1),
+        ]).match('x')
+        self.assertEqual([throttle.admit(trigger), throttle.admit(trigger)], [SEND, LIMITED])
+        self.assertEqual(throttle.take_coalesced(1), 0)
+
+    @patch('ai_agent_gateway.throttling.threading.Timer')
+    @patch('ai_agent_gateway.tasks.process_agent_action.apply_async', side_effect=ConnectionError('broker down'))
+    def test_publish_failure_closes_the_redis_window(self, mock_apply_async, mock_timer):
+        redis_client = MagicMock()
+        redis_client.register_script.return_value.return_value = 1
+        throttle = Throttle(redis_client)
+        trigger = PromptMatcher.from_triggers([
+            AgentTrigger(id=1, name='c', trigger_type='prompt', prompt_pattern='x', coalesce_window=datetime.timedelta(seconds=30)),
+        ]).match('x')
+        self.assertEqual(throttle.admit(trigger), COALESCED)
+        redis_client.delete.assert_called_once_with('ai_agent_gateway:coalesce:1')
+        mock_timer.assert_called_once()
+
+    def test_unthrottled_triggers_skip_the_throttle(self):
+        trigger = PromptMatcher.from_triggers([AgentTrigger(id=1, name='t', trigger_type='prompt', prompt_pattern='x')]).match('x')
+        self.assertIsNone(trigger.policy)
+        self.assertEqual(self.throttle.admit(trigger), SEND)
+
+
+class MetricsTest(TestCase):
+    def setUp(self):
+        self.registry = MetricsRegistry()
+        patcher = patch('ai_agent_gateway.metrics.registry', self.registry)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = Client()
+        self.staff = get_user_model().objects.create_user(username='ops', password='pw', is_staff=True)
+
+    def test_histogram_quantiles(self):
+        histogram = Histogram()
+        for _ in range(90):
+            histogram.observe(0.002)
+        for _ in range(10):
+            histogram.observe(0.2)
+        self.assertTrue(0.001 <= histogram.quantile(0.5) <= 0.0025)
+        self.assertTrue(0.1 <= histogram.quantile(0.99) <= 0.25)
+        self.assertEqual(histogram.quantile(1.0), 0.25)
+        self.assertIsNone(Histogram().quantile(0.5))
+        histogram.observe(1000)
+        self.assertEqual(histogram.counts[len(BUCKETS)], 1)
+
+    def test_snapshots_merge(self):
+        other = MetricsRegistry()
+        with span('match', 7, 'seven'):
+            pass
+        other.observe('match', 0.01, 7)
+        other.increment('dedup_hits', 2)
+        merged = MetricsRegistry()
+        merged.merge_snapshot(self.registry.snapshot())
+        merged.merge_snapshot(json.loads(json.dumps(other.snapshot())))
+        row, = merged.summary()
+        self.assertEqual((row['stage'], row['trigger'], row['name'], row['count']), ('match', '7', 'seven', 2))
+        self.assertEqual(merged.counters, {'dedup_hits': 2})
+
+    def test_series_are_capped(self):
+        registry = MetricsRegistry(max_series=2)
+        for trigger_id in range(5):
+            registry.observe('agent_call', 0.1, trigger_id)
+        self.assertEqual(len(registry.series), 3)
+        self.assertEqual(registry.series[('agent_call', 'other')].count, 3)
+
+    @patch('ai_agent_gateway.tasks.process_agent_action.delay')
+    def test_handle_prompt_records_stages(self, mock_delay):
+        trigger = AgentTrigger.objects.create(name='Timed', trigger_type='prompt', prompt_pattern='^time')
+        self.client.post(reverse('handle_prompt'), json.dumps({'prompt': 'time me'}), content_type='application/json')
+        self.client.post(reverse('handle_prompt'), json.dumps({'prompt': 'nothing'}), content_type='application/json')
+        self.assertEqual(self.registry.series[('match', str(trigger.id))].count, 1)
+        self.assertEqual(self.registry.series[('match', '-')].count, 1)
+        self.assertEqual(self.registry.series[('enqueue', str(trigger.id))].count, 1)
+        self.assertEqual(self.registry.names[str(trigger.id)], 'Timed')
+
+    def test_queue_wait_is_recorded(self):
+        trigger = AgentTrigger.objects.create(name='Queued', trigger_type='prompt', action_payload={'do': 'it'})
+        with patch('ai_agent_gateway.tasks.get_payload_store', return_value=PayloadStore()):
+            process_agent_action.apply(
+                (trigger.id, trigger.payload_version), headers={'published_at': time.time() - 2},
+            )
+        self.assertGreaterEqual(self.registry.series[('queue_wait', str(trigger.id))].sum, 2)
+        self.assertEqual(self.registry.series[('action', str(trigger.id))].count, 1)
+
+    def test_scrape_requires_token_or_staff(self):
+        url = reverse('agent_gateway:gateway_metrics')
+        self.assertEqual(self.client.get(url).status_code, 403)
+        with self.settings(AGENT_GATEWAY_METRICS_TOKEN='s3cret'):
+            self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+            self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION='Bearer s3cret').status_code, 200)
+        self.client.force_login(self.staff)
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_scrape_formats(self):
+        self.registry.observe('agent_call', 0.3, 4, 'four')
+        self.registry.increment('dedup_hits')
+        self.client.force_login(self.staff)
+        url = reverse('agent_gateway:gateway_metrics')
+        response = self.client.get(url)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        text = response.content.decode()
+        self.assertIn('agent_gateway_stage_seconds_bucket{stage="agent_call",trigger="4",le="0.25"} 0', text)
+        self.assertIn('agent_gateway_stage_seconds_bucket{stage="agent_call",trigger="4",le="+Inf"} 1', text)
+        self.assertIn('agent_gateway_stage_seconds_count{stage="agent_call",trigger="4"} 1', text)
+        self.assertIn('agent_gateway_dedup_hits_total 1', text)
+
+        data = self.client.get(url, {'format': 'json'}).json()
+        row = next(row for row in data['stages'] if row['stage'] == 'agent_call')
+        self.assertEqual((row['trigger'], row['name'], row['count']), ('4', 'four', 1))
+        self.assertTrue(250 <= row['p99_ms'] <= 500)
+        self.assertEqual(data['counters']['dedup_hits'], 1)
+
+    def test_other_processes_are_merged_through_the_shared_cache(self):
+        self.registry.increment('dedup_hits')
+        with self.settings(AGENT_GATEWAY_SHARED_CACHE_ALIAS=None):
+            self.assertFalse(maybe_publish(force=True))
+            self.assertEqual(collect().counters, {'dedup_hits': 1})
+        with self.settings(AGENT_GATEWAY_SHARED_CACHE_ALIAS='default'), \
+                patch('ai_agent_gateway.metrics._process_key', return_value='ai_agent_gateway:metrics:worker:1'):
+            self.assertTrue(maybe_publish(force=True))
+        with self.settings(AGENT_GATEWAY_SHARED_CACHE_ALIAS='default'):
+            self.assertEqual(collect().counters, {'dedup_hits': 2})
+        caches['default'].clear()
+
+    def test_async_publish_only_runs_when_due(self):
+        with self.settings(AGENT_GATEWAY_SHARED_CACHE_ALIAS='default'), \
+                patch('ai_agent_gateway.metrics._last_publish', 0.0), \
+                patch('ai_agent_gateway.metrics.maybe_publish', return_value=True) as mock_publish:
+            self.assertTrue(async_to_sync(amaybe_publish)())
+            with patch('ai_agent_gateway.metrics._last_publish', time.monotonic()):
+                self.assertFalse(async_to_sync(amaybe_publish)())
+        mock_publish.assert_called_once_with()
+
+    def test_admin_page(self):
+        self.registry.observe('agent_call', 0.3, 4, 'four')
+        self.client.force_login(get_user_model().objects.create_superuser(username='root', password='pw'))
+        response = self.client.get(reverse('admin:ai_agent_gateway_agenttrigger_metrics'))
+        self.assertContains(response, 'four (4)')
+
+
+class PeriodicSpreadTest(TestCase):
+    def setUp(self):
+        self.interval = datetime.timedelta(minutes=5)
+        self.now = timezone.now()
+
+    def on_phase(self, trigger_id, moment):
+        return (moment - PHASE_EPOCH - phase_offset(trigger_id, self.interval)) % self.interval == datetime.timedelta(0)
+
+    def test_phase_offsets_are_deterministic_and_uniform(self):
+        offsets = [phase_offset(trigger_id, self.interval) for trigger_id in range(1, 1001)]
+        self.assertEqual(offsets, [phase_offset(trigger_id, self.interval) for trigger_id in range(1, 1001)])
+        self.assertTrue(all(datetime.timedelta(0) <= offset < self.interval for offset in offsets))
+        per_minute = [sum(1 for offset in offsets if offset // datetime.timedelta(minutes=1) == m) for m in range(5)]
+        self.assertTrue(all(150 <= n <= 250 for n in per_minute), per_minute)
+
+    def test_next_phase_slot(self):
+        slot = next_phase_slot(7, self.interval, self.now)
+        self.assertTrue(self.now < slot <= self.now + self.interval)
+        self.assertTrue(self.on_phase(7, slot))
+        self.assertEqual(next_phase_slot(7, self.interval, slot), slot + self.interval)
+        # Missed slots are skipped, not replayed.
+        self.assertEqual(next_phase_slot(7, self.interval, slot + 10 * self.interval - datetime.timedelta(seconds=1)), slot + 10 * self.interval)
+        self.assertIsNone(next_phase_slot(7, datetime.timedelta(days=999999999), self.now))
+        self.assertEqual(phase_offset(7, datetime.timedelta(0)), datetime.timedelta(0))
+
+    def create_due(self, n):
+        return [
+            AgentTrigger.objects.create(
+                name=f'Periodic {i}', trigger_type='periodic', periodic_interval=self.interval,
+                last_triggered=self.now - datetime.timedelta(minutes=10),
+            )
+            for i in range(n)
+        ]
+
+    @override_settings(AGENT_GATEWAY_PERIODIC_SPREAD='phase')
+    def test_claims_move_triggers_onto_their_phase(self):
+        for skip_locked in (False, True):
+            AgentTrigger.objects.all().delete()
+            triggers = self.create_due(6)
+            with patch.object(connection.features, 'has_select_for_update_skip_locked', skip_locked):
+                self.assertEqual(len(claim_due_triggers('periodic', self.now)), 6)
+            for trigger in triggers:
+                trigger.refresh_from_db()
+                self.assertTrue(self.now < trigger.next_fire_at <= self.now + self.interval)
+                self.assertTrue(self.on_phase(trigger.id, trigger.next_fire_at))
+                # Saving keeps the trigger on its phase.
+                trigger.save()
+                self.assertTrue(self.on_phase(trigger.id, trigger.next_fire_at))
+            self.assertGreater(len({t.next_fire_at for t in triggers}), 1)
+
+    @override_settings(AGENT_GATEWAY_PERIODIC_SPREAD='smooth', AGENT_GATEWAY_SMOOTHING_WINDOW=60)
+    @patch('ai_agent_gateway.tasks.process_agent_action.apply_async')
+    def test_smoothed_scan_does_not_reclaim_its_own_firings(self, mock_apply_async):
+        # Fired now, a trigger whose interval is the window is next due
+        # within the lookahead.
+        self.interval = datetime.timedelta(seconds=60)
+        for skip_locked in (False, True):
+            AgentTrigger.objects.all().delete()
+            mock_apply_async.reset_mock()
+            triggers = self.create_due(3)
+            with patch.object(connection.features, 'has_select_for_update_skip_locked', skip_locked):
+                self.assertEqual(check_periodic_triggers(), 3)
+            self.assertEqual(mock_apply_async.call_count, 3)
+            for trigger in triggers:
+                trigger.refresh_from_db()
+                self.assertLessEqual(trigger.last_triggered, timezone.now())
+                self.assertTrue(trigger.last_triggered < trigger.next_fire_at <= trigger.last_triggered + self.interval)
+
+    @override_settings(AGENT_GATEWAY_PERIODIC_SPREAD='smooth', AGENT_GATEWAY_SMOOTHING_WINDOW=0)
+    @patch('ai_agent_gateway.tasks.process_agent_action.apply_async')
+    def test_smoothing_window_can_be_zero(self, mock_apply_async):
+        self.create_due(2)
+        self.assertEqual(check_periodic_triggers(), 2)
+        self.assertEqual(mock_apply_async.call_count, 2)
+
+    @override_settings(AGENT_GATEWAY_PERIODIC_SPREAD='smooth', AGENT_GATEWAY_SMOOTHING_WINDOW=60)
+    @patch('ai_agent_gateway.tasks.process_agent_action.apply_async')
+    def test_smoothed_scan_sends_firings_at_their_due_time(self, mock_apply_async):
+        overdue = self.create_due(3)
+        soon = AgentTrigger.objects.create(name='Soon', trigger_type='periodic', periodic_interval=self.interval)
+        short = AgentTrigger.objects.create(name='Short', trigger_type='periodic', periodic_interval=datetime.timedelta(seconds=30))
+        later = AgentTrigger.objects.create(name='Later', trigger_type='periodic', periodic_interval=self.interval)
+        for trigger, delay in ((soon, 30), (short, 30), (later, 90)):
+            AgentTrigger.objects.filter(id=trigger.id).update(next_fire_at=timezone.now() + datetime.timedelta(seconds=delay))
+        due_at = AgentTrigger.objects.get(id=soon.id).next_fire_at
+
+        self.assertEqual(check_periodic_triggers(), 4)
+        etas = {c.args[0][0]: c.kwargs['eta'] for c in mock_apply_async.call_args_list}
+        self.assertCountEqual(etas, [t.id for t in overdue] + [soon.id])
+        self.assertEqual(etas[soon.id], due_at)
+        self.assertEqual(mock_apply_async.call_args_list[-1].args[1], {'idempotency_key': firing_key(soon.id, due_at)})
+        for trigger in overdue:
+            self.assertTrue(timezone.now() - datetime.timedelta(seconds=5) < etas[trigger.id] < timezone.now() + datetime.timedelta(seconds=60))
+        soon.refresh_from_db()
+        self.assertEqual(soon.last_triggered, due_at)
+        self.assertTrue(due_at < soon.next_fire_at <= due_at + self.interval)
+        self.assertTrue(self.on_phase(soon.id, soon.next_fire_at))
+
+        # A trigger moved onto its phase may be due again within the window;
+        # that next slot is a new firing, but nothing is sent twice.
+        sent = {c.args[1]['idempotency_key'] for c in mock_apply_async.call_args_list}
+        mock_apply_async.reset_mock()
+        check_periodic_triggers()
+        again = [c.args[1]['idempotency_key'] for c in mock_apply_async.call_args_list]
+        self.assertFalse(sent & set(again))
+        self.assertTrue({c.args[0][0] for c in mock_apply_async.call_args_list} <= {t.id for t in overdue} | {soon.id})
+
+
+class PromptMatcherHypothesisTest(HypothesisTestCase):
+    @given(
+        patterns=st.lists(
+            st.sampled_from(['a', '^ab', 'abc$', 'a.c', 'b+', '(a|b)c', r'(\w)\1', '(?i)AB', 'x?a', '']),
+            max_size=8,
+        ),
+        prompt=st.text(alphabet='abcx', max_size=5),
+    )
+    @settings(deadline=None)
+    def test_matches_naive_scan(self, patterns, prompt):
+        """The compiled index picks the same trigger as a linear re.match scan."""
+        triggers = [
+            AgentTrigger(id=i + 1, name=f't{i}', trigger_type='prompt', prompt_pattern=p)
+            for i, p in enumerate(patterns)
+        ]
+        expected = next((t.id for t in triggers if re.match(t.prompt_pattern, prompt)), None)
+        found = PromptMatcher.from_triggers(triggers).match(prompt)
+        self.assertEqual(found.id if found else None, expected)
@@ -0,0 +1,241 @@
+import logging
+# agent_gateway/throttling.py
+import threading
+import time
+from dataclasses import dataclass
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+SEND = 'send'
+COALESCED = 'coalesced'
+LIMITED = 'limited'
+
+BUCKET_KEY_PREFIX = 'ai_agent_gateway:bucket'
+COALESCE_KEY_PREFIX = 'ai_agent_gateway:coalesce'
+
+# Refills the bucket for the time elapsed since the last call (using the
+# Redis server clock, so every web node agrees) and takes one token if it can.
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or capacity
+local ts = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local allowed = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity / rate * 1000) + 1000)
+return allowed
+"""
+
+# Counts a firing into the trigger's open coalescing window. The caller that
+# gets 1 back opened the window and is responsible for scheduling the task.
+COALESCE_SCRIPT = """
+local count = redis.call('INCR', KEYS[1])
+if count == 1 then
+    redis.call('PEXPIRE', KEYS[1], ARGV[1])
+end
+return count
+"""
+
+
+@dataclass(frozen=True)
+class ActionPolicy:
+    """
+    The rate limit and coalescing window configured on a trigger.
+
+    Attributes:
+        rate_limit: Firings allowed per minute, or None for no limit.
+        burst: The token bucket capacity.
+        coalesce_window: Seconds over which firings are merged, or None.
+    """
+    rate_limit: int = None
+    burst: int = None
+    coalesce_window: float = None
+
+    @classmethod
+    def for_trigger(cls, trigger):
+        """
+        Returns the trigger's policy, or None if it is not throttled at all.
+        """
+        window = trigger.coalesce_window.total_seconds() if trigger.coalesce_window else None
+        if not trigger.rate_limit and not window:
+            return None
+        return cls(
+            rate_limit=trigger.rate_limit or None,
+            burst=trigger.rate_burst or trigger.rate_limit or None,
+            coalesce_window=window,
+        )
+
+
+class LocalTokenBucket:
+    """
+    An in-process token bucket per trigger, used when Redis is unavailable.
+    Limits are then enforced per process rather than across the cluster.
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def allow(self, trigger_id, rate, capacity):
+        with self._lock:
+            now = self.clock()
+            tokens, ts = self._buckets.get(trigger_id, (capacity, now))
+            tokens = min(capacity, tokens + max(0.0, now - ts) * rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[trigger_id] = (tokens, now)
+            return allowed
+
+
+class LocalCoalescer:
+    """
+    Merges firings per trigger in this process and publishes one
+    `process_agent_action` with the merged count when the window closes.
+    """
+
+    def __init__(self):
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def add(self, trigger_id, payload_version, window):
+        with self._lock:
+            count = self._counts.get(trigger_id, 0) + 1
+            self._counts[trigger_id] = count
+        if count == 1:
+            timer = threading.Timer(window, self.flush, args=(trigger_id, payload_version))
+            timer.daemon = True
+            timer.start()
+        return count
+
+    def flush(self, trigger_id, payload_version):
+        from .tasks import process_agent_action
+        with self._lock:
+            count = self._counts.pop(trigger_id, 0)
+        if count:
+            process_agent_action.delay(trigger_id, payload_version, count=count)
+        return count
+
+
+class Throttle:
+    """
+    Applies per-trigger rate limits and coalescing windows before an agent
+    action is published.
+
+    The token bucket and the coalescing counters live in Redis when
+    `AGENT_GATEWAY_THROTTLE_REDIS_URL` is set, and are updated with Lua
+    scripts so concurrent web nodes see one consistent bucket. If Redis is
+    not configured or fails, the in-process fallbacks are used.
+    """
+
+    def __init__(self, redis_client=None):
+        self.redis = redis_client
+        self.local_bucket = LocalTokenBucket()
+        self.local_coalescer = LocalCoalescer()
+        if redis_client is not None:
+            self._bucket_script = redis_client.register_script(TOKEN_BUCKET_SCRIPT)
+            self._coalesce_script = redis_client.register_script(COALESCE_SCRIPT)
+
+    def _allow(self, trigger_id, policy):
+        rate = policy.rate_limit / 60
+        capacity = policy.burst or policy.rate_limit
+        if self.redis is not None:
+            try:
+                return bool(self._bucket_script(keys=[f'{BUCKET_KEY_PREFIX}:{trigger_id}'], args=[rate, capacity]))
+            except Exception as e:
+                logger.warning(f"Redis token bucket failed for trigger {trigger_id}, using in-process bucket: {e}")
+        return self.local_bucket.allow(trigger_id, rate, capacity)
+
+    def _coalesce(self, trigger_id, payload_version, window):
+        from .tasks import process_agent_action
+        if self.redis is not None:
+            key = f'{COALESCE_KEY_PREFIX}:{trigger_id}'
+            try:
+                # Keep the counter well past the window so the delayed task
+                # can still collect it if the queue is backed up.
+                ttl_ms = int((window + 3600) * 1000)
+                count = self._coalesce_script(keys=[key], args=[ttl_ms])
+            except Exception as e:
+                logger.warning(f"Redis coalescing failed for trigger {trigger_id}, coalescing in process: {e}")
+                return self.local_coalescer.add(trigger_id, payload_version, window)
+            if count != 1:
+                return count
+            try:
+                process_agent_action.apply_async(
+                    (trigger_id, payload_version), {'coalesced': True}, countdown=window
+                )
+                return count
+            except Exception as e:
+                logger.warning(f"Could not schedule coalesced action for trigger {trigger_id}, coalescing in process: {e}")
+            # Nobody will collect the window, so close it: otherwise later
+            # firings would only count into it until it expires.
+            try:
+                self.redis.delete(key)
+            except Exception as e:
+                logger.warning(f"Could not close coalescing window for trigger {trigger_id}: {e}")
+        return self.local_coalescer.add(trigger_id, payload_version, window)
+
+    def admit(self, trigger):
+        """
+        Decides what to do with one firing of a matched trigger.
+
+        Returns:
+            `SEND` if the caller should publish the action as usual,
+            `COALESCED` if the firing was merged into a pending action (which
+            this call may have scheduled), or `LIMITED` if the trigger's rate
+            limit is exhausted.
+        """
+        policy = getattr(trigger, 'policy', None)
+        if policy is None:
+            return SEND
+        if policy.rate_limit and not self._allow(trigger.id, policy):
+            logger.info(f"Trigger {trigger.name} is rate limited")
+            return LIMITED
+        if policy.coalesce_window:
+            self._coalesce(trigger.id, trigger.payload_version, policy.coalesce_window)
+            return COALESCED
+        return SEND
+
+    def take_coalesced(self, trigger_id):
+        """
+        Atomically collects and resets the number of firings merged into a
+        trigger's coalescing window in Redis.
+        """
+        if self.redis is None:
+            return 0
+        try:
+            count = self.redis.getdel(f'{COALESCE_KEY_PREFIX}:{trigger_id}')
+        except Exception as e:
+            logger.warning(f"Could not collect coalesced firings for trigger {trigger_id}: {e}")
+            return 0
+        return int(count or 0)
+
+
+_throttle = None
+_throttle_lock = threading.Lock()
+
+
+def get_throttle():
+    """
+    Returns the process-wide `Throttle`.
+    """
+    global _throttle
+    with _throttle_lock:
+        if _throttle is None:
+            url = getattr(settings, 'AGENT_GATEWAY_THROTTLE_REDIS_URL', None)
+            client = None
+            if url:
+                import redis
+                client = redis.Redis.from_url(url, socket_timeout=1.0, socket_connect_timeout=1.0)
+            _throttle = Throttle(client)
+        return _throttle
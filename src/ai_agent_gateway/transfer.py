@@ -0,0 +1,182 @@
+import logging
+# agent_gateway/transfer.py
+import datetime
+import json
+from dataclasses import dataclass, field
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils.dateparse import parse_datetime, parse_duration
+from .matcher import bump_trigger_set_version
+from .models import AgentTrigger
+from .payloads import payload_digest
+
+logger = logging.getLogger(__name__)
+
+# The fields that define a trigger. Ids, firing state and the fields derived
+# on save are not exported; an import always creates new triggers.
+TRANSFER_FIELDS = (
+    'name', 'trigger_type', 'prompt_pattern', 'scheduled_time', 'periodic_interval', 'active',
+    'action_payload', 'example_utterances', 'similarity_threshold', 'rate_limit', 'rate_burst', 'coalesce_window',
+)
+DATETIME_FIELDS = ('scheduled_time',)
+DURATION_FIELDS = ('periodic_interval', 'coalesce_window')
+
+# Errors kept in an `ImportResult`; any further errors are only counted.
+MAX_REPORTED_ERRORS = 100
+
+
+class TriggerEncoder(DjangoJSONEncoder):
+    """
+    Like `DjangoJSONEncoder`, but keeps the microseconds of datetimes, so an
+    exported `scheduled_time` survives a round trip unchanged.
+    """
+
+    def default(self, o):
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+def export_triggers(queryset=None, chunk_size=2000):
+    """
+    Yields every trigger in `queryset` as one NDJSON line.
+
+    Triggers are read in keyset-paginated chunks of `chunk_size` rows as
+    plain values, so memory use stays constant however many triggers there
+    are. Datetimes and durations are written in ISO 8601.
+    """
+    queryset = (queryset if queryset is not None else AgentTrigger.objects.all()).order_by('id')
+    last_id = 0
+    while True:
+        rows = list(queryset.filter(id__gt=last_id).values('id', *TRANSFER_FIELDS)[:chunk_size])
+        if not rows:
+            return
+        for row in rows:
+            last_id = row.pop('id')
+            yield json.dumps(row, cls=TriggerEncoder, ensure_ascii=False) + '\n'
+
+
+def trigger_from_record(record):
+    """
+    Builds an unsaved `AgentTrigger` from an exported record, validating it the
+    way `create_trigger` and the admin do.
+
+    `bulk_create` skips `save()`, so the fields `save()` derives (`payload_hash`,
+    `pattern_risk` and `next_fire_at`) are filled in here.
+
+    Raises:
+        ValidationError: If the record does not describe a valid trigger.
+    """
+    if not isinstance(record, dict):
+        raise ValidationError('Expected a JSON object')
+    unknown = set(record) - set(TRANSFER_FIELDS)
+    if unknown:
+        raise ValidationError(f"Unknown fields: {', '.join(sorted(unknown))}")
+    values = dict(record)
+    for name in DATETIME_FIELDS:
+        if values.get(name) is not None:
+            values[name] = parse_datetime(values[name]) if isinstance(values[name], str) else None
+            if values[name] is None:
+                raise ValidationError({name: 'Expected an ISO 8601 datetime'})
+    for name in DURATION_FIELDS:
+        if values.get(name) is not None:
+            values[name] = parse_duration(values[name]) if isinstance(values[name], str) else None
+            if values[name] is None:
+                raise ValidationError({name: 'Expected an ISO 8601 duration'})
+    if values.get('action_payload') is None:
+        values['action_payload'] = {}
+    if values.get('example_utterances') is None:
+        values['example_utterances'] = []
+
+    trigger = AgentTrigger(**values)
+    trigger.full_clean()
+    trigger.payload_hash = payload_digest(trigger.action_payload)
+    trigger.pattern_risk = trigger.compute_pattern_risk()
+    trigger.next_fire_at = trigger.compute_next_fire_at()
+    return trigger
+
+
+@dataclass
+class ImportResult:
+    """
+    The outcome of `import_triggers`.
+
+    Attributes:
+        created: The number of triggers written.
+        failed: The number of lines that were rejected.
+        errors: `(line_number, message)` pairs for the first rejected lines.
+    """
+    created: int = 0
+    failed: int = 0
+    errors: list = field(default_factory=list)
+
+    def reject(self, line_number, message):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((line_number, message))
+
+    def as_dict(self):
+        return {
+            'created': self.created,
+            'failed': self.failed,
+            'errors': [{'line': line, 'error': message} for line, message in self.errors],
+        }
+
+
+def import_triggers(lines, batch_size=1000, dry_run=False):
+    """
+    Creates triggers from an NDJSON stream, one exported record per line.
+
+    Lines are read lazily, validated (including the ReDoS check on prompt
+    patterns) and written with `bulk_create`, one transaction per batch of
+    `batch_size` triggers, so memory use is bounded by the batch size and a
+    failure loses at most one batch. Invalid lines are skipped and reported.
+    The trigger set version is bumped once at the end rather than per row.
+
+    Args:
+        lines: An iterable of NDJSON lines (str or bytes), e.g. an open file
+            or a request.
+        batch_size: The number of triggers written per transaction.
+        dry_run: Validate every line without writing anything.
+
+    Returns:
+        An `ImportResult`.
+    """
+    result = ImportResult()
+    batch = []
+
+    def write():
+        if not dry_run:
+            with transaction.atomic():
+                AgentTrigger.objects.bulk_create(batch)
+        result.created += len(batch)
+        batch.clear()
+
+    try:
+        for line_number, line in enumerate(lines, start=1):
+            if isinstance(line, bytes):
+                line = line.decode('utf-8')
+            if not line.strip():
+                continue
+            try:
+                batch.append(trigger_from_record(json.loads(line)))
+            except json.JSONDecodeError as e:
+                result.reject(line_number, f'Invalid JSON: {e}')
+                continue
+            except ValidationError as e:
+                result.reject(line_number, ' '.join(e.messages))
+                continue
+            except (TypeError, ValueError) as e:
+                result.reject(line_number, str(e))
+                continue
+            if len(batch) >= batch_size:
+                write()
+        if batch:
+            write()
+    finally:
+        if result.created and not dry_run:
+            # bulk_create does not send post_save, so invalidate the matcher here.
+            bump_trigger_set_version()
+    logger.info(f"Imported {result.created} triggers ({result.failed} rejected){' [dry run]' if dry_run else ''}")
+    return result
@@ -9,6 +9,13 @@ app_name = 'ai_agent_gateway'
 
 urlpatterns = [
     path('prompt/', views.handle_prompt, name='handle_prompt'),
+    path('prompt/batch/', views.handle_prompt_batch, name='handle_prompt_batch'),
     path('triggers/', views.trigger_list, name='trigger_list'),
+    path('triggers/json/', views.trigger_list_json, name='trigger_list_json'),
+    path('triggers/import/', views.trigger_import, name='trigger_import'),
+    path('triggers/export/', views.trigger_export, name='trigger_export'),
+    path('async/prompt/', views.handle_prompt_async, name='handle_prompt_async'),
+    path('async/triggers/', views.trigger_list_async, name='trigger_list_async'),
+    path('metrics/', views.gateway_metrics, name='gateway_metrics'),
     path('triggers/create/', views.create_trigger, name='create_trigger'),
 ]
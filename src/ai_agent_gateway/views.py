@@ -1,31 +1,59 @@
 import logging
 # agent_gateway/views.py
+from django.contrib import messages
+from django.contrib.admin.views.decorators import staff_member_required
+from django.core.exceptions import ValidationError
 from django.shortcuts import render, redirect
-from django.http import JsonResponse
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.utils.crypto import constant_time_compare
 from django.views.decorators.csrf import csrf_exempt
 import json
-import re
+from urllib.parse import urlencode
+from asgiref.sync import sync_to_async
+from .matcher import PatternError, aget_prompt_matcher, get_prompt_matcher
 from .models import AgentTrigger
-from .tasks import process_agent_action
+from .metrics import amaybe_publish, collect, maybe_publish, span
+from .patterns import validate_prompt_pattern
+from .throttling import COALESCED, LIMITED, SEND, get_throttle
+from .transfer import export_triggers, import_triggers
+from django.conf import settings
+from .tasks import process_agent_action, dispatch_agent_actions
 from datetime import timedelta
 
 logger = logging.getLogger(__name__)
 
+def _max_prompt_length():
+    """
+    The longest prompt that is matched against triggers. Together with the
+    per-pattern match budget this bounds the worst-case matching time.
+    """
+    return getattr(settings, 'AGENT_GATEWAY_MAX_PROMPT_LENGTH', 4096)
+
+def _activated_response(trigger, decision):
+    if decision == LIMITED:
+        return JsonResponse({'error': f'Rate limit exceeded for trigger {trigger.name}'}, status=429)
+    response = {'message': f'Trigger {trigger.name} activated'}
+    if decision == COALESCED:
+        response['coalesced'] = True
+    return JsonResponse(response)
+
 @csrf_exempt
 def handle_prompt(request):
     """
     Handles incoming prompts and triggers the appropriate agent action.
 
     This view expects a POST request with a JSON payload containing a "prompt" key.
-    It searches for active, prompt-based triggers that match the received prompt
-    and, if a match is found, dispatches a task to process the agent action.
+    It looks the prompt up in the process-local compiled matcher of active,
+    prompt-based triggers (see `matcher.get_prompt_matcher`) and, if a match is
+    found, dispatches a task to process the agent action, subject to the
+    trigger's rate limit and coalescing window (see `throttling.Throttle`).
 
     Args:
         request: The incoming HTTP request.
 
     Returns:
         A JSON response indicating whether a trigger was activated, no triggers
-        were found, or an error occurred.
+        were found, or an error occurred. A rate-limited trigger gets a 429.
     """
     logger.info(f"handle_prompt started for user {request.user.id if request.user.is_authenticated else 'Anonymous'}")
     if request.method != 'POST':
@@ -38,23 +66,34 @@ def handle_prompt(request):
         if not prompt:
             logger.warning("handle_prompt received a request with no prompt.")
             return JsonResponse({'error': 'Prompt is required'}, status=400)
+        if len(prompt) > _max_prompt_length():
+            logger.warning("Prompt of %s characters rejected as too long.", len(prompt))
+            return JsonResponse({'error': 'Prompt is too long'}, status=400)
+
+        try:
+            with span('match') as match_span:
+                trigger = get_prompt_matcher().match(prompt)
+                if trigger is not None:
+                    match_span.trigger, match_span.name = trigger.id, trigger.name
+        except PatternError as e:
+            logger.error("Regex error for trigger %s: %s", e.trigger_name, e, exc_info=True)
+            return JsonResponse({'error': f'Regex error for trigger {e.trigger_name}'}, status=500)
 
-        triggers = AgentTrigger.objects.filter(trigger_type='prompt', active=True)
-        
-        for trigger in triggers:
+        if trigger is not None:
             try:
-                if re.match(trigger.prompt_pattern, prompt):
-                    try:
-                        process_agent_action.delay(trigger.id, trigger.action_payload)
-                        logger.info(f"Trigger {trigger.name} activated for prompt: {prompt}")
-                        return JsonResponse({'message': f'Trigger {trigger.name} activated'})
-                    except Exception as e:
-                        logger.error("Could not queue action for trigger %s: %s", trigger.name, e, exc_info=True)
-                        return JsonResponse({'error': 'Could not queue action for trigger'}, status=500)
-            except re.error as e:
-                logger.error("Regex error for trigger %s: %s", trigger.name, e, exc_info=True)
-                return JsonResponse({'error': f'Regex error for trigger {trigger.name}'}, status=500)
+                with span('enqueue', trigger.id, trigger.name):
+                    decision = get_throttle().admit(trigger)
+                    if decision == SEND:
+                        process_agent_action.delay(trigger.id, trigger.payload_version)
+                maybe_publish()
+                if decision != LIMITED:
+                    logger.info(f"Trigger {trigger.name} activated for prompt: {prompt}")
+                return _activated_response(trigger, decision)
+            except Exception as e:
+                logger.error("Could not queue action for trigger %s: %s", trigger.name, e, exc_info=True)
+                return JsonResponse({'error': 'Could not queue action for trigger'}, status=500)
 
+        maybe_publish()
         logger.info("No matching triggers found for prompt: %s", prompt)
         return JsonResponse({'message': 'No matching triggers found'})
 
@@ -66,33 +105,462 @@ def handle_prompt(request):
         return JsonResponse({'error': 'An unexpected error occurred'}, status=500)
 
 
+@csrf_exempt
+async def handle_prompt_async(request):
+    """
+    Async counterpart of `handle_prompt` for deployments served under ASGI.
+
+    Matching uses the same compiled trigger index, rebuilt with the async ORM
+    when triggers change. Celery has no asyncio client, so the broker publish
+    runs in a worker thread instead of blocking the event loop; a single
+    process can therefore hold many concurrent prompt requests.
+
+    Args:
+        request: The incoming HTTP request.
+
+    Returns:
+        The same JSON responses as `handle_prompt`.
+    """
+    user = await request.auser()
+    logger.info(f"handle_prompt_async started for user {user.id if user.is_authenticated else 'Anonymous'}")
+    if request.method != 'POST':
+        logger.warning("handle_prompt_async received a non-POST request.")
+        return JsonResponse({'error': 'Method not allowed'}, status=405)
+
+    try:
+        data = json.loads(request.body)
+        prompt = data.get('prompt')
+        if not prompt:
+            logger.warning("handle_prompt_async received a request with no prompt.")
+            return JsonResponse({'error': 'Prompt is required'}, status=400)
+        if len(prompt) > _max_prompt_length():
+            logger.warning("Prompt of %s characters rejected as too long.", len(prompt))
+            return JsonResponse({'error': 'Prompt is too long'}, status=400)
+
+        try:
+            matcher = await aget_prompt_matcher()
+            with span('match') as match_span:
+                trigger = matcher.match(prompt, shared=False)
+                if trigger is not None:
+                    match_span.trigger, match_span.name = trigger.id, trigger.name
+        except PatternError as e:
+            logger.error("Regex error for trigger %s: %s", e.trigger_name, e, exc_info=True)
+            return JsonResponse({'error': f'Regex error for trigger {e.trigger_name}'}, status=500)
+
+        if trigger is not None:
+            try:
+                with span('enqueue', trigger.id, trigger.name):
+                    decision = SEND
+                    if trigger.policy is not None:
+                        decision = await sync_to_async(get_throttle().admit, thread_sensitive=False)(trigger)
+                    if decision == SEND:
+                        await sync_to_async(process_agent_action.delay, thread_sensitive=False)(trigger.id, trigger.payload_version)
+                await amaybe_publish()
+                if decision != LIMITED:
+                    logger.info(f"Trigger {trigger.name} activated for prompt: {prompt}")
+                return _activated_response(trigger, decision)
+            except Exception as e:
+                logger.error("Could not queue action for trigger %s: %s", trigger.name, e, exc_info=True)
+                return JsonResponse({'error': 'Could not queue action for trigger'}, status=500)
+
+        await amaybe_publish()
+        logger.info("No matching triggers found for prompt: %s", prompt)
+        return JsonResponse({'message': 'No matching triggers found'})
+
+    except json.JSONDecodeError as e:
+        logger.warning("Invalid JSON received in handle_prompt_async: %s", e)
+        return JsonResponse({'error': 'Invalid JSON'}, status=400)
+    except Exception as e:
+        logger.error("An unexpected error occurred in handle_prompt_async: %s", e, exc_info=True)
+        return JsonResponse({'error': 'An unexpected error occurred'}, status=500)
+
+
+NDJSON_CONTENT_TYPES = ('application/x-ndjson', 'application/ndjson', 'application/jsonl')
+
+
+def _read_prompt_batch(request, max_size):
+    """
+    Reads the prompts of a batch request.
+
+    Accepts either a JSON array (or an object with a "prompts" array) or, for
+    NDJSON content types, one JSON value per line. Each item may be a prompt
+    string or an object with a "prompt" key. NDJSON bodies are read line by
+    line and reading stops once the batch is known to be too large.
+
+    Returns:
+        A list of prompts (None for items without a usable prompt).
+
+    Raises:
+        json.JSONDecodeError: If the body or a line is not valid JSON.
+        ValueError: If the body is not a list of prompts or exceeds `max_size`.
+    """
+    if request.content_type in NDJSON_CONTENT_TYPES:
+        items = []
+        for line in request:
+            if not line.strip():
+                continue
+            items.append(json.loads(line))
+            if len(items) > max_size:
+                break
+    else:
+        items = json.loads(request.body)
+        if isinstance(items, dict):
+            items = items.get('prompts')
+        if not isinstance(items, list):
+            raise ValueError('Expected a list of prompts')
+    if len(items) > max_size:
+        raise ValueError(f'Batch exceeds the maximum of {max_size} prompts')
+
+    prompts = []
+    for item in items:
+        if isinstance(item, dict):
+            item = item.get('prompt')
+        prompts.append(item if isinstance(item, str) and item else None)
+    return prompts
+
+
+@csrf_exempt
+def handle_prompt_batch(request):
+    """
+    Handles a batch of incoming prompts in a single request.
+
+    Every prompt is matched against the same compiled trigger index, and the
+    resulting agent actions are published together as chunked Celery groups
+    (see `tasks.dispatch_agent_actions`) instead of one broker call per prompt.
+    Rate limits and coalescing windows apply to each prompt as in `handle_prompt`.
+
+    Args:
+        request: The incoming HTTP request. The body is a JSON array of prompts
+            or an NDJSON stream with one prompt per line.
+
+    Returns:
+        A JSON response with one result per prompt, in request order, or an
+        error if the batch could not be read or queued.
+    """
+    logger.info(f"handle_prompt_batch started for user {request.user.id if request.user.is_authenticated else 'Anonymous'}")
+    if request.method != 'POST':
+        logger.warning("handle_prompt_batch received a non-POST request.")
+        return JsonResponse({'error': 'Method not allowed'}, status=405)
+
+    max_size = getattr(settings, 'AGENT_GATEWAY_MAX_BATCH_SIZE', 1000)
+    try:
+        prompts = _read_prompt_batch(request, max_size)
+    except json.JSONDecodeError as e:
+        logger.warning("Invalid JSON received in handle_prompt_batch: %s", e)
+        return JsonResponse({'error': 'Invalid JSON'}, status=400)
+    except ValueError as e:
+        logger.warning("Invalid batch received in handle_prompt_batch: %s", e)
+        return JsonResponse({'error': str(e)}, status=400)
+
+    try:
+        matcher = get_prompt_matcher()
+        throttle = get_throttle()
+        max_length = _max_prompt_length()
+        results = []
+        calls = []
+        matched = {}
+        for index, prompt in enumerate(prompts):
+            if prompt is None:
+                results.append({'index': index, 'status': 'error', 'error': 'Prompt is required'})
+                continue
+            if len(prompt) > max_length:
+                results.append({'index': index, 'status': 'error', 'error': 'Prompt is too long'})
+                continue
+            if prompt not in matched:
+                try:
+                    matched[prompt] = matcher.match(prompt)
+                except PatternError as e:
+                    logger.error("Regex error for trigger %s: %s", e.trigger_name, e)
+                    matched[prompt] = e
+            trigger = matched[prompt]
+            if isinstance(trigger, PatternError):
+                results.append({'index': index, 'status': 'error', 'error': f'Regex error for trigger {trigger.trigger_name}'})
+            elif trigger is None:
+                results.append({'index': index, 'status': 'no_match'})
+            else:
+                decision = throttle.admit(trigger)
+                if decision == LIMITED:
+                    results.append({'index': index, 'status': 'rate_limited', 'trigger': trigger.name, 'trigger_id': trigger.id})
+                    continue
+                result = {'index': index, 'status': 'activated', 'trigger': trigger.name, 'trigger_id': trigger.id}
+                if decision == COALESCED:
+                    result['coalesced'] = True
+                else:
+                    calls.append((trigger.id, trigger.payload_version))
+                results.append(result)
+
+        try:
+            dispatch_agent_actions(calls)
+        except Exception as e:
+            logger.error("Could not queue %s actions for prompt batch: %s", len(calls), e, exc_info=True)
+            return JsonResponse({'error': 'Could not queue actions for triggers'}, status=500)
+
+        logger.info("Prompt batch of %s activated %s triggers", len(prompts), len(calls))
+        return JsonResponse({'results': results, 'activated': len(calls)})
+    except Exception as e:
+        logger.error("An unexpected error occurred in handle_prompt_batch: %s", e, exc_info=True)
+        return JsonResponse({'error': 'An unexpected error occurred'}, status=500)
+
+
+# The columns the trigger list shows. Everything else, in particular the
+# potentially large `action_payload` and `example_utterances` JSON, is
+# deferred.
+TRIGGER_LIST_FIELDS = (
+    'id', 'name', 'trigger_type', 'prompt_pattern', 'scheduled_time', 'periodic_interval',
+    'last_triggered', 'active', 'payload_version', 'next_fire_at', 'pattern_risk', 'quarantined_at',
+)
+MAX_TRIGGER_PAGE_SIZE = 1000
+
+
+def _filter_triggers(queryset, params):
+    """
+    Applies the `trigger_type` and `active` query parameters to `queryset`.
+    """
+    if params.get('trigger_type'):
+        queryset = queryset.filter(trigger_type=params['trigger_type'])
+    if params.get('active'):
+        queryset = queryset.filter(active=params['active'].lower() in ('1', 'true', 'on', 'yes'))
+    return queryset
+
+
+def _trigger_page_query(params):
+    """
+    Builds the query for one page of the trigger list.
+
+    Pages are keyset-paginated on `id`: `after` returns the page following
+    that trigger id and `before` the page preceding it, so every page costs
+    an index range scan no matter how deep it is. `trigger_type` and `active`
+    filter on the `(trigger_type, active)` index.
+
+    Returns:
+        A `(queryset, limit, backwards)` tuple. The queryset is sliced to
+        `limit + 1` rows so the caller can tell whether another page follows.
+
+    Raises:
+        ValueError: If a cursor or the limit is not a positive integer.
+    """
+    limit = int(params.get('limit') or getattr(settings, 'AGENT_GATEWAY_TRIGGER_PAGE_SIZE', 100))
+    if limit < 1:
+        raise ValueError('limit must be positive')
+    limit = min(limit, MAX_TRIGGER_PAGE_SIZE)
+    queryset = _filter_triggers(AgentTrigger.objects.only(*TRIGGER_LIST_FIELDS), params)
+    backwards = bool(params.get('before'))
+    if backwards:
+        queryset = queryset.filter(id__lt=int(params['before'])).order_by('-id')
+    else:
+        if params.get('after'):
+            queryset = queryset.filter(id__gt=int(params['after']))
+        queryset = queryset.order_by('id')
+    return queryset[:limit + 1], limit, backwards
+
+
+def _trigger_page(rows, limit, backwards, params):
+    """
+    Trims a page fetched by `_trigger_page_query` and works out the cursors of
+    the neighbouring pages (None where there is no such page).
+    """
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if backwards:
+        rows.reverse()
+    next_cursor = previous_cursor = None
+    if rows:
+        if has_more or backwards:
+            next_cursor = rows[-1].id
+        if (has_more and backwards) or (not backwards and params.get('after')):
+            previous_cursor = rows[0].id
+    filters = {key: params[key] for key in ('trigger_type', 'active', 'limit') if params.get(key)}
+    return {'triggers': rows, 'next_cursor': next_cursor, 'previous_cursor': previous_cursor, 'filters': urlencode(filters)}
+
+
+def _trigger_as_dict(trigger):
+    return {field: getattr(trigger, field) for field in TRIGGER_LIST_FIELDS}
+
+
 @csrf_exempt
 def trigger_list(request):
     """
-    Displays a list of all configured agent triggers.
+    Displays one page of the configured agent triggers.
+
+    Accepts the `after`, `before`, `limit`, `trigger_type` and `active` query
+    parameters described in `_trigger_page_query`.
 
     Args:
         request: The incoming HTTP request.
 
     Returns:
-        A rendered HTML page displaying the list of triggers.
+        A rendered HTML page displaying the page of triggers.
     """
     logger.info(f"trigger_list started for user {request.user.id if request.user.is_authenticated else 'Anonymous'}")
     try:
-        triggers = AgentTrigger.objects.all()
-        return render(request, 'agent_gateway/trigger_list.html', {'triggers': triggers})
+        queryset, limit, backwards = _trigger_page_query(request.GET)
+    except ValueError as e:
+        logger.warning("Invalid trigger_list parameters: %s", e)
+        return render(request, 'agent_gateway/trigger_list.html', {'error': 'Invalid page parameters.'}, status=400)
+    try:
+        page = _trigger_page(list(queryset), limit, backwards, request.GET)
+        return render(request, 'agent_gateway/trigger_list.html', page)
     except Exception as e:
         logger.error("An error occurred in trigger_list: %s", e, exc_info=True)
         return render(request, 'agent_gateway/trigger_list.html', {'error': 'An unexpected error occurred.'})
 
 
+@csrf_exempt
+def trigger_list_json(request):
+    """
+    JSON variant of `trigger_list` for tooling.
+
+    Args:
+        request: The incoming HTTP request.
+
+    Returns:
+        A JSON response with the page of triggers and the `next_cursor` and
+        `previous_cursor` to pass as `after` and `before` for the
+        neighbouring pages.
+    """
+    logger.info(f"trigger_list_json started for user {request.user.id if request.user.is_authenticated else 'Anonymous'}")
+    try:
+        queryset, limit, backwards = _trigger_page_query(request.GET)
+    except ValueError as e:
+        logger.warning("Invalid trigger_list_json parameters: %s", e)
+        return JsonResponse({'error': 'Invalid page parameters'}, status=400)
+    try:
+        page = _trigger_page(list(queryset), limit, backwards, request.GET)
+        return JsonResponse({
+            'triggers': [_trigger_as_dict(trigger) for trigger in page['triggers']],
+            'next_cursor': page['next_cursor'],
+            'previous_cursor': page['previous_cursor'],
+        })
+    except Exception as e:
+        logger.error("An error occurred in trigger_list_json: %s", e, exc_info=True)
+        return JsonResponse({'error': 'An unexpected error occurred'}, status=500)
+
+
+@csrf_exempt
+async def trigger_list_async(request):
+    """
+    Async counterpart of `trigger_list`.
+
+    The triggers are fetched with the async ORM; only the template rendering,
+    which may touch the session and user, runs in a thread.
+
+    Args:
+        request: The incoming HTTP request.
+
+    Returns:
+        A rendered HTML page displaying the page of triggers.
+    """
+    user = await request.auser()
+    logger.info(f"trigger_list_async started for user {user.id if user.is_authenticated else 'Anonymous'}")
+    try:
+        queryset, limit, backwards = _trigger_page_query(request.GET)
+    except ValueError as e:
+        logger.warning("Invalid trigger_list_async parameters: %s", e)
+        return await sync_to_async(render)(request, 'agent_gateway/trigger_list.html', {'error': 'Invalid page parameters.'}, status=400)
+    try:
+        rows = [trigger async for trigger in queryset]
+        page = _trigger_page(rows, limit, backwards, request.GET)
+        return await sync_to_async(render)(request, 'agent_gateway/trigger_list.html', page)
+    except Exception as e:
+        logger.error("An error occurred in trigger_list_async: %s", e, exc_info=True)
+        return await sync_to_async(render)(request, 'agent_gateway/trigger_list.html', {'error': 'An unexpected error occurred.'})
+
+
+@staff_member_required(login_url=settings.LOGIN_URL)
+def trigger_import(request):
+    """
+    Creates triggers in bulk from an NDJSON request body, one trigger
+    definition per line in the format written by `trigger_export`.
+
+    Staff are authenticated by their session, so the request must carry a
+    CSRF token in the `X-CSRFToken` header.
+
+    The body is read line by line and written in batched transactions (see
+    `transfer.import_triggers`). Pass `?dry_run=1` to only validate.
+
+    Args:
+        request: The incoming HTTP request.
+
+    Returns:
+        A JSON response with the number of triggers created and the lines
+        that were rejected.
+    """
+    logger.info(f"trigger_import started for user {request.user.id}")
+    if request.method != 'POST':
+        logger.warning("trigger_import received a non-POST request.")
+        return JsonResponse({'error': 'Method not allowed'}, status=405)
+    try:
+        result = import_triggers(
+            request,
+            batch_size=getattr(settings, 'AGENT_GATEWAY_IMPORT_BATCH_SIZE', 1000),
+            dry_run=request.GET.get('dry_run') in ('1', 'true'),
+        )
+    except Exception as e:
+        logger.error("An unexpected error occurred in trigger_import: %s", e, exc_info=True)
+        return JsonResponse({'error': 'An unexpected error occurred'}, status=500)
+    return JsonResponse(result.as_dict(), status=400 if result.failed and not result.created else 200)
+
+
+@staff_member_required(login_url=settings.LOGIN_URL)
+def trigger_export(request):
+    """
+    Streams every trigger definition as NDJSON, optionally filtered by
+    `trigger_type` and `active`. Memory use does not grow with the number of
+    triggers (see `transfer.export_triggers`).
+
+    Args:
+        request: The incoming HTTP request.
+
+    Returns:
+        A streaming NDJSON response.
+    """
+    logger.info(f"trigger_export started for user {request.user.id}")
+    queryset = _filter_triggers(AgentTrigger.objects.all(), request.GET)
+    response = StreamingHttpResponse(export_triggers(queryset), content_type='application/x-ndjson')
+    response['Content-Disposition'] = 'attachment; filename="agent_triggers.ndjson"'
+    return response
+
+
+def _metrics_authorized(request):
+    """
+    Scrapers authenticate with `Authorization: Bearer <AGENT_GATEWAY_METRICS_TOKEN>`;
+    without a configured token, only staff users may read the metrics.
+    """
+    token = getattr(settings, 'AGENT_GATEWAY_METRICS_TOKEN', None)
+    if token and constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return True
+    return request.user.is_authenticated and request.user.is_staff
+
+
+def gateway_metrics(request):
+    """
+    Exposes the per-stage, per-trigger timing histograms and the gateway
+    counters of every process that published them recently.
+
+    Args:
+        request: The incoming HTTP request. `?format=json` returns p50/p95/p99
+            summaries instead of the Prometheus text format.
+
+    Returns:
+        The metrics, or a 403 JSON response.
+    """
+    if not _metrics_authorized(request):
+        return JsonResponse({'error': 'Forbidden'}, status=403)
+    maybe_publish()
+    merged = collect()
+    if request.GET.get('format') == 'json':
+        return JsonResponse({'stages': merged.summary(), 'counters': merged.counters})
+    return HttpResponse(merged.prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
 @csrf_exempt
 def create_trigger(request):
     """
     Handles the creation of a new agent trigger.
 
     This view processes a POST request containing the trigger's configuration
-    data and creates a new `AgentTrigger` instance.
+    data and creates a new `AgentTrigger` instance. Prompt patterns that do
+    not compile or are prone to catastrophic backtracking are rejected.
 
     Args:
         request: The incoming HTTP request.
@@ -108,6 +576,8 @@ def create_trigger(request):
         scheduled_time = request.POST.get('scheduled_time')
         periodic_interval = request.POST.get('periodic_interval')
         action_payload = request.POST.get('action_payload')
+        example_utterances = [line.strip() for line in request.POST.get('example_utterances', '').splitlines() if line.strip()]
+        similarity_threshold = request.POST.get('similarity_threshold')
         active = request.POST.get('active') == 'on'
 
         try:
@@ -126,6 +596,24 @@ def create_trigger(request):
             logger.warning("Invalid periodic_interval format in create_trigger: %s", e)
             periodic_interval_delta=None
 
+        try:
+            similarity_threshold = float(similarity_threshold) if similarity_threshold else None
+        except ValueError as e:
+            logger.warning("Invalid similarity_threshold in create_trigger: %s", e)
+            similarity_threshold = None
+
+        try:
+            validate_prompt_pattern(prompt_pattern)
+            AgentTrigger(
+                trigger_type=trigger_type,
+                example_utterances=example_utterances,
+                similarity_threshold=similarity_threshold,
+            ).clean()
+        except ValidationError as e:
+            logger.warning("Rejected trigger '%s': %s", name, e.messages)
+            messages.error(request, ' '.join(e.messages))
+            return redirect('agent_gateway:trigger_list')
+
         try:
             AgentTrigger.objects.create(
                 name=name,
@@ -134,6 +622,8 @@ def create_trigger(request):
                 scheduled_time=scheduled_time,
                 periodic_interval=periodic_interval_delta,
                 action_payload=action_payload_json,
+                example_utterances=example_utterances,
+                similarity_threshold=similarity_threshold,
                 active=active
             )
             logger.info(f"Trigger '{name}' created successfully.")
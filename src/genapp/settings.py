@@ -232,6 +232,42 @@ CELERY_ACCEPT_CONTENT = ['application/json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = 'UTC' # Or your timezone
+# Honour task priorities on the Redis broker (0 is served first). The agent
+# gateway routes its tasks to dedicated queues, see ai_agent_gateway.routing.
+CELERY_BROKER_TRANSPORT_OPTIONS = {
+    'queue_order_strategy': 'priority',
+    'priority_steps': list(range(10)),
+    'sep': ':',
+}
+CELERY_TASK_DEFAULT_PRIORITY = 5
+# A cache shared by every web and worker process. The agent gateway merges
+# per-process metrics through it and uses it as the second tier of the prompt
+# match cache. Without REDIS_CACHE_URL those stay per process, and
+# `manage.py check` says so.
+REDIS_CACHE_URL = config("REDIS_CACHE_URL", default=None)
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+}
+if REDIS_CACHE_URL:
+    CACHES['shared'] = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': REDIS_CACHE_URL,
+    }
+AGENT_GATEWAY_SHARED_CACHE_ALIAS = 'shared' if REDIS_CACHE_URL else None
+AGENT_GATEWAY_MATCH_CACHE_ALIAS = AGENT_GATEWAY_SHARED_CACHE_ALIAS
+AGENT_GATEWAY_SCAN_QUEUE = config("AGENT_GATEWAY_SCAN_QUEUE", default="agent_scans")
+AGENT_GATEWAY_ACTION_QUEUE = config("AGENT_GATEWAY_ACTION_QUEUE", default="agent_actions")
+
+# Outbound agent API used by ai_agent_gateway.tasks.process_agent_action.
+# Agent calls are skipped while AGENT_API_URL is unset.
+AGENT_API_URL = config("AGENT_API_URL", default=None)
+AGENT_API_TIMEOUT = config("AGENT_API_TIMEOUT", cast=float, default=10.0)
+AGENT_API_MAX_CONCURRENCY = config("AGENT_API_MAX_CONCURRENCY", cast=int, default=10)
+AGENT_API_MAX_RETRIES = config("AGENT_API_MAX_RETRIES", cast=int, default=3)
+AGENT_API_CIRCUIT_FAILURES = config("AGENT_API_CIRCUIT_FAILURES", cast=int, default=5)
+AGENT_API_CIRCUIT_RESET = config("AGENT_API_CIRCUIT_RESET", cast=float, default=30.0)
 
 # src/genapp/settings.py
 # ... (imports and other settings)
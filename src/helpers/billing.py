@@ -7,6 +7,9 @@ managing subscriptions and checkout sessions.
 """
 # Set your secret key. Remember to switch to your live secret key in production.
 # See your keys here: https://dashboard.stripe.com/apikeys
+import random
+import threading
+import time
 import stripe
 from decouple import config
 from . import date_utils
@@ -16,6 +19,10 @@ logger = logging.getLogger(__name__)
 DJANGO_DEBUG=config("DJANGO_DEBUG", default=False, cast=bool)
 STRIPE_SECRET_KEY=config("STRIPE_SECRET_KEY", default="", cast=str)
 STRIPE_TEST_OVERRIDE=config("STRIPE_TEST_OVERRIDE", default=False, cast=bool)
+# Stripe allows 100 read requests per second in live mode and 25 in test mode.
+STRIPE_READ_RATE_LIMIT=config("STRIPE_READ_RATE_LIMIT", default=25, cast=float)
+STRIPE_RATE_LIMIT_RETRIES=config("STRIPE_RATE_LIMIT_RETRIES", default=5, cast=int)
+STRIPE_WEBHOOK_SECRET=config("STRIPE_WEBHOOK_SECRET", default="", cast=str)
 
 #if "sk_test" in STRIPE_SECRET_KEY and not DJANGO_DEBUG and not STRIPE_TEST_OVERRIDE:
 #    raise ValueError("Invalid stripe key in Production")
@@ -23,6 +30,59 @@ STRIPE_TEST_OVERRIDE=config("STRIPE_TEST_OVERRIDE", default=False, cast=bool)
 stripe.api_key = STRIPE_SECRET_KEY
 logger.info("Stripe API key set.")
 
+class RateLimiter:
+    """
+    Spaces out calls so that at most `rate` start per second, across all the
+    threads sharing the limiter.
+
+    Args:
+        rate (float): Calls per second. 0 disables the limit.
+    """
+
+    def __init__(self, rate=STRIPE_READ_RATE_LIMIT, clock=time.monotonic, sleep=time.sleep):
+        self.interval = 1.0 / rate if rate else 0.0
+        self.clock = clock
+        self.sleep = sleep
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        """
+        Blocks until the caller may make its call.
+        """
+        with self._lock:
+            now = self.clock()
+            slot = max(now, self._next)
+            self._next = slot + self.interval
+        if slot > now:
+            self.sleep(slot - now)
+
+def call_with_backoff(func, *args, limiter=None, retries=STRIPE_RATE_LIMIT_RETRIES, base_delay=1.0, **kwargs):
+    """
+    Calls a Stripe API function, waiting on `limiter` first and retrying with
+    jittered exponential backoff when Stripe answers with a rate limit error.
+
+    Args:
+        func: The function to call with `args` and `kwargs`.
+        limiter (RateLimiter): The limiter shared by concurrent callers.
+        retries (int): How many times a rate-limited call is retried.
+        base_delay (float): The delay before the first retry, in seconds.
+
+    Returns:
+        Whatever `func` returns.
+    """
+    for attempt in range(retries + 1):
+        if limiter is not None:
+            limiter.wait()
+        try:
+            return func(*args, **kwargs)
+        except stripe.RateLimitError:
+            if attempt == retries:
+                raise
+            delay = base_delay * 2 ** attempt * random.uniform(0.5, 1.0)
+            logger.warning(f"Stripe rate limit hit, retrying in {delay:.2f}s")
+            time.sleep(delay)
+
 def serialize_subscription_data(subscription_response):
     """
     Serializes a Stripe subscription object into a dictionary.
@@ -233,6 +293,41 @@ def get_subscription(stripe_id, raw=True):
         return response
     return serialize_subscription_data(response) 
 
+def list_subscriptions(status="all", created_after=None, page_size=100, limiter=None, raw=False):
+    """
+    Lists subscriptions from Stripe page by page, instead of one retrieve
+    call per subscription.
+
+    Args:
+        status (str): Only list subscriptions with this status; "all"
+            includes canceled ones.
+        created_after (datetime or int): Only list subscriptions created
+            after this time (a datetime or a Unix timestamp).
+        page_size (int): Subscriptions per request; Stripe allows up to 100.
+        limiter (RateLimiter): Spaces out the page requests.
+        raw (bool): If True, yields the Stripe subscription objects as the data.
+
+    Yields:
+        `(stripe_id, data)` pairs, where `data` is serialized with
+        `serialize_subscription_data` unless `raw` is True.
+    """
+    params = {"limit": page_size, "status": status}
+    if created_after is not None:
+        if hasattr(created_after, "timestamp"):
+            created_after = created_after.timestamp()
+        params["created"] = {"gt": int(created_after)}
+    pages = count = 0
+    while True:
+        page = call_with_backoff(stripe.Subscription.list, limiter=limiter, **params)
+        pages += 1
+        for sub in page.data:
+            count += 1
+            yield sub.id, sub if raw else serialize_subscription_data(sub)
+        if not page.has_more or not page.data:
+            break
+        params["starting_after"] = page.data[-1].id
+    logger.info(f"Listed {count} Stripe subscriptions in {pages} pages")
+
 def get_customer_active_subscriptions(customer_stripe_id):
     """
     Retrieves all active subscriptions for a customer.
@@ -289,6 +384,31 @@ def cancel_subscription(stripe_id, reason = "", cancel_at_period_end = False,
         return response
     return serialize_subscription_data(response) 
 
+def construct_webhook_event(payload, sig_header, secret=None):
+    """
+    Verifies a webhook request's `Stripe-Signature` header and parses the event.
+
+    Args:
+        payload (bytes): The raw request body.
+        sig_header (str): The `Stripe-Signature` header.
+        secret (str): The endpoint's signing secret. Defaults to
+            `STRIPE_WEBHOOK_SECRET`.
+
+    Returns:
+        The Stripe event.
+
+    Raises:
+        ValueError: If no signing secret is configured or the payload is not
+            valid JSON.
+        stripe.SignatureVerificationError: If the signature does not match
+            or is too old.
+    """
+    secret = secret or STRIPE_WEBHOOK_SECRET
+    if not secret:
+        # An empty key would verify signatures anyone can compute.
+        raise ValueError("STRIPE_WEBHOOK_SECRET is not set")
+    return stripe.Webhook.construct_event(payload, sig_header, secret)
+
 def get_checkout_customer_plan(session_id):
     """
     Retrieves customer and plan information from a checkout session.
@@ -141,6 +141,38 @@ class BillingTests(unittest.TestCase):
         )
 
 
+    def test_rate_limiter_spaces_calls(self):
+        """
+        Test that the rate limiter starts at most `rate` calls per second.
+        """
+        now = [0.0]
+        sleeps = []
+
+        def sleep(seconds):
+            sleeps.append(seconds)
+            now[0] += seconds
+
+        limiter = billing.RateLimiter(rate=4, clock=lambda: now[0], sleep=sleep)
+        for _ in range(5):
+            limiter.wait()
+        self.assertEqual(sleeps, [0.25, 0.25, 0.25, 0.25])
+
+    @patch("helpers.billing.time.sleep")
+    def test_call_with_backoff_retries_rate_limits(self, mock_sleep):
+        """
+        Test that rate-limited Stripe calls are retried with growing delays.
+        """
+        func = MagicMock(side_effect=[billing.stripe.RateLimitError("slow down"), "ok"])
+        self.assertEqual(billing.call_with_backoff(func, "sub_1", raw=False), "ok")
+        func.assert_called_with("sub_1", raw=False)
+        mock_sleep.assert_called_once()
+
+        func = MagicMock(side_effect=billing.stripe.RateLimitError("slow down"))
+        with self.assertRaises(billing.stripe.RateLimitError):
+            billing.call_with_backoff(func, retries=2)
+        self.assertEqual(func.call_count, 3)
+
+
 class DateUtilsTests(unittest.TestCase):
     """
     Test cases for the date_utils helper functions.
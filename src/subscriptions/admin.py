@@ -7,7 +7,7 @@ models with the Django admin site.
 from django.contrib import admin
 
 # Register your models here.
-from .models import Subscription, SubscriptionPrice, UserSubscription
+from .models import StripeEvent, Subscription, SubscriptionPrice, UserSubscription
 
 logger = logging.getLogger(__name__)
 
@@ -31,4 +31,20 @@ class SubscriptionAdmin(admin.ModelAdmin):
 admin.site.register(Subscription, SubscriptionAdmin) 
 admin.site.register(UserSubscription)
 
+class StripeEventAdmin(admin.ModelAdmin):
+    """
+    A read-only admin for received Stripe webhook events.
+    """
+    list_display = ['event_id', 'type', 'object_id', 'created', 'processed_at']
+    list_filter = ['type', ('processed_at', admin.EmptyFieldListFilter)]
+    search_fields = ['event_id', 'object_id']
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+admin.site.register(StripeEvent, StripeEventAdmin)
+
 logger.info("Subscription models registered with admin.")
\ No newline at end of file
@@ -19,5 +19,27 @@ class SubscriptionsConfig(AppConfig):
     def ready(self):
         """
         Logs a message when the subscriptions app is ready.
+
+        If Celery is installed, this also schedules
+        `process_pending_stripe_events` every five minutes, so webhook events
+        whose task was never queued or ran out of retries are retried.
         """
         logger.info("Subscriptions app ready.")
+        try:
+            from celery import current_app as celery_app
+            from celery.schedules import crontab
+        except ImportError:
+            logger.warning("Celery is not installed, pending Stripe events will not be retried.")
+            return
+
+        from . import tasks
+
+        celery_app.conf.beat_schedule = {
+            **(celery_app.conf.beat_schedule or {}),
+            'process-pending-stripe-events': {
+                'task': 'subscriptions.tasks.process_pending_stripe_events',
+                'schedule': crontab(minute='*/5'),
+                # A sweep that has waited past the next one is redundant.
+                'options': {'expires': 295},
+            },
+        }
@@ -1,4 +1,7 @@
 import helpers.billing
+import json
+from dataclasses import asdict
+from pathlib import Path
 from typing import Any
 from django.core.management.base import BaseCommand
 
@@ -12,6 +15,21 @@ class Command(BaseCommand):
         parser.add_argument("--days-left", default=0, type=int)
         parser.add_argument("--days-ago", default=0, type=int)
         parser.add_argument("--clear-dangling", action="store_true", default=False)
+        parser.add_argument("--dry-run", action="store_true", default=False,
+                            help="With --clear-dangling, only report the dangling subscriptions")
+        parser.add_argument("--chunk-size", default=500, type=int)
+        parser.add_argument("--workers", default=subs_utils.REFRESH_WORKERS, type=int)
+        parser.add_argument("--checkpoint", default=None,
+                            help="File recording progress after every chunk")
+        parser.add_argument("--resume", action="store_true", default=False,
+                            help="Continue after the subscription recorded in --checkpoint, "
+                                 "retrying the ones that failed")
+        parser.add_argument("--snapshot", action="store_true", default=False,
+                            help="Sync every subscription from a paged Stripe listing")
+        parser.add_argument("--status", default="all",
+                            help="With --snapshot, only list Stripe subscriptions with this status")
+        parser.add_argument("--created-after", default=None, type=int,
+                            help="With --snapshot, only list Stripe subscriptions created after this Unix timestamp")
 
     def handle(self, *args: Any, **options: Any):
         # python manage.py sync_user_subs --clear-dangling
@@ -22,18 +40,46 @@ class Command(BaseCommand):
         day_end = options.get("day_end")
         if clear_dangling:
             print("Clearing dangling not in use active subs in stripe")
-            subs_utils.clear_dangling_subs()
+            subs_utils.clear_dangling_subs(dry_run=options["dry_run"], max_workers=options["workers"])
+        elif options.get("snapshot"):
+            print("Sync subs from a Stripe snapshot")
+            result = subs_utils.snapshot_sync_subscriptions(
+                status=options["status"],
+                created_after=options.get("created_after"),
+                chunk_size=options["chunk_size"],
+                verbose=True)
+            print(f"Done: {result.matched} matched, {result.changed} changed, "
+                  f"{result.unlisted} not in Stripe listing, {len(result.unknown)} unknown to the database")
         else:
             print("Sync active subs")
+            checkpoint = Path(options["checkpoint"]) if options.get("checkpoint") else None
+            after_pk = None
+            retry_pks = None
+            if options.get("resume") and checkpoint is not None and checkpoint.exists():
+                saved = json.loads(checkpoint.read_text())
+                after_pk = saved["last_pk"]
+                retry_pks = saved.get("failed_pks", [])
+                print(f"Resuming after subscription {after_pk}, retrying {len(retry_pks)} failed")
+
+            def save_checkpoint(progress):
+                checkpoint.write_text(json.dumps(asdict(progress)))
+
             done = subs_utils.refresh_active_users_subscriptions(
                 active_only=True,
                 days_left=days_left,
                 days_ago=days_ago,
                 day_start=day_start,
                 day_end=day_end,
-                verbose=True)
+                verbose=True,
+                chunk_size=options["chunk_size"],
+                max_workers=options["workers"],
+                after_pk=after_pk,
+                retry_pks=retry_pks,
+                on_checkpoint=save_checkpoint if checkpoint is not None else None)
             if done:
+                if checkpoint is not None:
+                    checkpoint.unlink(missing_ok=True)
                 print("Done")
 
-        
-        
+
+
@@ -232,9 +232,9 @@ class UserSubscriptionQuerySet(models.QuerySet):
         if isinstance(user_ids,list):
             qs = self.filter(user_id__in=user_ids)
         elif isinstance(user_ids, int):
-            qs = self.filter(user_ids__in=[user_ids])
+            qs = self.filter(user_id__in=[user_ids])
         elif isinstance(user_ids, str):
-            qs = self.filter(user_ids__in=[user_ids])
+            qs = self.filter(user_id__in=[user_ids])
         return qs    
 
 class UserSubscriptionManager(models.Manager):
@@ -272,9 +272,18 @@ class UserSubscription(models.Model):
     updated = models.DateTimeField(auto_now=True)
     timestamp = models.DateTimeField(auto_now_add=True)
 
+    objects = UserSubscriptionManager()
+
     def __str__(self):
         return f"{self.user.username} - {self.subscription.name}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # What `user_sub_post_save` last reconciled the user's access for.
+        instance._saved_access = (instance.__dict__.get('subscription_id'), instance.__dict__.get('status'))
+        return instance
+
     def get_absolute_url(self):
         return reverse('user_subscription')
 
@@ -361,50 +370,111 @@ class UserSubscription(models.Model):
         except Exception as e:
             logger.error(f"Error canceling subscription for user {self.user.username}: {e}", exc_info=True)
 
+class StripeEvent(models.Model):
+    """
+    A Stripe webhook event, stored as received before it is processed.
+
+    Rows are only ever inserted by the webhook view; `tasks.process_stripe_events`
+    marks them processed. The unique `event_id` makes redelivered events a
+    no-op insert.
+
+    Attributes:
+        event_id (str): The Stripe event ID.
+        type (str): The event type, e.g. "customer.subscription.updated".
+        object_id (str): The Stripe ID of the object the event is about (the
+            subscription or customer). Events for one object are processed in
+            order, one at a time.
+        created (DateTimeField): When Stripe created the event.
+        payload (dict): The event as received.
+        received_at (DateTimeField): When the webhook was received.
+        processed_at (DateTimeField): When the event was processed, or None
+            while it is pending.
+        error (str): The error the last processing attempt failed with.
+    """
+    event_id = models.CharField(max_length=255, unique=True)
+    type = models.CharField(max_length=120)
+    object_id = models.CharField(max_length=255, blank=True)
+    created = models.DateTimeField()
+    payload = models.JSONField()
+    received_at = models.DateTimeField(default=timezone.now)
+    processed_at = models.DateTimeField(blank=True, null=True)
+    error = models.TextField(blank=True)
+
+    def __str__(self):
+        return f"{self.type} {self.event_id}"
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['object_id', 'created'],
+                condition=Q(processed_at__isnull=True),
+                name='stripe_event_pending_idx',
+            ),
+        ]
+
+def _reconcile(manager, wanted_ids, keep=lambda obj_id: False):
+    """
+    Makes the ids linked through the many-to-many `manager` equal to
+    `wanted_ids`, with one bulk INSERT and one bulk DELETE on the through
+    table. Ids for which `keep` is true are never removed.
+
+    Returns:
+        The `(added, removed)` id sets.
+    """
+    through = manager.through
+    source, target = f'{manager.source_field_name}_id', f'{manager.target_field_name}_id'
+    current_ids = set(through.objects.filter(**{source: manager.instance.pk}).values_list(target, flat=True))
+    added = wanted_ids - current_ids
+    removed = {obj_id for obj_id in current_ids - wanted_ids if not keep(obj_id)}
+    if added:
+        through.objects.bulk_create(
+            [through(**{source: manager.instance.pk, target: obj_id}) for obj_id in added],
+            ignore_conflicts=True,
+        )
+    if removed:
+        through.objects.filter(**{source: manager.instance.pk, f'{target}__in': removed}).delete()
+    return added, removed
+
 def user_sub_post_save(sender, instance, created, *args, **kwargs):
     """
     A post-save signal handler for the UserSubscription model.
 
     When a UserSubscription is created or updated, this function ensures that
     the user's group and permissions are updated to match the subscription.
+    The memberships are compared as sets of ids and written with one bulk
+    insert and one bulk delete per through table. Saves that change neither
+    the subscription nor the status skip the reconciliation entirely.
     """
     user_sub_obj = instance
-    if not user_sub_obj.is_active:
+    access = (user_sub_obj.subscription_id, user_sub_obj.status)
+    if not created and access == getattr(user_sub_obj, '_saved_access', None):
+        return
+    user_sub_obj._saved_access = access
+    if not user_sub_obj.is_active or user_sub_obj.subscription_id is None:
         return
     user = user_sub_obj.user
     sub_obj = user_sub_obj.subscription
-    
-    current_groups = list(user.groups.all())
-    current_permissions = list(user.user_permissions.all())
-    
-    sub_groups = list(sub_obj.groups.all())
-    sub_permissions = list(sub_obj.permissions.all())
-    
-    # Add user to subscription groups
-    for group in sub_groups:
-        if group not in current_groups:
-            user.groups.add(group)
-            logger.info(f"User {user.username} added to group {group.name}")
-    
-    # Remove user from groups not in subscription
-    for group in current_groups:
-        if group.name.lower() == "default":
-            continue
-        if group not in sub_groups:
-            user.groups.remove(group)
-            logger.info(f"User {user.username} removed from group {group.name}")
-            
-    # Add user permissions from subscription
-    for perm in sub_permissions:
-        if perm not in current_permissions:
-            user.user_permissions.add(perm)
-            logger.info(f"Permission {perm.codename} added to user {user.username}")
-            
-    # Remove user permissions not in subscription
-    for perm in current_permissions:
-        if perm not in sub_permissions:
-            user.user_permissions.remove(perm)
-            logger.info(f"Permission {perm.codename} removed from user {user.username}")
+
+    sub_groups = dict(sub_obj.groups.values_list('id', 'name'))
+    user_groups = dict(user.groups.values_list('id', 'name'))
+    added, removed = _reconcile(
+        user.groups, set(sub_groups),
+        # Users stay in the default group whatever their subscription.
+        keep=lambda group_id: user_groups.get(group_id, '').lower() == "default",
+    )
+    for group_id in added:
+        logger.info(f"User {user.username} added to group {sub_groups[group_id]}")
+    for group_id in removed:
+        logger.info(f"User {user.username} removed from group {user_groups[group_id]}")
+
+    sub_permissions = set(sub_obj.permissions.values_list('id', flat=True))
+    added, removed = _reconcile(user.user_permissions, sub_permissions)
+    if added or removed:
+        codenames = dict(Permission.objects.filter(id__in=added | removed).values_list('id', 'codename'))
+        for perm_id in added:
+            logger.info(f"Permission {codenames[perm_id]} added to user {user.username}")
+        for perm_id in removed:
+            logger.info(f"Permission {codenames[perm_id]} removed from user {user.username}")
 
 post_save.connect(user_sub_post_save, sender=UserSubscription)
 
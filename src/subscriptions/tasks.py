@@ -0,0 +1,153 @@
+"""
+This module contains the Celery tasks that process Stripe webhook events.
+"""
+import logging
+import helpers.billing
+import stripe
+from celery import shared_task
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+from customers.models import Customer
+from subscriptions.models import StripeEvent, SubscriptionPrice, UserSubscription
+
+logger = logging.getLogger(__name__)
+
+SUBSCRIPTION_EVENTS = (
+    "customer.subscription.created",
+    "customer.subscription.updated",
+    "customer.subscription.deleted",
+    "customer.subscription.paused",
+    "customer.subscription.resumed",
+)
+
+def event_object_id(data_object):
+    """
+    Returns the Stripe ID that orders an event: the subscription it concerns,
+    else its customer, else the event's own object.
+    """
+    if data_object.get("object") in ("subscription", "customer"):
+        return data_object.get("id", "")
+    return data_object.get("subscription") or data_object.get("customer") or data_object.get("id", "")
+
+def apply_subscription_event(data_object):
+    """
+    Updates the `UserSubscription` a subscription event concerns, found by its
+    Stripe ID or, for a new subscription, by the customer's Stripe ID.
+    """
+    sub = stripe.Subscription.construct_from(data_object, stripe.api_key)
+    user_sub_obj = UserSubscription.objects.filter(stripe_id=sub.id).first()
+    if user_sub_obj is None:
+        customer_obj = Customer.objects.filter(stripe_id=sub.get("customer")).select_related("user").first()
+        if customer_obj is None:
+            logger.warning(f"No customer found for Stripe subscription {sub.id}")
+            return
+        user_sub_obj, _ = UserSubscription.objects.get_or_create(user=customer_obj.user)
+        if user_sub_obj.stripe_id and sub.status not in ("active", "trialing"):
+            # An event about a subscription the user has since replaced.
+            logger.info(f"Ignoring Stripe subscription {sub.id}, user {customer_obj.user} has {user_sub_obj.stripe_id}")
+            return
+        user_sub_obj.stripe_id = sub.id
+    for k, v in helpers.billing.serialize_subscription_data(sub).items():
+        setattr(user_sub_obj, k, v)
+    plan = sub.get("plan")
+    if plan:
+        sub_price_obj = SubscriptionPrice.objects.filter(stripe_id=plan.id).select_related("subscription").first()
+        if sub_price_obj is not None:
+            user_sub_obj.subscription = sub_price_obj.subscription
+        else:
+            logger.warning(f"SubscriptionPrice with stripe_id {plan.id} not found for subscription {sub.id}")
+    user_sub_obj.save()
+    logger.info(f"Subscription {sub.id} updated from webhook: {sub.status}")
+
+def apply_customer_event(event_type, data_object):
+    """
+    Updates the `Customer` a customer event concerns.
+    """
+    if event_type == "customer.deleted":
+        # update() rather than save(): saving without a stripe_id would
+        # create a new Stripe customer.
+        cleared = Customer.objects.filter(stripe_id=data_object["id"]).update(stripe_id=None)
+        logger.info(f"Stripe customer {data_object['id']} deleted, {cleared} customers unlinked")
+
+def apply_event(event_type, payload):
+    """
+    Applies one event to the database. Event types that are not handled are
+    ignored.
+    """
+    data_object = payload["data"]["object"]
+    if event_type in SUBSCRIPTION_EVENTS:
+        apply_subscription_event(data_object)
+    elif event_type.startswith("customer.") and data_object.get("object") == "customer":
+        apply_customer_event(event_type, data_object)
+
+def process_pending_events(object_id):
+    """
+    Processes the pending events of one Stripe object, oldest first.
+
+    The pending rows are locked for the duration, so a concurrent task for the
+    same object waits and then finds nothing left to do. Events older than
+    one already processed for the object arrived out of order and are marked
+    processed without being applied, so they cannot roll the state back.
+
+    Returns:
+        The number of events processed.
+
+    Raises:
+        Exception: The error an event failed with. The events before it are
+            committed; it and the ones after it stay pending.
+    """
+    failure = None
+    done = []
+    with transaction.atomic():
+        pending = list(
+            StripeEvent.objects.select_for_update()
+            .filter(object_id=object_id, processed_at__isnull=True)
+            .order_by("created", "id")
+        )
+        latest = StripeEvent.objects.filter(
+            object_id=object_id, processed_at__isnull=False,
+        ).aggregate(latest=Max("created"))["latest"]
+        for event in pending:
+            if latest is not None and event.created < latest:
+                logger.info(f"Skipping out-of-order Stripe event {event.event_id} for {object_id}")
+            else:
+                try:
+                    with transaction.atomic():
+                        apply_event(event.type, event.payload)
+                except Exception as e:
+                    logger.error(f"Error processing Stripe event {event.event_id}: {e}", exc_info=True)
+                    StripeEvent.objects.filter(pk=event.pk).update(error=str(e))
+                    failure = e
+                    break
+                latest = event.created
+            done.append(event.pk)
+        if done:
+            StripeEvent.objects.filter(pk__in=done).update(processed_at=timezone.now(), error="")
+    if failure is not None:
+        raise failure
+    return len(done)
+
+@shared_task(bind=True, max_retries=5)
+def process_stripe_events(self, object_id):
+    """
+    Processes the pending webhook events of one Stripe object, retrying with
+    backoff if an event fails.
+    """
+    try:
+        return process_pending_events(object_id)
+    except Exception as e:
+        raise self.retry(exc=e, countdown=10 * 2 ** self.request.retries)
+
+@shared_task
+def process_pending_stripe_events():
+    """
+    Queues processing for every object with pending events, e.g. events whose
+    task could not be queued or ran out of retries.
+    """
+    object_ids = list(
+        StripeEvent.objects.filter(processed_at__isnull=True).values_list("object_id", flat=True).distinct()
+    )
+    for object_id in object_ids:
+        process_stripe_events.delay(object_id)
+    return len(object_ids)
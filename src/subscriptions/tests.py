@@ -1,10 +1,20 @@
 import datetime
+import hashlib
+import hmac
+import json
+import tempfile
+import time
+from pathlib import Path
+from django.core.management import call_command
 from django.test import TestCase
 from django.contrib.auth import get_user_model
 from django.urls import reverse
 from unittest.mock import patch, MagicMock
-from .models import UserSubscription, SubscriptionPrice, Subscription
-from django.contrib.auth.models import Group
+from customers.models import Customer
+from .models import StripeEvent, UserSubscription, SubscriptionPrice, Subscription
+from .tasks import process_pending_events
+from . import utils as subs_utils
+from django.contrib.auth.models import Group, Permission
 
 from hypothesis.extra.django import TestCase as HypothesisTestCase
 from hypothesis import given, strategies as st, settings
@@ -94,6 +104,304 @@ class SubscriptionViewsTest(TestCase):
         self.assertTemplateUsed(response, 'subscriptions/pricing.html')
         self.assertContains(response, 'Pro')
 
+class UserSubscriptionAccessTest(TestCase):
+    def setUp(self):
+        self.default = Group.objects.get_or_create(name='default')[0]
+        self.member = Group.objects.get_or_create(name='member')[0]
+        self.legacy = Group.objects.create(name='legacy')
+        self.user = User.objects.create_user(username='subscriber', password='password')
+        self.user.groups.add(self.default, self.legacy)
+        perms = Permission.objects.filter(content_type__app_label='subscriptions', codename__in=['pro', 'basic'])
+        self.pro, self.basic = perms.get(codename='pro'), perms.get(codename='basic')
+        self.user.user_permissions.add(self.basic)
+        with patch('helpers.billing.create_product', return_value='prod_123'):
+            self.subscription = Subscription.objects.create(name='Pro')
+            self.other = Subscription.objects.create(name='Basic')
+        self.subscription.groups.add(self.member)
+        self.subscription.permissions.add(self.pro)
+        self.other.permissions.add(self.basic)
+
+    def test_access_matches_the_subscription(self):
+        UserSubscription.objects.create(user=self.user, subscription=self.subscription, status='active')
+        self.assertCountEqual(self.user.groups.all(), [self.default, self.member])
+        self.assertCountEqual(self.user.user_permissions.all(), [self.pro])
+
+    def test_inactive_subscriptions_leave_access_alone(self):
+        UserSubscription.objects.create(user=self.user, subscription=self.subscription, status='past_due')
+        self.assertCountEqual(self.user.groups.all(), [self.default, self.legacy])
+
+    def test_unchanged_saves_skip_reconciliation(self):
+        UserSubscription.objects.create(user=self.user, subscription=self.subscription, status='active')
+        user_sub = UserSubscription.objects.get(user=self.user)
+        user_sub.cancel_at_period_end = True
+        with self.assertNumQueries(1):
+            user_sub.save()
+
+        user_sub.subscription = self.other
+        user_sub.save()
+        self.assertCountEqual(self.user.groups.all(), [self.default])
+        self.assertCountEqual(self.user.user_permissions.all(), [self.basic])
+        with self.assertNumQueries(1):
+            user_sub.save()
+
+class RefreshSubscriptionsTest(TestCase):
+    def setUp(self):
+        with patch('helpers.billing.create_product', return_value='prod_123'):
+            self.subscription = Subscription.objects.create(name='Pro')
+        self.period_end = datetime.datetime(2030, 1, 1, tzinfo=datetime.timezone.utc)
+        self.user_subs = [
+            UserSubscription.objects.create(
+                user=User.objects.create_user(username=f'user{i}', password='password'),
+                subscription=self.subscription, stripe_id=f'sub_{i}', status='active',
+                current_period_end=self.period_end,
+            )
+            for i in range(5)
+        ]
+
+    def stripe_data(self, stripe_id, raw=False):
+        return {
+            'status': 'past_due' if stripe_id == 'sub_1' else 'active',
+            'current_period_start': None,
+            'current_period_end': self.period_end,
+            'cancel_at_period_end': False,
+        }
+
+    @patch('helpers.billing.RateLimiter.wait')
+    @patch('helpers.billing.get_subscription')
+    def test_changed_fields_are_bulk_updated(self, mock_get, mock_wait):
+        mock_get.side_effect = self.stripe_data
+        checkpoints = []
+        done = subs_utils.refresh_active_users_subscriptions(
+            chunk_size=2, max_workers=3, on_checkpoint=lambda p: checkpoints.append((p.processed, p.last_pk)))
+        self.assertTrue(done)
+        self.assertEqual(mock_get.call_count, 5)
+        self.assertEqual(mock_wait.call_count, 5)
+        self.assertEqual([processed for processed, _ in checkpoints], [2, 4, 5])
+        self.assertEqual(checkpoints[-1][1], self.user_subs[-1].pk)
+        self.assertEqual(
+            list(UserSubscription.objects.order_by('pk').values_list('status', flat=True)),
+            ['active', 'past_due', 'active', 'active', 'active'],
+        )
+
+        # Nothing changed: no writes at all.
+        with self.assertNumQueries(2):
+            subs_utils.refresh_active_users_subscriptions(active_only=False, chunk_size=10)
+
+    @patch('helpers.billing.RateLimiter.wait')
+    @patch('helpers.billing.get_subscription')
+    def test_failures_are_counted_and_resume_skips_done_rows(self, mock_get, mock_wait):
+        def flaky(stripe_id, raw=False):
+            if stripe_id == 'sub_3':
+                raise RuntimeError('boom')
+            return self.stripe_data(stripe_id)
+        mock_get.side_effect = flaky
+        checkpoints = []
+        self.assertFalse(subs_utils.refresh_active_users_subscriptions(chunk_size=2, on_checkpoint=checkpoints.append))
+        progress = checkpoints[-1]
+        self.assertEqual((progress.failed, progress.failed_pks, progress.last_pk), (1, [self.user_subs[3].pk], self.user_subs[4].pk))
+
+        mock_get.reset_mock()
+        mock_get.side_effect = self.stripe_data
+        self.assertTrue(subs_utils.refresh_active_users_subscriptions(after_pk=self.user_subs[2].pk))
+        self.assertEqual([c.args[0] for c in mock_get.call_args_list], ['sub_3', 'sub_4'])
+
+        # Resuming after the last row still retries the failed one.
+        mock_get.reset_mock()
+        self.assertTrue(subs_utils.refresh_active_users_subscriptions(
+            after_pk=progress.last_pk, retry_pks=progress.failed_pks))
+        self.assertEqual([c.args[0] for c in mock_get.call_args_list], ['sub_3'])
+
+    @patch('helpers.billing.RateLimiter.wait')
+    @patch('helpers.billing.get_subscription')
+    def test_command_resumes_from_checkpoint(self, mock_get, mock_wait):
+        mock_get.side_effect = self.stripe_data
+        with tempfile.TemporaryDirectory() as tmp:
+            checkpoint = Path(tmp) / 'sync.json'
+            checkpoint.write_text(json.dumps({'last_pk': self.user_subs[3].pk, 'failed_pks': [self.user_subs[1].pk]}))
+            with patch('builtins.print'):
+                call_command('sync_user_subs', '--days-left=-1', '--days-ago=-1', '--day-start=-1',
+                             f'--checkpoint={checkpoint}', '--resume')
+            self.assertEqual([c.args[0] for c in mock_get.call_args_list], ['sub_1', 'sub_4'])
+            self.assertFalse(checkpoint.exists())
+
+    @patch('helpers.billing.RateLimiter.wait')
+    @patch('stripe.Subscription.list')
+    def test_snapshot_sync_pages_through_the_listing(self, mock_list, mock_wait):
+        def stripe_sub(stripe_id, status='active'):
+            return MagicMock(id=stripe_id, status=status, current_period_start=None,
+                             current_period_end=int(self.period_end.timestamp()), cancel_at_period_end=False)
+        mock_list.side_effect = [
+            MagicMock(data=[stripe_sub('sub_0'), stripe_sub('sub_1', 'past_due'), stripe_sub('sub_9')], has_more=True),
+            MagicMock(data=[stripe_sub('sub_2')], has_more=False),
+        ]
+        result = subs_utils.snapshot_sync_subscriptions(status='all', created_after=1700000000, chunk_size=2)
+        self.assertEqual(mock_list.call_count, 2)
+        self.assertEqual(mock_list.call_args_list[0].kwargs, {'limit': 100, 'status': 'all', 'created': {'gt': 1700000000}})
+        self.assertEqual(mock_list.call_args_list[1].kwargs['starting_after'], 'sub_9')
+        self.assertEqual((result.listed, result.matched, result.changed, result.unlisted), (4, 3, 1, 2))
+        self.assertEqual(result.unknown, ['sub_9'])
+        self.assertEqual(UserSubscription.objects.get(stripe_id='sub_1').status, 'past_due')
+
+class ClearDanglingSubsTest(TestCase):
+    def setUp(self):
+        user = User.objects.create_user(username='dangling', password='password')
+        Customer.objects.create(user=user, stripe_id='cus_ours')
+        UserSubscription.objects.create(user=user, stripe_id=' SUB_Known ')
+        created = int(time.time()) - 3600
+        self.listing = MagicMock(has_more=False, data=[
+            MagicMock(id='sub_known', customer='cus_ours', created=created),
+            MagicMock(id='sub_dangling', customer='cus_ours', created=created),
+            MagicMock(id='sub_failing', customer='cus_ours', created=created),
+            MagicMock(id='sub_foreign', customer='cus_someone_else', created=created),
+        ])
+
+    @patch('helpers.billing.RateLimiter.wait')
+    @patch('helpers.billing.cancel_subscription')
+    @patch('stripe.Subscription.list')
+    def test_dry_run_only_reports(self, mock_list, mock_cancel, mock_wait):
+        mock_list.return_value = self.listing
+        with self.assertNumQueries(2):
+            report = subs_utils.clear_dangling_subs(dry_run=True, verbose=False)
+        mock_list.assert_called_once_with(limit=100, status='active')
+        self.assertEqual(report.listed, 4)
+        self.assertEqual(report.dangling, [('sub_dangling', 'cus_ours'), ('sub_failing', 'cus_ours')])
+        mock_cancel.assert_not_called()
+
+    @patch('helpers.billing.RateLimiter.wait')
+    @patch('helpers.billing.cancel_subscription')
+    @patch('stripe.Subscription.list')
+    def test_dangling_subscriptions_are_canceled(self, mock_list, mock_cancel, mock_wait):
+        mock_list.return_value = self.listing
+        def cancel(stripe_id, **kwargs):
+            if stripe_id == 'sub_failing':
+                raise RuntimeError('boom')
+        mock_cancel.side_effect = cancel
+        report = subs_utils.clear_dangling_subs(max_workers=2, verbose=False)
+        self.assertCountEqual([c.args[0] for c in mock_cancel.call_args_list], ['sub_dangling', 'sub_failing'])
+        self.assertEqual(mock_cancel.call_args.kwargs['cancel_at_period_end'], False)
+        self.assertEqual(report.canceled, 1)
+        self.assertEqual(report.failed, [('sub_failing', 'boom')])
+
+    @patch('helpers.billing.RateLimiter.wait')
+    @patch('helpers.billing.cancel_subscription')
+    @patch('stripe.Subscription.list')
+    def test_subscriptions_created_during_the_run_are_kept(self, mock_list, mock_cancel, mock_wait):
+        user = User.objects.get(username='dangling')
+        self.listing.data.append(MagicMock(id='sub_new', customer='cus_ours', created=int(time.time()) + 60))
+
+        def listing(**kwargs):
+            # A checkout finishes while Stripe is being listed.
+            UserSubscription.objects.filter(user=user).update(stripe_id='sub_dangling')
+            return self.listing
+        mock_list.side_effect = listing
+        report = subs_utils.clear_dangling_subs(verbose=False)
+        self.assertEqual(report.listed, 5)
+        self.assertEqual(report.dangling, [('sub_failing', 'cus_ours')])
+        self.assertEqual([c.args[0] for c in mock_cancel.call_args_list], ['sub_failing'])
+
+WEBHOOK_SECRET = 'whsec_test_local'
+STRIPE_FIXTURES = Path(__file__).parent / 'stripe_fixtures'
+
+def stripe_fixture(name):
+    return (STRIPE_FIXTURES / f'{name}.json').read_text()
+
+def sign(payload, secret=WEBHOOK_SECRET, timestamp=None):
+    timestamp = timestamp or int(time.time())
+    signature = hmac.new(secret.encode(), f'{timestamp}.{payload}'.encode(), hashlib.sha256).hexdigest()
+    return f't={timestamp},v1={signature}'
+
+@patch('helpers.billing.STRIPE_WEBHOOK_SECRET', WEBHOOK_SECRET)
+class StripeWebhookTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='webhook', password='password')
+        Customer.objects.create(user=self.user, stripe_id='cus_QaWebhook0001')
+        with patch('helpers.billing.create_product', return_value='prod_123'):
+            self.subscription = Subscription.objects.create(name='Pro')
+        SubscriptionPrice.objects.create(subscription=self.subscription, stripe_id='price_1QaWebhookPro')
+
+    def post_event(self, payload, signature=None):
+        return self.client.post(
+            reverse('stripe_webhook'), payload, content_type='application/json',
+            HTTP_STRIPE_SIGNATURE=signature or sign(payload),
+        )
+
+    def test_unsigned_events_are_rejected(self):
+        payload = stripe_fixture('customer.subscription.updated')
+        response = self.post_event(payload, signature=sign(payload, secret='whsec_other'))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.post_event('not json', signature=sign('not json')).status_code, 400)
+        self.assertFalse(StripeEvent.objects.exists())
+
+    def test_events_are_refused_without_a_secret(self):
+        payload = stripe_fixture('customer.deleted')
+        with patch('helpers.billing.STRIPE_WEBHOOK_SECRET', ''):
+            response = self.post_event(payload, signature=sign(payload, secret=''))
+        self.assertEqual(response.status_code, 503)
+        self.assertFalse(StripeEvent.objects.exists())
+        self.assertTrue(Customer.objects.filter(stripe_id='cus_QaWebhook0001').exists())
+
+    def test_pending_events_are_swept_by_beat(self):
+        from celery import current_app
+        entry = current_app.conf.beat_schedule['process-pending-stripe-events']
+        self.assertEqual(entry['task'], 'subscriptions.tasks.process_pending_stripe_events')
+        self.assertIn('check-scheduled-triggers', current_app.conf.beat_schedule)
+
+    @patch('subscriptions.tasks.process_stripe_events.delay')
+    def test_events_are_stored_once_and_queued(self, mock_delay):
+        payload = stripe_fixture('customer.subscription.updated')
+        for _ in range(2):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.assertEqual(self.post_event(payload).status_code, 200)
+        event = StripeEvent.objects.get()
+        self.assertEqual((event.event_id, event.type, event.object_id), ('evt_1QaUpdated0001', 'customer.subscription.updated', 'sub_1QaWebhook0001'))
+        self.assertIsNone(event.processed_at)
+        mock_delay.assert_called_with('sub_1QaWebhook0001')
+
+    @patch('subscriptions.tasks.process_stripe_events.delay', side_effect=ConnectionError('broker down'))
+    def test_queue_failures_still_acknowledge(self, mock_delay):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.post_event(stripe_fixture('customer.subscription.updated'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(StripeEvent.objects.filter(processed_at__isnull=True).exists())
+
+    def store(self, *names):
+        with patch('subscriptions.tasks.process_stripe_events.delay'):
+            for name in names:
+                self.post_event(stripe_fixture(name))
+
+    def test_subscription_events_update_the_user_subscription(self):
+        self.store('customer.subscription.updated')
+        self.assertEqual(process_pending_events('sub_1QaWebhook0001'), 1)
+        user_sub = UserSubscription.objects.get(user=self.user)
+        self.assertEqual(user_sub.stripe_id, 'sub_1QaWebhook0001')
+        self.assertEqual(user_sub.subscription, self.subscription)
+        self.assertEqual(user_sub.status, 'active')
+        self.assertTrue(user_sub.cancel_at_period_end)
+        self.assertEqual(process_pending_events('sub_1QaWebhook0001'), 0)
+
+    def test_out_of_order_events_do_not_roll_back(self):
+        self.store('customer.subscription.deleted')
+        process_pending_events('sub_1QaWebhook0001')
+        self.store('customer.subscription.updated')
+        self.assertEqual(process_pending_events('sub_1QaWebhook0001'), 1)
+        self.assertEqual(UserSubscription.objects.get(user=self.user).status, 'canceled')
+        self.assertFalse(StripeEvent.objects.filter(processed_at__isnull=True).exists())
+
+    def test_failed_events_stay_pending_in_order(self):
+        self.store('customer.subscription.updated', 'customer.subscription.deleted')
+        with patch('subscriptions.tasks.apply_event', side_effect=RuntimeError('boom')):
+            with self.assertRaises(RuntimeError):
+                process_pending_events('sub_1QaWebhook0001')
+        self.assertEqual(StripeEvent.objects.filter(processed_at__isnull=True).count(), 2)
+        self.assertEqual(StripeEvent.objects.get(event_id='evt_1QaUpdated0001').error, 'boom')
+        self.assertEqual(process_pending_events('sub_1QaWebhook0001'), 2)
+        self.assertEqual(UserSubscription.objects.get(user=self.user).status, 'canceled')
+
+    def test_customer_deleted_unlinks_the_customer(self):
+        self.store('customer.deleted')
+        process_pending_events('cus_QaWebhook0001')
+        self.assertIsNone(Customer.objects.get(user=self.user).stripe_id)
+
 class SubscriptionHypothesisTest(HypothesisTestCase):
     @settings(deadline=None)
     @given(
@@ -1,13 +1,71 @@
 """
 This module contains the views for the subscriptions app.
 """
+import datetime
+import json
+import logging
 import helpers.billing
+import stripe
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
+from django.db import transaction
+from django.http import HttpResponse, HttpResponseBadRequest
 from django.shortcuts import render, redirect
 from django.urls import reverse
-from subscriptions.models import SubscriptionPrice, UserSubscription
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+from subscriptions.models import StripeEvent, SubscriptionPrice, UserSubscription
 from subscriptions import utils as subs_utils
+from subscriptions.tasks import event_object_id, process_stripe_events
+
+logger = logging.getLogger(__name__)
+
+def _queue_event_processing(object_id):
+    try:
+        process_stripe_events.delay(object_id)
+    except Exception as e:
+        # The event is stored; process_pending_stripe_events picks it up.
+        logger.error(f"Could not queue Stripe event processing for {object_id}: {e}")
+
+@csrf_exempt
+@require_POST
+def stripe_webhook_view(request):
+    """
+    Receives Stripe webhook events.
+
+    The signature is verified against `STRIPE_WEBHOOK_SECRET` and the event
+    is stored with a single insert, which is a no-op for a redelivered event.
+    Processing is queued to Celery (see `tasks.process_stripe_events`), so
+    Stripe gets its 200 straight away.
+
+    Args:
+        request: The HTTP request.
+
+    Returns:
+        An empty 200 response, a 400 if the event cannot be verified, or a
+        503 if `STRIPE_WEBHOOK_SECRET` is not set.
+    """
+    if not helpers.billing.STRIPE_WEBHOOK_SECRET:
+        logger.error("Rejected Stripe webhook: STRIPE_WEBHOOK_SECRET is not set")
+        return HttpResponse("Stripe webhooks are not configured", status=503)
+    try:
+        event = helpers.billing.construct_webhook_event(request.body, request.headers.get("Stripe-Signature", ""))
+    except (ValueError, stripe.SignatureVerificationError) as e:
+        logger.warning(f"Rejected Stripe webhook: {e}")
+        return HttpResponseBadRequest("Invalid Stripe webhook")
+    payload = json.loads(request.body)
+    object_id = event_object_id(payload["data"]["object"])
+    StripeEvent.objects.bulk_create([
+        StripeEvent(
+            event_id=payload["id"],
+            type=payload["type"],
+            object_id=object_id,
+            created=datetime.datetime.fromtimestamp(payload["created"], tz=datetime.timezone.utc),
+            payload=payload,
+        )
+    ], ignore_conflicts=True)
+    transaction.on_commit(lambda: _queue_event_processing(object_id))
+    return HttpResponse(status=200)
 
 # Create your views here.
 @login_required